@@ -0,0 +1,28 @@
+# Saas_GrapeIQ_V1.0/app/lazy.py
+
+# Importación diferida de módulos pesados (prophet, pandas, sklearn...).
+# lazy_import devuelve el módulo sin ejecutarlo; el código se carga la primera vez que se
+# accede a uno de sus atributos. Así los workers de la API arrancan rápido y los routers
+# ligeros no pagan el coste del stack científico.
+
+import sys
+import threading
+import importlib.util
+
+_lock = threading.Lock()
+
+
+def lazy_import(name: str):
+    """Módulo `name` con carga diferida. Si ya está importado, se devuelve tal cual."""
+    with _lock:
+        if name in sys.modules:
+            return sys.modules[name]
+        spec = importlib.util.find_spec(name)
+        if spec is None:
+            raise ImportError(f"No se encontró el módulo {name}")
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        loader.exec_module(module)
+        return module
@@ -3,6 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 
 # IMPORTA LAS FUNCIONES DE DATABASE Y LOS ROUTERS
 from .database import connect_to_db, close_db_connection
+from .migrations import apply_migrations
+from .services import forecast_jobs
 # Se añade el nuevo router 'products'
 from .routers import auth, data, forecast, weather, users, field_log, traceability, cellar_management, ingest, products, parcels, financials, sales, analytics, laboratory
 
@@ -15,9 +17,13 @@ app = FastAPI(
 @app.on_event("startup")
 def startup_event():
     connect_to_db()
+    apply_migrations()
+    if forecast_jobs.WARMUP:
+        forecast_jobs.warm_up_workers()
 
 @app.on_event("shutdown")
 def shutdown_event():
+    forecast_jobs.shutdown()
     close_db_connection()
 
 
@@ -36,6 +42,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cabeceras de paginación del catálogo, legibles desde el navegador
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Total-Estimate"],
 )
 
 @app.get("/", tags=["Root"])
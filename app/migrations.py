@@ -0,0 +1,271 @@
+# Saas_GrapeIQ_V1.0/app/migrations.py
+
+# Sentencias DDL idempotentes que la API aplica al arrancar, para que una base de datos
+# ya existente reciba las tablas e índices nuevos sin tener que regenerarla.
+# Las tablas se declaran también en app/models.py (usado por generador_datos.py).
+
+from .database import get_db_connection
+
+MIGRATIONS = [
+    # --- Cola de trabajos de pronóstico ---
+    """
+    CREATE TABLE IF NOT EXISTS forecast_jobs (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        status VARCHAR NOT NULL DEFAULT 'queued',
+        progress INTEGER NOT NULL DEFAULT 0,
+        params JSONB NOT NULL,
+        result JSONB,
+        error TEXT,
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        started_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_forecast_jobs_tenant_id ON forecast_jobs (tenant_id);",
+
+    # --- Pronósticos materializados (pronóstico masivo del catálogo) ---
+    """
+    CREATE TABLE IF NOT EXISTS forecasts (
+        id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        product_id UUID REFERENCES products(id) ON DELETE CASCADE,
+        series VARCHAR NOT NULL,
+        run_id UUID NOT NULL,
+        ds DATE NOT NULL,
+        yhat DOUBLE PRECISION NOT NULL,
+        yhat_lower DOUBLE PRECISION NOT NULL,
+        yhat_upper DOUBLE PRECISION NOT NULL,
+        trend DOUBLE PRECISION,
+        yearly DOUBLE PRECISION,
+        weekly DOUBLE PRECISION,
+        regressors DOUBLE PRECISION,
+        generated_at TIMESTAMPTZ DEFAULT NOW()
+    );
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_forecasts_tenant_series_ds ON forecasts (tenant_id, series, ds);",
+    # Marca de agua de los datos con los que se generó el pronóstico guardado de cada serie
+    """
+    CREATE TABLE IF NOT EXISTS forecast_watermarks (
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        series VARCHAR NOT NULL,
+        data_key VARCHAR NOT NULL,
+        periods INTEGER NOT NULL,
+        refreshed_at TIMESTAMPTZ DEFAULT NOW(),
+        PRIMARY KEY (tenant_id, series)
+    );
+    """,
+    # Política de selección de modelo de pronóstico por tenant
+    """
+    CREATE TABLE IF NOT EXISTS forecast_settings (
+        tenant_id UUID PRIMARY KEY REFERENCES tenants(id),
+        model_policy VARCHAR NOT NULL DEFAULT 'auto',
+        fallback_model VARCHAR NOT NULL DEFAULT 'exp_smoothing',
+        min_history_days INTEGER NOT NULL DEFAULT 365,
+        min_active_ratio DOUBLE PRECISION NOT NULL DEFAULT 0.5,
+        updated_at TIMESTAMPTZ DEFAULT NOW()
+    );
+    """,
+
+    # --- Precálculo nocturno de pronósticos ---
+    "ALTER TABLE forecasts ADD COLUMN IF NOT EXISTS model_version VARCHAR;",
+    "ALTER TABLE forecast_watermarks ADD COLUMN IF NOT EXISTS selection_reason VARCHAR;",
+    # Progreso de cada tenant en cada ejecución, para poder reanudar una ejecución interrumpida
+    """
+    CREATE TABLE IF NOT EXISTS forecast_precompute_runs (
+        run_date DATE NOT NULL,
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        status VARCHAR NOT NULL,
+        summary JSONB,
+        error TEXT,
+        started_at TIMESTAMPTZ DEFAULT NOW(),
+        finished_at TIMESTAMPTZ,
+        PRIMARY KEY (run_date, tenant_id)
+    );
+    """,
+
+    # --- Agregados de ventas para los cuadros de mando (ver app/services/sales_rollups.py) ---
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_daily (
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        sale_date DATE NOT NULL,
+        sale_count INTEGER NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        quantity BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, sale_date)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_monthly (
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        month DATE NOT NULL,
+        sale_count INTEGER NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        quantity BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, month)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_weekday (
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        weekday INTEGER NOT NULL,
+        sale_count INTEGER NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        quantity BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, weekday)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_products (
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        product_id UUID NOT NULL REFERENCES products(id),
+        line_count INTEGER NOT NULL DEFAULT 0,
+        quantity BIGINT NOT NULL DEFAULT 0,
+        revenue DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, product_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sales_rollup_customers (
+        tenant_id UUID NOT NULL REFERENCES tenants(id),
+        customer_name VARCHAR NOT NULL,
+        sale_count INTEGER NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, customer_name)
+    );
+    """,
+
+    # --- Marca de agua de cambios de sale_details (cubo de ventas en memoria) ---
+    # Al añadir la columna, las filas existentes reciben ya su número de secuencia
+    "CREATE SEQUENCE IF NOT EXISTS sale_details_change_seq;",
+    "ALTER TABLE sale_details ADD COLUMN IF NOT EXISTS change_seq BIGINT DEFAULT nextval('sale_details_change_seq');",
+    "CREATE INDEX IF NOT EXISTS ix_sale_details_tenant_change_seq ON sale_details (tenant_id, change_seq);",
+
+    # --- Filtros por periodo de la analítica (ver app/services/date_ranges.py) ---
+    "CREATE INDEX IF NOT EXISTS ix_sales_tenant_sale_date ON sales (tenant_id, sale_date);",
+
+    # --- Búsqueda y paginación del catálogo (ver app/services/catalog_search.py) ---
+    "CREATE INDEX IF NOT EXISTS ix_products_tenant_name_id ON products (tenant_id, name, id);",
+    "CREATE INDEX IF NOT EXISTS ix_products_tenant_lower_name ON products (tenant_id, lower(name) text_pattern_ops);",
+    "CREATE INDEX IF NOT EXISTS ix_products_tenant_lower_sku ON products (tenant_id, lower(sku) text_pattern_ops);",
+    # pg_trgm es opcional: sin la extensión (o sin permiso para crearla) no se crean los índices de trigramas
+    """
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'pg_trgm no disponible: la búsqueda del catálogo no usará índices de trigramas';
+    END $$;
+    """,
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+            CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS ix_products_sku_trgm ON products USING gin (sku gin_trgm_ops);
+        END IF;
+    END $$;
+    """,
+
+    # --- Resúmenes de costes precalculados (ver app/services/cost_summaries.py) ---
+    # Coste y producción por parcela
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS cost_summary_parcels AS
+    SELECT p.tenant_id, p.id AS parcel_id, p.name AS parcel_name, p.area_hectares,
+           COALESCE(pc.total_cost, 0) AS cost, COALESCE(pp.production_kg, 0) AS production_kg
+    FROM parcels p
+    LEFT JOIN (
+        SELECT tenant_id, related_parcel_id, SUM(amount) AS total_cost
+        FROM costs WHERE related_parcel_id IS NOT NULL
+        GROUP BY tenant_id, related_parcel_id
+    ) pc ON pc.related_parcel_id = p.id AND pc.tenant_id = p.tenant_id
+    LEFT JOIN (
+        SELECT tenant_id, origin_parcel_id, SUM(initial_grape_kg) AS production_kg
+        FROM wine_lots WHERE origin_parcel_id IS NOT NULL
+        GROUP BY tenant_id, origin_parcel_id
+    ) pp ON pp.origin_parcel_id = p.id AND pp.tenant_id = p.tenant_id;
+    """,
+    # REFRESH ... CONCURRENTLY necesita un índice único sobre columnas simples
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_cost_summary_parcels ON cost_summary_parcels (tenant_id, parcel_id);",
+    # Total de costes por categoría y tipo de coste
+    """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS cost_summary_categories AS
+    SELECT c.tenant_id, cp.category, c.cost_type, SUM(c.amount) AS total, COUNT(*) AS cost_count
+    FROM costs c
+    JOIN cost_parameters cp ON c.cost_type = cp.parameter_name AND c.tenant_id = cp.tenant_id
+    GROUP BY c.tenant_id, cp.category, c.cost_type;
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_cost_summary_categories ON cost_summary_categories (tenant_id, category, cost_type);",
+    # Versión de los datos de origen: cada sentencia que modifica las tablas de origen la incrementa.
+    # Es una fila de una tabla (no una secuencia) para que el incremento sea transaccional: solo es
+    # visible cuando se confirman las filas que lo provocaron.
+    """
+    CREATE TABLE IF NOT EXISTS summary_changes (
+        name VARCHAR PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0
+    );
+    """,
+    # Versión de los datos de origen incorporada en el último refresco
+    """
+    CREATE TABLE IF NOT EXISTS summary_refreshes (
+        name VARCHAR PRIMARY KEY,
+        version BIGINT NOT NULL DEFAULT 0,
+        refreshed_at TIMESTAMPTZ DEFAULT NOW()
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION mark_cost_summaries_stale() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO summary_changes AS c (name, version) VALUES ('cost_summaries', 1)
+        ON CONFLICT (name) DO UPDATE SET version = c.version + 1;
+        RETURN NULL;
+    END $$;
+    """,
+    # Triggers por sentencia (no por fila); en UPDATE solo cuentan las columnas que usan los resúmenes
+    """
+    DO $$
+    DECLARE
+        source RECORD;
+    BEGIN
+        FOR source IN SELECT * FROM (VALUES
+            ('costs', ''),
+            ('cost_parameters', ' OF parameter_name, category, tenant_id'),
+            ('wine_lots', ' OF initial_grape_kg, origin_parcel_id, tenant_id'),
+            ('parcels', ' OF name, area_hectares, tenant_id')
+        ) AS t(table_name, update_columns)
+        LOOP
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'trg_cost_summaries_stale' AND tgrelid = source.table_name::regclass
+            ) THEN
+                EXECUTE format(
+                    'CREATE TRIGGER trg_cost_summaries_stale AFTER INSERT OR UPDATE%s OR DELETE OR TRUNCATE ON %I '
+                    'FOR EACH STATEMENT EXECUTE FUNCTION mark_cost_summaries_stale()',
+                    source.update_columns, source.table_name
+                );
+            END IF;
+        END LOOP;
+    END $$;
+    """,
+
+    # --- Desglose de costes por producto (ver app/services/product_costs.py) ---
+    "CREATE INDEX IF NOT EXISTS ix_costs_tenant_related_lot_id ON costs (tenant_id, related_lot_id);",
+    "CREATE INDEX IF NOT EXISTS ix_costs_tenant_related_parcel_id ON costs (tenant_id, related_parcel_id);",
+]
+
+
+def apply_migrations():
+    """Aplica todas las sentencias de MIGRATIONS. Un fallo no impide arrancar la API."""
+    try:
+        with get_db_connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    for statement in MIGRATIONS:
+                        cur.execute(statement)
+                conn.commit()
+                print("Esquema de base de datos actualizado.")
+            except Exception:
+                conn.rollback()
+                raise
+    except Exception as e:
+        print(f"ERROR: No se pudieron aplicar las migraciones: {e}")
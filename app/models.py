@@ -1,6 +1,6 @@
 # Saas_GrapeIQ_V1.0/app/models.py
 
-from sqlalchemy import Column, Integer, String, Numeric, Date, Text, ForeignKey, DateTime, Boolean, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Numeric, Date, Text, ForeignKey, DateTime, Boolean, Float, Index, Sequence
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
@@ -208,9 +208,15 @@ class Cost(Base):
     amount = Column(Float, nullable=False)
     description = Column(Text)
     cost_date = Column(Date, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_costs_tenant_related_lot_id", "tenant_id", "related_lot_id"),
+        Index("ix_costs_tenant_related_parcel_id", "tenant_id", "related_parcel_id"),
+    )
 
 class Product(Base):
     __tablename__ = "products"
+    # Orden de la paginación por cursor del catálogo; los índices de búsqueda están en app/migrations.py
+    __table_args__ = (Index("ix_products_tenant_name_id", "tenant_id", "name", "id"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
     name = Column(String, nullable=False)
@@ -224,6 +230,8 @@ class Product(Base):
 
 class Sale(Base):
     __tablename__ = "sales"
+    # Filtros por periodo de la analítica: sale_date >= inicio AND sale_date < fin (ver services/date_ranges.py)
+    __table_args__ = (Index("ix_sales_tenant_sale_date", "tenant_id", "sale_date"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
     sale_date = Column(Date, default=datetime.utcnow)
@@ -235,8 +243,11 @@ class Sale(Base):
     avg_temperature = Column(Float, nullable=True)
     channel = Column(String, nullable=True)
 
+SALE_DETAILS_CHANGE_SEQ = Sequence("sale_details_change_seq")
+
 class SaleDetail(Base):
     __tablename__ = "sale_details"
+    __table_args__ = (Index("ix_sale_details_tenant_change_seq", "tenant_id", "change_seq"),)
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     sale_id = Column(UUID(as_uuid=True), ForeignKey("sales.id"), nullable=False)
     product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"), nullable=False)
@@ -244,4 +255,119 @@ class SaleDetail(Base):
     unit_price = Column(Float, nullable=False)
     tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
     on_promotion = Column(Boolean, default=False)
-    discount_percentage = Column(Float, default=0.0)
\ No newline at end of file
+    discount_percentage = Column(Float, default=0.0)
+    # Marca de agua de cambios: crece con cada línea insertada (refresco incremental del cubo de ventas)
+    change_seq = Column(BigInteger, SALE_DETAILS_CHANGE_SEQ, server_default=SALE_DETAILS_CHANGE_SEQ.next_value())
+
+# --- TABLAS DE PRONÓSTICO ---
+class ForecastJob(Base):
+    __tablename__ = "forecast_jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False, index=True)
+    status = Column(String, nullable=False, default='queued') # queued, running, completed, failed, cancelled
+    progress = Column(Integer, nullable=False, default=0) # 0-100
+    params = Column(JSONB, nullable=False)
+    result = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class Forecast(Base):
+    __tablename__ = "forecasts"
+    __table_args__ = (Index("ix_forecasts_tenant_series_ds", "tenant_id", "series", "ds"),)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id", ondelete="CASCADE"), nullable=True) # NULL para la serie 'total'
+    series = Column(String, nullable=False) # product_id o 'total'
+    run_id = Column(UUID(as_uuid=True), nullable=False)
+    ds = Column(Date, nullable=False)
+    yhat = Column(Float, nullable=False)
+    yhat_lower = Column(Float, nullable=False)
+    yhat_upper = Column(Float, nullable=False)
+    trend = Column(Float)
+    yearly = Column(Float)
+    weekly = Column(Float)
+    regressors = Column(Float)
+    model_version = Column(String) # Modelo y configuración, p. ej. 'prophet:1a2b3c4d5e6f'
+    generated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+class ForecastWatermark(Base):
+    __tablename__ = "forecast_watermarks"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    series = Column(String, primary_key=True)
+    data_key = Column(String, nullable=False) # Clave de caché (datos + hiperparámetros) del último pronóstico
+    periods = Column(Integer, nullable=False)
+    selection_reason = Column(String) # Motivo de la elección del modelo, se devuelve en los metadatos
+    refreshed_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+class ForecastSettings(Base):
+    __tablename__ = "forecast_settings"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    model_policy = Column(String, nullable=False, default='auto') # 'auto', 'prophet' o un modelo ligero
+    fallback_model = Column(String, nullable=False, default='exp_smoothing') # Modelo para series poco densas con 'auto'
+    min_history_days = Column(Integer, nullable=False, default=365)
+    min_active_ratio = Column(Float, nullable=False, default=0.5)
+    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+
+class ForecastPrecomputeRun(Base):
+    __tablename__ = "forecast_precompute_runs"
+    run_date = Column(Date, primary_key=True)
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    status = Column(String, nullable=False) # 'running', 'completed' o 'failed'
+    summary = Column(JSONB)
+    error = Column(Text)
+    started_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    finished_at = Column(DateTime(timezone=True))
+
+# --- AGREGADOS DE VENTAS (se mantienen en cada venta e ingesta; ver app/services/sales_rollups.py) ---
+class SalesRollupDaily(Base):
+    __tablename__ = "sales_rollup_daily"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    sale_date = Column(Date, primary_key=True)
+    sale_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    quantity = Column(BigInteger, nullable=False, default=0)
+
+class SalesRollupMonthly(Base):
+    __tablename__ = "sales_rollup_monthly"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    month = Column(Date, primary_key=True) # Primer día del mes
+    sale_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    quantity = Column(BigInteger, nullable=False, default=0)
+
+class SalesRollupWeekday(Base):
+    __tablename__ = "sales_rollup_weekday"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    weekday = Column(Integer, primary_key=True) # ISODOW: 1 = lunes ... 7 = domingo
+    sale_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+    quantity = Column(BigInteger, nullable=False, default=0)
+
+class SalesRollupProduct(Base):
+    __tablename__ = "sales_rollup_products"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id"), primary_key=True)
+    line_count = Column(Integer, nullable=False, default=0)
+    quantity = Column(BigInteger, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0) # SUM(quantity * unit_price)
+
+class SalesRollupCustomer(Base):
+    __tablename__ = "sales_rollup_customers"
+    tenant_id = Column(UUID(as_uuid=True), ForeignKey("tenants.id"), primary_key=True)
+    customer_name = Column(String, primary_key=True)
+    sale_count = Column(Integer, nullable=False, default=0)
+    total_amount = Column(Float, nullable=False, default=0)
+
+# --- RESÚMENES DE COSTES (vistas materializadas creadas en app/migrations.py; ver app/services/cost_summaries.py) ---
+class SummaryChange(Base):
+    __tablename__ = "summary_changes"
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0) # La incrementan los triggers de las tablas de origen
+
+class SummaryRefresh(Base):
+    __tablename__ = "summary_refreshes"
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0) # Versión de summary_changes incorporada en el último refresco
+    refreshed_at = Column(DateTime(timezone=True), default=datetime.utcnow)
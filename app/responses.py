@@ -0,0 +1,129 @@
+# Saas_GrapeIQ_V1.0/app/responses.py
+
+# Respuestas JSON rápidas para los endpoints que devuelven muchos datos.
+# Serializan directamente arrays de numpy, Decimal y fechas en una sola pasada, sin pasar por la
+# validación de pydantic. Usa orjson si está instalado y, si no, el módulo json estándar.
+# Para resultados sin límite de filas, stream_query() envía el array JSON por bloques leídos de un
+# cursor de servidor, sin cargar todas las filas en memoria.
+
+import json
+import uuid
+import threading
+from contextlib import ExitStack
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from .database import get_db_connection
+from .lazy import lazy_import
+
+try:
+    import orjson
+except ImportError: # pragma: no cover - dependencia opcional
+    orjson = None
+
+# numpy solo se carga si el codificador estándar se encuentra con un tipo que no conoce
+np = lazy_import("numpy")
+
+
+# Filas por bloque al recorrer un cursor de servidor
+STREAM_BATCH_SIZE = 2000
+
+
+def _default(value: Any):
+    """Tipos que el codificador no sabe serializar (orjson ya trata fechas y UUID)."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que acepta arrays de numpy y usa el codificador más rápido disponible."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def rows_as_dicts(columns: Sequence[str], rows: Sequence[Sequence]) -> List[Dict]:
+    """Filas de un cursor de tuplas como lista de diccionarios columna -> valor."""
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def cursor_response(cur) -> "FastJSONResponse":
+    """Resultado completo de un cursor de tuplas como array JSON de objetos, codificado en una pasada.
+    Para resultados acotados; los que no tienen límite de filas deben usar stream_query()."""
+    return FastJSONResponse(rows_as_dicts([desc[0] for desc in cur.description], cur.fetchall()))
+
+
+class _QueryStream:
+    """Filas de un cursor de servidor como trozos de un array JSON. La conexión se libera con close(),
+    que llaman tanto el propio recorrido al terminar como la tarea de fondo de la respuesta: así se
+    devuelve al pool aunque el cliente se desconecte antes de empezar o el cuerpo no llegue a leerse."""
+
+    def __init__(self, stack: ExitStack, cur, columns: List[str], first_batch: List, batch_size: int):
+        self._stack, self._cur, self._columns = stack, cur, columns
+        self._first_batch, self._batch_size = first_batch, batch_size
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _fetch(self) -> List:
+        with self._lock:
+            return [] if self._closed else self._cur.fetchmany(self._batch_size)
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            yield b"["
+            batch, separator = self._first_batch, b""
+            while batch:
+                # Un bloque de filas se codifica de una vez: "[a,b,c]" sin corchetes es "a,b,c"
+                yield separator + dumps(rows_as_dicts(self._columns, batch))[1:-1]
+                separator = b","
+                batch = self._fetch()
+            yield b"]"
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed: return
+            self._closed = True
+        self._stack.close()
+
+
+def stream_query(query: str, params: Optional[Sequence] = None, batch_size: int = STREAM_BATCH_SIZE) -> StreamingResponse:
+    """Ejecuta la consulta en un cursor de servidor y devuelve sus filas como array JSON de objetos,
+    enviado por bloques de `batch_size` filas. La respuesta usa su propia conexión del pool, que se
+    devuelve al terminar el envío (o al cortarse). Los errores de la consulta se lanzan aquí, antes
+    de empezar a responder, para que el endpoint los convierta en un error HTTP."""
+    stack = ExitStack()
+    try:
+        conn = stack.enter_context(get_db_connection())
+        # Al cerrar: primero el cursor, luego fin de la transacción del cursor con nombre
+        stack.callback(conn.rollback)
+        cur = stack.enter_context(conn.cursor(name=f"stream_{uuid.uuid4().hex}"))
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        first_batch = cur.fetchmany(batch_size)
+        columns = [desc[0] for desc in cur.description]
+    except Exception:
+        stack.close()
+        raise
+    stream = _QueryStream(stack, cur, columns, first_batch, batch_size)
+    return StreamingResponse(iter(stream), media_type="application/json", background=BackgroundTask(stream.close))
@@ -4,17 +4,22 @@ from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import Optional, List
 import uuid
 from collections import defaultdict
-import random
-import pandas as pd
-from sklearn.linear_model import LinearRegression
-import numpy as np
 
 # Importamos las dependencias necesarias de nuestro proyecto
-from ..services import security
+from ..services import security, analytics_cache, dashboard_bundle, kpi_metrics, sales_cube, catalog_search, date_ranges, cost_summaries, product_costs
 from ..database import get_db_connection
 from .. import schemas
+from ..lazy import lazy_import
+from ..responses import FastJSONResponse
+from fastapi.responses import Response
 from psycopg2.extras import RealDictCursor
 
+# El optimizador de catálogo usa numpy: se carga con la primera petición
+price_optimizer = lazy_import("app.services.price_optimizer")
+
+# Rejilla de simulación del optimizador por producto: (desde, hasta) x precio mediano, nº de puntos
+LEGACY_PRICE_GRID = (0.75, 1.25, 30)
+
 # --- Configuración ---
 router = APIRouter(
     prefix="/api/analytics",
@@ -36,6 +41,18 @@ def optimize_product_price(product_id: uuid.UUID, current_user: schemas.User = D
     """
     try:
         with get_db_connection() as conn:
+            # 0. Resultado en caché si las ventas del producto no han cambiado (no carga pandas ni sklearn)
+            watermark = analytics_cache.sales_watermark(conn, current_user.tenant_id, [str(product_id)])
+            cache_key = (str(current_user.tenant_id), str(product_id), watermark, LEGACY_PRICE_GRID)
+            cached = analytics_cache.price_results.get(cache_key)
+            if cached is not None:
+                return cached
+
+            # pandas y sklearn solo se cargan si hay que recalcular, no al arrancar la API
+            import numpy as np
+            import pandas as pd
+            from sklearn.linear_model import LinearRegression
+
             # 1. Obtener datos históricos de precio y cantidad para el producto
             df = pd.read_sql(query, conn, params=(str(current_user.tenant_id), str(product_id)))
             
@@ -56,7 +73,8 @@ def optimize_product_price(product_id: uuid.UUID, current_user: schemas.User = D
 
             # 3. Simular un rango de precios
             current_price = float(df['unit_price'].median())
-            price_range = np.linspace(current_price * 0.75, current_price * 1.25, 30).reshape(-1, 1)
+            low, high, points = LEGACY_PRICE_GRID
+            price_range = np.linspace(current_price * low, current_price * high, points).reshape(-1, 1)
 
             # 4. Predecir la demanda para cada precio
             predicted_demand = model.predict(price_range).round()
@@ -70,11 +88,13 @@ def optimize_product_price(product_id: uuid.UUID, current_user: schemas.User = D
 
             optimal = max(simulation_results, key=lambda x: x['revenue'])
 
-            return {
+            result = {
                 "base_price": current_price,
                 "optimal_point": optimal,
                 "simulation_data": simulation_results
             }
+            analytics_cache.price_results.set(cache_key, result)
+            return result
 
     except HTTPException as e:
         raise e
@@ -82,57 +102,135 @@ def optimize_product_price(product_id: uuid.UUID, current_user: schemas.User = D
         raise HTTPException(status_code=500, detail=f"Error de análisis: {e}")
 
 
-# --- Resto de endpoints de analytics.py (sin cambios) ---
+@router.get("/optimize-prices")
+def optimize_catalog_prices(
+    objective: str = Query("revenue", pattern="^(revenue|profit)$", description="Qué maximizar: 'revenue' (ingresos) o 'profit' (margen, usa el coste unitario)."),
+    include_grid: bool = Query(False, description="Incluye la simulación completa de la rejilla de precios de cada producto."),
+    product_ids: Optional[List[uuid.UUID]] = Query(None, description="Limita el análisis a estos productos. Por defecto, todo el catálogo."),
+    current_user: schemas.User = Depends(security.get_current_active_user)
+):
+    """
+    Precio óptimo de todos los productos en una sola llamada: elasticidad log-log por producto
+    ajustada de forma agrupada y rejilla de precios evaluada como una matriz.
+    """
+    try:
+        with get_db_connection() as conn:
+            selected = sorted({str(pid) for pid in product_ids}) if product_ids else None
+            watermark = analytics_cache.sales_watermark(conn, current_user.tenant_id, selected)
+            cache_key = (str(current_user.tenant_id), analytics_cache.CATALOG_SCOPE, watermark, objective, include_grid, tuple(selected or ()))
+            result = analytics_cache.price_results.get(cache_key)
+            if result is None:
+                rows = price_optimizer.load_price_data(conn, current_user.tenant_id, selected)
+                result = price_optimizer.optimize_catalog(rows, objective, include_grid)
+                analytics_cache.price_results.set(cache_key, result)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error de análisis: {e}")
+    return FastJSONResponse(result)
 
-@router.get("/kpis-summary")
-def get_kpis_summary(current_user: schemas.User = Depends(security.get_current_active_user)):
+
+@router.get("/dashboard-bundle")
+def get_dashboard_bundle(
+    fields: Optional[str] = Query(None, description=f"Secciones separadas por comas. Por defecto, todas: {', '.join(dashboard_bundle.SECTIONS)}."),
+    limit: int = Query(10, ge=1, le=100, description="Productos en los rankings de beneficio y unidades."),
+    matrix_limit: int = Query(7, ge=1, le=100, description="Productos en la matriz de rendimiento."),
+    current_user: schemas.User = Depends(security.get_current_active_user)
+):
+    """
+    Datos del cuadro de mando de analítica en una sola petición y una sola consulta.
+    """
+    selected = [field.strip() for field in fields.split(',') if field.strip()] if fields else list(dashboard_bundle.SECTIONS)
+    unknown = set(selected) - set(dashboard_bundle.SECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Secciones desconocidas: {', '.join(sorted(unknown))}")
+    try:
+        with get_db_connection() as conn:
+            payload = dashboard_bundle.build_bundle(conn, current_user.tenant_id, selected, limit, matrix_limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error de BBDD en dashboard-bundle: {e}")
+    # PostgreSQL ya devuelve el JSON serializado: se envía sin decodificarlo
+    return Response(content=payload, media_type="application/json")
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in value.split(',') if item.strip()] if value else []
+
+
+@router.get("/cube")
+def get_sales_cube_slice(
+    group_by: str = Query("product", description=f"Dimensiones separadas por comas: {', '.join(sales_cube.DIMENSIONS)}."),
+    month: Optional[str] = Query(None, description="Filtra por meses (AAAA-MM), separados por comas."),
+    channel: Optional[str] = Query(None, description="Filtra por canales, separados por comas."),
+    weekday: Optional[str] = Query(None, description="Filtra por días de la semana ISO (1 = lunes ... 7 = domingo), separados por comas."),
+    product_ids: Optional[List[uuid.UUID]] = Query(None, description="Filtra por productos."),
+    quarter: Optional[str] = Query(None, description="Limita a un trimestre (AAAA-Qn)."),
+    year: Optional[str] = Query(None, description="Limita a un año (AAAA)."),
+    sort: str = Query("revenue", pattern="^(quantity|revenue|lines)$", description="Medida por la que ordenar (de mayor a menor)."),
+    limit: Optional[int] = Query(None, ge=1, description="Número máximo de filas."),
+    current_user: schemas.User = Depends(security.get_current_active_user)
+):
     """
-    Calcula los KPIs principales directamente desde la base de datos para el tenant actual.
+    Unidades, ingresos y líneas de venta agrupadas por cualquier combinación de producto, mes,
+    día de la semana y canal, calculadas sobre el cubo de ventas en memoria del tenant.
     """
-    kpis_query = """
-    SELECT
-        COALESCE(SUM(s.total_amount), 0) AS "TotalSale",
-        COALESCE(SUM(sd.quantity), 0) AS "Quantity",
-        COALESCE(COUNT(DISTINCT s.customer_name), 0) AS "UniqueCustomers",
-        COALESCE(AVG(s.total_amount), 0) AS "AverageSaleValue"
-    FROM sales s
-    LEFT JOIN sale_details sd ON s.id = sd.sale_id
-    WHERE s.tenant_id = %s;
+    dimensions = _split(group_by)
+    filters = {'month': _split(month), 'channel': _split(channel), 'weekday': _split(weekday), 'product': [str(pid) for pid in product_ids or []]}
+    try:
+        period = date_ranges.resolve_period(quarter=quarter, year=year)
+        with get_db_connection() as conn:
+            cube = sales_cube.get_cube(conn, current_user.tenant_id)
+        rows = sales_cube.slice_rows(cube, dimensions, filters, sort, limit, period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error de análisis en cube: {e}")
+    return FastJSONResponse(rows)
+
+
+@router.get("/channel-mix")
+def get_channel_mix(
+    month: Optional[str] = Query(None, description="Limita el reparto a estos meses (AAAA-MM), separados por comas."),
+    quarter: Optional[str] = Query(None, description="Limita el reparto a un trimestre (AAAA-Qn)."),
+    year: Optional[str] = Query(None, description="Limita el reparto a un año (AAAA)."),
+    current_user: schemas.User = Depends(security.get_current_active_user)
+):
     """
-    
-    profit_query = """
-    SELECT
-        COALESCE(SUM(sd.quantity * (sd.unit_price - p.unit_cost)), 0) as "Profit"
-    FROM sale_details sd
-    JOIN products p ON sd.product_id = p.id
-    WHERE sd.tenant_id = %s;
+    Reparto de las ventas por canal: unidades, ingresos y porcentaje de los ingresos.
     """
-    
     try:
+        period = date_ranges.resolve_period(quarter=quarter, year=year)
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                tenant_id_str = str(current_user.tenant_id)
-                cur.execute(kpis_query, (tenant_id_str,))
-                kpis = cur.fetchone()
+            cube = sales_cube.get_cube(conn, current_user.tenant_id)
+        rows = sales_cube.slice_rows(cube, ['channel'], {'month': _split(month)}, period=period)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error de análisis en channel-mix: {e}")
+    total = sum(row['revenue'] for row in rows)
+    for row in rows:
+        row['share_pct'] = round(row['revenue'] / total * 100, 2) if total else 0.0
+    return FastJSONResponse(rows)
 
-                cur.execute(profit_query, (tenant_id_str,))
-                profit_result = cur.fetchone()
-                kpis['Profit'] = profit_result['Profit'] if profit_result else 0
-                
-                kpis['MonthOverMonthChange'] = random.uniform(-5.0, 15.0)
 
-                return kpis
+# --- Resto de endpoints de analytics.py (sin cambios) ---
+
+@router.get("/kpis-summary")
+def get_kpis_summary(current_user: schemas.User = Depends(security.get_current_active_user)):
+    """
+    KPIs principales del tenant: totales, mes en curso frente al anterior y variación mensual.
+    """
+    try:
+        with get_db_connection() as conn:
+            return kpi_metrics.get_kpis(conn, current_user.tenant_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de base de datos en KPIs: {e}")
 
 @router.get("/monthly-sales")
 def get_monthly_sales(current_user: schemas.User = Depends(security.get_current_active_user)):
     query = """
-    SELECT TO_CHAR(sale_date, 'YYYY-MM') as "Month", SUM(total_amount) as "TotalSale"
-    FROM sales
+    SELECT TO_CHAR(month, 'YYYY-MM') as "Month", total_amount as "TotalSale"
+    FROM sales_rollup_monthly
     WHERE tenant_id = %s
-    GROUP BY "Month"
-    ORDER BY "Month";
+    ORDER BY month;
     """
     try:
         with get_db_connection() as conn:
@@ -145,10 +243,10 @@ def get_monthly_sales(current_user: schemas.User = Depends(security.get_current_
 @router.get("/top-profitable-products")
 def get_top_profitable_products(limit: int = 10, current_user: schemas.User = Depends(security.get_current_active_user)):
     query = """
-    SELECT p.name AS "ProductName", SUM(sd.quantity * (sd.unit_price - p.unit_cost)) AS "Profit"
-    FROM sale_details sd
-    JOIN products p ON sd.product_id = p.id
-    WHERE sd.tenant_id = %s
+    SELECT p.name AS "ProductName", SUM(r.revenue - r.quantity * p.unit_cost) AS "Profit"
+    FROM sales_rollup_products r
+    JOIN products p ON r.product_id = p.id
+    WHERE r.tenant_id = %s
     GROUP BY p.name
     ORDER BY "Profit" DESC
     LIMIT %s;
@@ -164,10 +262,10 @@ def get_top_profitable_products(limit: int = 10, current_user: schemas.User = De
 @router.get("/top-units-products")
 def get_top_units_products(limit: int = 10, current_user: schemas.User = Depends(security.get_current_active_user)):
     query = """
-    SELECT p.name AS "ProductName", p.sku as "SKU", SUM(sd.quantity) AS "Quantity"
-    FROM sale_details sd
-    JOIN products p ON sd.product_id = p.id
-    WHERE sd.tenant_id = %s
+    SELECT p.name AS "ProductName", p.sku as "SKU", SUM(r.quantity) AS "Quantity"
+    FROM sales_rollup_products r
+    JOIN products p ON r.product_id = p.id
+    WHERE r.tenant_id = %s
     GROUP BY p.name, p.sku
     ORDER BY "Quantity" DESC
     LIMIT %s;
@@ -183,11 +281,10 @@ def get_top_units_products(limit: int = 10, current_user: schemas.User = Depends
 @router.get("/sales-by-weekday")
 def get_sales_by_weekday(current_user: schemas.User = Depends(security.get_current_active_user)):
     query = """
-    SELECT EXTRACT(ISODOW FROM sale_date) as weekday_num, SUM(total_amount) as total_sales
-    FROM sales
+    SELECT weekday as weekday_num, total_amount as total_sales
+    FROM sales_rollup_weekday
     WHERE tenant_id = %s
-    GROUP BY weekday_num
-    ORDER BY weekday_num;
+    ORDER BY weekday;
     """
     try:
         with get_db_connection() as conn:
@@ -202,11 +299,11 @@ def get_product_performance_matrix(limit: int = 7, current_user: schemas.User =
     query = """
     SELECT 
         p.name AS "ProductName",
-        SUM(sd.quantity) AS "Quantity",
-        SUM(sd.quantity * (sd.unit_price - p.unit_cost)) AS "Profit"
-    FROM sale_details sd
-    JOIN products p ON sd.product_id = p.id
-    WHERE sd.tenant_id = %s
+        SUM(r.quantity) AS "Quantity",
+        SUM(r.revenue - r.quantity * p.unit_cost) AS "Profit"
+    FROM sales_rollup_products r
+    JOIN products p ON r.product_id = p.id
+    WHERE r.tenant_id = %s
     GROUP BY p.name
     ORDER BY "Profit" DESC
     LIMIT %s;
@@ -221,7 +318,7 @@ def get_product_performance_matrix(limit: int = 7, current_user: schemas.User =
 
 @router.get("/available-months")
 def get_available_months(current_user: schemas.User = Depends(security.get_current_active_user)):
-    query = "SELECT DISTINCT TO_CHAR(sale_date, 'YYYY-MM') as month FROM sales WHERE tenant_id = %s ORDER BY month DESC;"
+    query = "SELECT TO_CHAR(month, 'YYYY-MM') as month FROM sales_rollup_monthly WHERE tenant_id = %s ORDER BY month DESC;"
     try:
         with get_db_connection() as conn:
             with conn.cursor() as cur:
@@ -231,108 +328,114 @@ def get_available_months(current_user: schemas.User = Depends(security.get_curre
         raise HTTPException(status_code=500, detail=f"Error de BBDD en available-months: {e}")
 
 @router.get("/sales/by_sku/{sku}")
-def get_sales_by_sku(sku: str, month: Optional[str] = Query(None), current_user: schemas.User = Depends(security.get_current_active_user)):
-    base_query = """
-        SELECT p.name as product_name, SUM(s.total_amount) as total_sales
-        FROM sales s
-        JOIN sale_details sd ON s.id = sd.sale_id
+def get_sales_by_sku(
+    sku: str,
+    month: Optional[str] = Query(None, description="Mes (AAAA-MM)."),
+    quarter: Optional[str] = Query(None, description="Trimestre (AAAA-Qn)."),
+    year: Optional[str] = Query(None, description="Año (AAAA)."),
+    current_user: schemas.User = Depends(security.get_current_active_user)
+):
+    """
+    Ingresos (SUM(cantidad x precio) de sus líneas de venta) y unidades de un SKU, opcionalmente en un periodo.
+    """
+    try:
+        period = date_ranges.resolve_period(month, quarter, year)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    date_filter, date_params = date_ranges.range_clause("s.sale_date", period)
+    query = f"""
+        SELECT p.name as product_name, SUM(sd.quantity * sd.unit_price) as total_sales, SUM(sd.quantity) as total_units
+        FROM sale_details sd
         JOIN products p ON sd.product_id = p.id
-        WHERE p.tenant_id = %s AND p.sku ILIKE %s
+        JOIN sales s ON s.id = sd.sale_id
+        WHERE p.tenant_id = %s AND p.sku ILIKE %s AND s.tenant_id = %s{date_filter}
+        GROUP BY p.name;
     """
-    params = [str(current_user.tenant_id), sku]
-
-    if month:
-        base_query += " AND TO_CHAR(s.sale_date, 'YYYY-MM') = %s"
-        params.append(month)
-    
-    base_query += " GROUP BY p.name;"
+    tenant_id_str = str(current_user.tenant_id)
+    params = [tenant_id_str, sku, tenant_id_str, *date_params]
 
     try:
         with get_db_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(base_query, params)
+                cur.execute(query, params)
                 result = cur.fetchone()
                 if not result:
-                    raise HTTPException(status_code=404, detail="SKU no encontrado o sin ventas para el mes especificado.")
+                    raise HTTPException(status_code=404, detail="SKU no encontrado o sin ventas en el periodo especificado.")
                 return result
+    except HTTPException as e:
+        raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de BBDD en sales/by_sku: {e}")
 
 
 @router.get("/product-catalog")
 def get_product_catalog(
-    limit: int = 10,
-    offset: int = 0,
+    response: Response,
+    limit: int = Query(10, ge=1, le=1000),
+    offset: int = Query(0, ge=0, description="Obsoleto: usa `cursor`. Solo se aplica si no se envía cursor."),
     sku: str = "",
+    q: Optional[str] = Query(None, description="Busca en nombre y SKU."),
+    cursor: Optional[str] = Query(None, description="Cursor de la cabecera X-Next-Cursor de la página anterior."),
+    count: str = Query("none", pattern="^(none|estimate|exact)$", description="Total en la cabecera X-Total-Estimate (estimado) o X-Total-Count (exacto)."),
     current_user: schemas.User = Depends(security.get_current_active_user)
 ):
     """
-    Devuelve el catálogo de productos directamente desde la base de datos, paginado y filtrado.
+    Devuelve el catálogo de productos directamente desde la base de datos, paginado por cursor y filtrado.
     """
-    base_query = """
-        SELECT 
+    select_sql = """
             id as "id",
             name AS "ProductName",
             sku AS "SKU",
             price AS "UnitPrice",
             unit_cost AS "UnitCost",
             stock_units AS "Stock"
-        FROM products
-        WHERE tenant_id = %s
     """
-    params = [str(current_user.tenant_id)]
-
-    if sku:
-        base_query += " AND sku ILIKE %s"
-        params.append(f"%{sku}%")
-
-    base_query += " ORDER BY \"ProductName\" LIMIT %s OFFSET %s"
-    params.extend([limit, offset])
-
     try:
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(base_query, params)
-                return cur.fetchall()
+            rows, next_cursor, total = catalog_search.search_products(conn, current_user.tenant_id, select_sql, q, sku, limit, cursor, offset, count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de BBDD en product-catalog: {e}")
+    catalog_search.set_pagination_headers(response, next_cursor, total, count)
+    return rows
 
 
 # --- ENDPOINTS ESTRATÉGICOS (YA USABAN LA BBDD, SE CONSERVAN) ---
 
 @router.get("/parcel-performance")
 def get_parcel_performance_metrics(current_user: schemas.User = Depends(security.get_current_active_user)):
-    # Esta función ya era correcta
+    # Lee el resumen precalculado por parcela (ver services/cost_summaries.py)
     query = """
-    WITH ParcelCosts AS (SELECT related_parcel_id, SUM(amount) as total_cost FROM costs WHERE related_parcel_id IS NOT NULL AND tenant_id = %s GROUP BY related_parcel_id),
-    ParcelProduction AS (SELECT origin_parcel_id, SUM(initial_grape_kg) as total_production_kg FROM wine_lots WHERE origin_parcel_id IS NOT NULL AND tenant_id = %s GROUP BY origin_parcel_id)
-    SELECT p.id, p.name, p.area_hectares, COALESCE(pc.total_cost, 0) as cost, COALESCE(pp.total_production_kg, 0) as production_kg
-    FROM parcels p LEFT JOIN ParcelCosts pc ON p.id = pc.related_parcel_id LEFT JOIN ParcelProduction pp ON p.id = pp.origin_parcel_id
-    WHERE p.tenant_id = %s;
+    SELECT parcel_name, area_hectares, cost, production_kg
+    FROM cost_summary_parcels
+    WHERE tenant_id = %s
+    ORDER BY parcel_name;
     """
     try:
         with get_db_connection() as conn:
+            cost_summaries.ensure_fresh(conn)
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                tenant_id_str = str(current_user.tenant_id)
-                cur.execute(query, (tenant_id_str, tenant_id_str, tenant_id_str))
+                cur.execute(query, (str(current_user.tenant_id),))
                 results = []
                 for rec in cur.fetchall():
                     area = float(rec['area_hectares'] or 1.0); cost = float(rec['cost']); prod_kg = float(rec['production_kg'])
-                    results.append({ "parcel_name": rec['name'], "cost_per_ha": cost / area if area > 0 else 0, "prod_per_ha": prod_kg / area if area > 0 else 0, "cost_per_kg": cost / prod_kg if prod_kg > 0 else 0 })
+                    results.append({ "parcel_name": rec['parcel_name'], "cost_per_ha": cost / area if area > 0 else 0, "prod_per_ha": prod_kg / area if area > 0 else 0, "cost_per_kg": cost / prod_kg if prod_kg > 0 else 0 })
                 return results
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de base de datos en parcel-performance: {e}")
 
 @router.get("/cost-breakdown", response_model=List[schemas.SunburstCategory])
 def get_cost_breakdown(current_user: schemas.User = Depends(security.get_current_active_user)):
-    # Esta función ya era correcta
+    # Lee los totales precalculados por categoría y tipo de coste (ver services/cost_summaries.py)
     query = """
-    SELECT cp.category, c.cost_type, SUM(c.amount) as total
-    FROM costs c JOIN cost_parameters cp ON c.cost_type = cp.parameter_name AND c.tenant_id = cp.tenant_id
-    WHERE c.tenant_id = %s GROUP BY cp.category, c.cost_type ORDER BY cp.category, total DESC;
+    SELECT category, cost_type, total
+    FROM cost_summary_categories
+    WHERE tenant_id = %s ORDER BY category, total DESC;
     """
     try:
         with get_db_connection() as conn:
+            cost_summaries.ensure_fresh(conn)
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(query, (str(current_user.tenant_id),))
                 hierarchical_data = defaultdict(lambda: {'name': '', 'children': []})
@@ -352,9 +455,9 @@ def get_product_profitability(current_user: schemas.User = Depends(security.get_
     # Esta función ya era correcta
     query = """
     WITH ProductSales AS (
-        SELECT sd.product_id, SUM(sd.quantity) as total_units_sold, SUM(sd.quantity * sd.unit_price) as total_revenue
-        FROM sale_details sd JOIN sales s ON sd.sale_id = s.id
-        WHERE s.tenant_id = %s GROUP BY sd.product_id
+        SELECT product_id, quantity as total_units_sold, revenue as total_revenue
+        FROM sales_rollup_products
+        WHERE tenant_id = %s
     )
     SELECT p.name as product_name, p.price as price, p.unit_cost as cost,
            COALESCE(ps.total_units_sold, 0) as units_sold, COALESCE(ps.total_revenue, 0) as revenue
@@ -374,40 +477,33 @@ def get_product_profitability(current_user: schemas.User = Depends(security.get_
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error de base de datos en product-profitability: {e}")
 
+@router.get("/cost-breakdowns")
+def get_product_cost_breakdowns(
+    product_ids: str = Query('all', description="IDs de producto separados por comas, o 'all' para todo el catálogo"),
+    current_user: schemas.User = Depends(security.get_current_active_user)
+):
+    """Desglose de costes por botella de varios productos en una sola consulta: {product_id: {total_unit_cost, breakdown}}."""
+    if product_ids.strip().lower() == 'all':
+        selected = None
+    else:
+        try:
+            selected = [str(uuid.UUID(value.strip())) for value in product_ids.split(',') if value.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="product_ids debe ser 'all' o una lista de UUID separados por comas.")
+        if not selected: return {}
+    try:
+        with get_db_connection() as conn:
+            return product_costs.get_breakdowns(conn, current_user.tenant_id, selected)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error de base de datos en cost-breakdowns: {e}")
+
 @router.get("/cost-breakdown/{product_id}")
 def get_single_product_cost_breakdown(product_id: uuid.UUID, current_user: schemas.User = Depends(security.get_current_active_user)):
-    # Esta función ya era correcta
-    product_query = """
-    SELECT p.unit_cost as total_unit_cost, p.wine_lot_origin_id, wl.origin_parcel_id, (wl.total_liters / 0.75) as total_bottles
-    FROM products p JOIN wine_lots wl ON p.wine_lot_origin_id = wl.id
-    WHERE p.id = %s AND p.tenant_id = %s;
-    """
-    costs_query = """
-    SELECT cp.category, c.cost_type, c.amount FROM costs c
-    JOIN cost_parameters cp ON c.cost_type = cp.parameter_name AND c.tenant_id = cp.tenant_id
-    WHERE c.tenant_id = %s AND (c.related_lot_id = %s OR c.related_parcel_id = %s);
-    """
+    # Mismo cálculo que /cost-breakdowns, para un solo producto
     try:
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                tenant_id_str = str(current_user.tenant_id)
-                cur.execute(product_query, (str(product_id), tenant_id_str))
-                product_info = cur.fetchone()
-                if not product_info: raise HTTPException(status_code=404, detail="Producto no encontrado.")
-                lot_id = product_info['wine_lot_origin_id']; parcel_id = product_info['origin_parcel_id']
-                total_bottles = float(product_info['total_bottles'] or 1)
-                total_unit_cost = float(product_info['total_unit_cost'] or 0)
-                cur.execute(costs_query, (tenant_id_str, lot_id, parcel_id))
-                
-                aggregated_costs = defaultdict(lambda: defaultdict(float))
-                for rec in cur.fetchall():
-                    aggregated_costs[rec['category']][rec['cost_type']] += float(rec['amount']) / total_bottles if total_bottles > 0 else 0
-                
-                final_data = []
-                for category, children in aggregated_costs.items():
-                    child_list = [{'name': name, 'value': value} for name, value in children.items()]
-                    final_data.append({'name': category, 'children': sorted(child_list, key=lambda x: x['value'], reverse=True)})
-                
-                return { "total_unit_cost": total_unit_cost, "breakdown": sorted(final_data, key=lambda x: sum(c['value'] for c in x['children']), reverse=True) }
+            breakdowns = product_costs.get_breakdowns(conn, current_user.tenant_id, [str(product_id)])
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error de base de datos: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error de base de datos: {str(e)}")
+    if str(product_id) not in breakdowns: raise HTTPException(status_code=404, detail="Producto no encontrado.")
+    return breakdowns[str(product_id)]
\ No newline at end of file
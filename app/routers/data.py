@@ -1,10 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
-import json
-from decimal import Decimal
 from datetime import date, timedelta
 import psycopg2.extras
 
 from ..database import get_db_connection
+from ..responses import cursor_response, stream_query
 from ..services.security import role_checker
 from .. import schemas
 
@@ -14,45 +13,25 @@ router = APIRouter(
     dependencies=[Depends(role_checker(["admin", "lector"]))]
 )
 
-def db_to_json(data, columns):
-    class CustomEncoder(json.JSONEncoder):
-        def default(self, obj):
-            if isinstance(obj, Decimal):
-                return float(obj)
-            if isinstance(obj, date):
-                return obj.isoformat()
-            return super(CustomEncoder, self).default(obj)
-
-    results = [dict(zip(columns, row)) for row in data]
-    return json.loads(json.dumps(results, cls=CustomEncoder))
-
 @router.get("/products")
 def get_products(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
     tenant_id = str(user.tenant_id) # <-- CORRECCIÓN
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, name, sku, product_type, price_per_unit, cost_per_unit, stock_quantity 
-                FROM products 
-                WHERE tenant_id = %s 
-                ORDER BY name
-                """,
-                (tenant_id,)
-            )
-            columns = [desc[0] for desc in cur.description]
-            products = cur.fetchall()
-            return db_to_json(products, columns)
+    # El catálogo no tiene límite de filas: se envía por bloques desde un cursor de servidor
+    return stream_query(
+        """
+        SELECT id, name, sku, product_type, price_per_unit, cost_per_unit, stock_quantity 
+        FROM products 
+        WHERE tenant_id = %s 
+        ORDER BY name
+        """,
+        (tenant_id,)
+    )
 
 @router.get("/transfers")
 def get_inventory_transfers(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
     tenant_id = str(user.tenant_id) # <-- CORRECCIÓN
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT transfer_date, sku, quantity FROM inventory_transfers WHERE tenant_id = %s ORDER BY transfer_date DESC", (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            transfers = cur.fetchall()
-            return db_to_json(transfers, columns)
+    # Sin límite de filas: se envía por bloques desde un cursor de servidor
+    return stream_query("SELECT transfer_date, sku, quantity FROM inventory_transfers WHERE tenant_id = %s ORDER BY transfer_date DESC", (tenant_id,))
 
 @router.get("/sales")
 def get_sales_data(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -60,9 +39,7 @@ def get_sales_data(user: schemas.User = Depends(role_checker(["admin", "lector"]
     with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT sale_date, sku, channel, sales_value FROM sales WHERE tenant_id = %s ORDER BY sale_date DESC LIMIT 500", (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            sales = cur.fetchall()
-            return db_to_json(sales, columns)
+            return cursor_response(cur)
             
 @router.get("/kpis")
 def get_main_kpis(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -118,8 +95,7 @@ def get_monthly_sales(user: schemas.User = Depends(role_checker(["admin", "lecto
                 GROUP BY month
                 ORDER BY month;
             """, (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            return db_to_json(cur.fetchall(), columns)
+            return cursor_response(cur)
 
 @router.get("/analytics/top-profitable-products")
 def get_top_profitable_products(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -138,8 +114,7 @@ def get_top_profitable_products(user: schemas.User = Depends(role_checker(["admi
                 ORDER BY total_profit DESC
                 LIMIT 10;
             """, (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            return db_to_json(cur.fetchall(), columns)
+            return cursor_response(cur)
 
 @router.get("/analytics/sales-by-weekday")
 def get_sales_by_weekday(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -155,8 +130,7 @@ def get_sales_by_weekday(user: schemas.User = Depends(role_checker(["admin", "le
                 GROUP BY weekday_num
                 ORDER BY weekday_num;
             """, (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            return db_to_json(cur.fetchall(), columns)
+            return cursor_response(cur)
 
 @router.get("/analytics/top-units-products")
 def get_top_products_by_units(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -174,8 +148,7 @@ def get_top_products_by_units(user: schemas.User = Depends(role_checker(["admin"
                 ORDER BY total_units DESC
                 LIMIT 10;
             """, (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            return db_to_json(cur.fetchall(), columns)
+            return cursor_response(cur)
 
 @router.get("/analytics/sales-by-channel")
 def get_sales_by_channel(user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -188,8 +161,7 @@ def get_sales_by_channel(user: schemas.User = Depends(role_checker(["admin", "le
                 WHERE tenant_id = %s
                 GROUP BY channel;
             """, (tenant_id,))
-            columns = [desc[0] for desc in cur.description]
-            return db_to_json(cur.fetchall(), columns)
+            return cursor_response(cur)
 
 @router.get("/sales/by_sku/{sku}")
 def get_sales_by_sku(sku: str, user: schemas.User = Depends(role_checker(["admin", "lector"]))):
@@ -6,7 +6,6 @@ from contextlib import closing
 import uuid
 from datetime import date, datetime
 import psycopg2
-from fpdf import FPDF
 import csv
 import io
 
@@ -182,6 +181,9 @@ def export_field_logs(
         return Response(content=output.getvalue(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=cuaderno_de_campo.csv"})
 
     elif format == "pdf":
+        # fpdf (y fontTools) solo se cargan al exportar en PDF, no al arrancar la API
+        from fpdf import FPDF
+
         pdf = FPDF()
         pdf.add_page()
         pdf.set_font("Arial", size=12)
@@ -7,7 +7,7 @@ import math
 from collections import defaultdict
 
 from .. import schemas
-from ..services import security
+from ..services import security, cost_summaries
 from ..database import get_db_connection
 from ..services.security import get_current_active_user
 from contextlib import closing
@@ -43,6 +43,7 @@ def create_cost_parameter(
                 ))
                 rec = cur.fetchone()
                 conn.commit()
+            cost_summaries.refresh_after_write(conn)
     except Exception as e:
         # Mejorar el manejo de errores para claves duplicadas
         if "unique constraint" in str(e):
@@ -112,6 +113,7 @@ def update_cost_parameter(
                 ))
                 rec = cur.fetchone()
                 conn.commit()
+            cost_summaries.refresh_after_write(conn)
         if not rec:
             raise HTTPException(status_code=404, detail="Parámetro no encontrado.")
     except Exception as e:
@@ -137,6 +139,7 @@ def delete_cost_parameter(
                     (str(parameter_id), str(current_user.tenant_id))
                 )
                 conn.commit()
+            cost_summaries.refresh_after_write(conn)
     except HTTPException as http_exc:
         raise http_exc
     except Exception as e:
@@ -214,17 +217,16 @@ def get_costs_summary(current_user: schemas.UserInDB = Depends(security.get_curr
     """
     Calcula el total de costes incurridos y el desglose porcentual por categoría.
     """
-    # Esta consulta asume que la columna 'cost_type' en la tabla 'costs'
-    # se corresponde con un 'parameter_name' en la tabla 'cost_parameters'.
+    # Parte de los totales precalculados por categoría y tipo de coste (ver services/cost_summaries.py),
+    # que cruzan 'cost_type' de 'costs' con 'parameter_name' de 'cost_parameters'.
     query = """
     WITH CategoryCosts AS (
         SELECT
-            cp.category,
-            SUM(c.amount) as total_amount
-        FROM costs c
-        JOIN cost_parameters cp ON c.cost_type = cp.parameter_name AND c.tenant_id = cp.tenant_id
-        WHERE c.tenant_id = %s
-        GROUP BY cp.category
+            category,
+            SUM(total) as total_amount
+        FROM cost_summary_categories
+        WHERE tenant_id = %s
+        GROUP BY category
     ),
     GrandTotal AS (
         SELECT SUM(total_amount) as total FROM CategoryCosts
@@ -239,6 +241,7 @@ def get_costs_summary(current_user: schemas.UserInDB = Depends(security.get_curr
     """
     try:
         with get_db_connection() as conn:
+            cost_summaries.ensure_fresh(conn)
             with conn.cursor() as cur:
                 cur.execute(query, (str(current_user.tenant_id),))
                 records = cur.fetchall()
@@ -1,88 +1,268 @@
 # Saas_GrapeIQ_V1.0/app/routers/forecast.py (VERSIÓN CON EVENTOS DINÁMICOS)
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from .. import database, schemas
-from ..services import advanced_forecast
-from ..services.security import get_current_user
+from ..services import forecast_jobs
+from ..services.security import get_current_user, role_checker
+from ..responses import FastJSONResponse
+from ..lazy import lazy_import
 import uuid
 from typing import List
 
+# advanced_forecast arrastra pandas (y Prophet): se carga con la primera petición de pronóstico
+advanced_forecast = lazy_import("app.services.advanced_forecast")
+hierarchical_forecast = lazy_import("app.services.hierarchical_forecast")
+
 router = APIRouter(
     prefix="/api/forecast",
     tags=["Forecast"]
 )
 
-def format_forecast_output(forecast_df, component_modes, periods=90):
-    if forecast_df is None: return None
-    future_forecast = forecast_df.tail(periods)
-    
-    prediction = [
-        schemas.ForecastPoint(
-            date=row['ds'].strftime('%Y-%m-%d'),
-            forecast=max(0, round(row['yhat'], 2)),
-            forecast_lower=max(0, round(row['yhat_lower'], 2)),
-            forecast_upper=max(0, round(row['yhat_upper'], 2)),
-        ) for _, row in future_forecast.iterrows()
-    ]
-
-    components = {'trend': future_forecast['trend'].round(2).tolist(), 'yearly': future_forecast['yearly'].round(2).tolist(), 'weekly': future_forecast['weekly'].round(2).tolist()}
-    regressor_cols = [col for col in future_forecast.columns if col not in ['ds', 'yhat', 'yhat_lower', 'yhat_upper', 'trend', 'yearly', 'weekly']]
-    if component_modes and component_modes.get('additive'):
-         regressor_sum = future_forecast[regressor_cols].sum(axis=1)
-         components['regressors'] = regressor_sum.round(2).tolist()
+# 'rows' (por defecto) mantiene el formato histórico; 'columnar' devuelve arrays paralelos
+FORMAT_DESCRIPTION = "Formato de la respuesta: 'rows' (un punto por día) o 'columnar' (arrays paralelos)."
+
+def _parse_series_id(product_id: str):
+    """'total' (o vacío) para las ventas totales; si no, el UUID del producto."""
+    if not product_id or product_id == 'total': return None
+    try:
+        return uuid.UUID(product_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="El product_id debe ser 'total' o un UUID válido.")
+
+def _forecast_response(forecast_df, component_modes, metadata, periods: int, output_format: str, not_found_detail: str):
+    if output_format == "columnar":
+        formatted_output = advanced_forecast.format_forecast_columnar(forecast_df, component_modes, periods, metadata)
     else:
-         components['regressors'] = [0] * periods
-         
-    return schemas.ForecastResponse(prediction=prediction, components=components)
+        formatted_output = advanced_forecast.format_forecast_output(forecast_df, component_modes, periods, metadata)
+    if formatted_output is None: raise HTTPException(status_code=404, detail=not_found_detail)
+    # La respuesta columnar se serializa tal cual, sin pasar por response_model
+    return FastJSONResponse(formatted_output) if output_format == "columnar" else formatted_output
+
+# Los GET sirven el pronóstico precalculado (forecast_precompute) desde la tabla 'forecasts'.
+# Solo se calcula en vivo si aún no hay uno guardado o si se pide con refresh=true; el
+# resultado se guarda para las siguientes lecturas.
+REFRESH_DESCRIPTION = "Recalcula el pronóstico en vivo en lugar de servir el precalculado."
+
+def _serve_forecast(tenant_id, product_id, refresh: bool, output_format: str, not_found_detail: str):
+    series = str(product_id) if product_id else 'total'
+    if not refresh:
+        with database.get_db_connection() as conn:
+            stored = advanced_forecast.load_stored_forecast(conn, tenant_id, series, 90)
+        if stored is not None:
+            return FastJSONResponse(stored) if output_format == "columnar" else advanced_forecast.columnar_to_rows(stored)
+
+    # La conexión solo se retiene para cargar datos; el ajuste del modelo se hace sin ella
+    with database.get_db_connection() as conn:
+        prepared = advanced_forecast.prepare_forecast(conn, tenant_id, product_id)
+    forecast_df, component_modes = advanced_forecast.execute_forecast(prepared, 90)
+    metadata = None
+    if prepared:
+        metadata = advanced_forecast.forecast_metadata(prepared)
+        try:
+            advanced_forecast.store_forecast(prepared, forecast_df, component_modes, 90)
+        except Exception as e:
+            print(f"⚠️ No se pudo guardar el pronóstico calculado en vivo: {e}")
+    return _forecast_response(forecast_df, component_modes, metadata, 90, output_format, not_found_detail)
 
 @router.get("/sku/{product_id}", response_model=schemas.ForecastResponse)
-def get_advanced_sku_forecast(product_id: uuid.UUID, current_user: schemas.User = Depends(get_current_user)):
+def get_advanced_sku_forecast(
+    product_id: uuid.UUID,
+    output_format: str = Query("rows", alias="format", pattern="^(rows|columnar)$", description=FORMAT_DESCRIPTION),
+    refresh: bool = Query(False, description=REFRESH_DESCRIPTION),
+    current_user: schemas.User = Depends(get_current_user)
+):
     try:
-        with database.get_db_connection() as conn:
-            forecast_df, component_modes = advanced_forecast.get_advanced_forecast(conn, product_id)
+        return _serve_forecast(current_user.tenant_id, product_id, refresh, output_format, "No se pudo generar el pronóstico. Datos insuficientes o producto no encontrado.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error en el endpoint de forecast: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
 
-    formatted_output = format_forecast_output(forecast_df, component_modes)
-    if formatted_output is None: raise HTTPException(status_code=404, detail="No se pudo generar el pronóstico. Datos insuficientes o producto no encontrado.")
-    return formatted_output
-
 @router.get("/total", response_model=schemas.ForecastResponse)
-def get_total_sales_forecast_endpoint(current_user: schemas.User = Depends(get_current_user)):
+def get_total_sales_forecast_endpoint(
+    output_format: str = Query("rows", alias="format", pattern="^(rows|columnar)$", description=FORMAT_DESCRIPTION),
+    refresh: bool = Query(False, description=REFRESH_DESCRIPTION),
+    current_user: schemas.User = Depends(get_current_user)
+):
     try:
-        with database.get_db_connection() as conn:
-            forecast_df, component_modes = advanced_forecast.get_total_sales_forecast(conn)
+        return _serve_forecast(current_user.tenant_id, None, refresh, output_format, "No se pudo generar el pronóstico. Datos insuficientes.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error en el endpoint de forecast total: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
 
-    formatted_output = format_forecast_output(forecast_df, component_modes)
-    if formatted_output is None: raise HTTPException(status_code=404, detail="No se pudo generar el pronóstico. Datos insuficientes.")
-    return formatted_output
-
 @router.post("/scenario", response_model=schemas.ForecastResponse)
-def get_scenario_forecast(scenario_request: schemas.ScenarioRequest, current_user: schemas.User = Depends(get_current_user)):
+def get_scenario_forecast(
+    scenario_request: schemas.ScenarioRequest,
+    output_format: str = Query("rows", alias="format", pattern="^(rows|columnar)$", description=FORMAT_DESCRIPTION),
+    current_user: schemas.User = Depends(get_current_user)
+):
     """Genera una predicción basada en un escenario futuro definido por el usuario."""
+    product_uuid = _parse_series_id(scenario_request.product_id)
     try:
+        # El escenario reutiliza el modelo base; solo se reentrena si trae eventos desconocidos
+        scenario = {
+            'future_events': [event.dict() for event in scenario_request.future_events],
+            'future_regressors': [reg.dict() for reg in scenario_request.future_regressors],
+        }
+
         with database.get_db_connection() as conn:
-            # --- MEJORA: Pasar los eventos futuros al servicio ---
-            future_events_dict = [event.dict() for event in scenario_request.future_events]
-
-            if scenario_request.product_id and scenario_request.product_id != 'total':
-                product_uuid = uuid.UUID(scenario_request.product_id)
-                forecast_df, component_modes = advanced_forecast.get_advanced_forecast(
-                    conn, product_uuid, scenario_request.periods, 
-                    [reg.dict() for reg in scenario_request.future_regressors],
-                    future_events_dict
-                )
-            else:
-                forecast_df, component_modes = advanced_forecast.get_total_sales_forecast(
-                    conn, scenario_request.periods, 
-                    [reg.dict() for reg in scenario_request.future_regressors],
-                    future_events_dict
-                )
+            prepared = advanced_forecast.prepare_scenarios(conn, current_user.tenant_id, product_uuid, [scenario])
+        results = advanced_forecast.execute_scenarios(prepared, scenario_request.periods)
+        forecast_df, component_modes, metadata = results[0] if results else (None, None, None)
     except Exception as e:
         print(f"Error en el endpoint de escenario: {e}"); raise HTTPException(status_code=500, detail=f"Error al simular el escenario: {e}")
         
-    formatted_output = format_forecast_output(forecast_df, component_modes, scenario_request.periods)
-    if formatted_output is None: raise HTTPException(status_code=404, detail="No se pudieron generar datos para este escenario.")
-    return formatted_output
\ No newline at end of file
+    return _forecast_response(forecast_df, component_modes, metadata, scenario_request.periods, output_format, "No se pudieron generar datos para este escenario.")
+
+@router.post("/scenarios", response_model=schemas.ScenarioComparisonResponse)
+def compare_scenarios(
+    comparison_request: schemas.ScenarioComparisonRequest,
+    output_format: str = Query("rows", alias="format", pattern="^(rows|columnar)$", description=FORMAT_DESCRIPTION),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """Evalúa varios escenarios sobre la misma serie en una sola llamada (pantallas de comparación)."""
+    product_uuid = _parse_series_id(comparison_request.product_id)
+    try:
+        scenarios = [scenario.model_dump(mode='json') for scenario in comparison_request.scenarios]
+
+        with database.get_db_connection() as conn:
+            prepared = advanced_forecast.prepare_scenarios(conn, current_user.tenant_id, product_uuid, scenarios)
+        results = advanced_forecast.execute_scenarios(prepared, comparison_request.periods)
+    except Exception as e:
+        print(f"Error en el endpoint de comparación de escenarios: {e}"); raise HTTPException(status_code=500, detail=f"Error al simular los escenarios: {e}")
+
+    if not results: raise HTTPException(status_code=404, detail="No se pudieron generar datos para estos escenarios.")
+    formatter = advanced_forecast.format_forecast_columnar if output_format == "columnar" else advanced_forecast.format_forecast_output
+    compared = []
+    for scenario, (forecast_df, component_modes, metadata) in zip(comparison_request.scenarios, results):
+        formatted_output = formatter(forecast_df, component_modes, comparison_request.periods, metadata)
+        if formatted_output is None: raise HTTPException(status_code=404, detail=f"No se pudieron generar datos para el escenario '{scenario.name}'.")
+        compared.append({'name': scenario.name, 'forecast': formatted_output})
+    return FastJSONResponse({'scenarios': compared}) if output_format == "columnar" else {'scenarios': compared}
+
+@router.post("/batch", response_model=schemas.ForecastJobSubmitted, status_code=202)
+def run_catalog_batch_forecast(
+    periods: int = Query(90, ge=1, le=365),
+    only_changed: bool = Query(False, description="Solo las series con datos nuevos desde el último pronóstico."),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """Encola el pronóstico de todos los productos del catálogo (y el total), que se guarda en 'forecasts'.
+    El resumen de la ejecución queda en el resultado del trabajo (GET /jobs/{job_id})."""
+    try:
+        job_id = forecast_jobs.submit_batch_job(current_user.tenant_id, periods, only_changed)
+    except forecast_jobs.TenantJobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        print(f"Error al encolar el pronóstico masivo: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
+    return schemas.ForecastJobSubmitted(job_id=job_id, status="queued")
+
+@router.get("/hierarchy", response_model=schemas.HierarchicalForecastResponse)
+def get_hierarchical_forecast(
+    periods: int = Query(90, ge=1, le=365),
+    method: str = Query("mint", pattern="^(mint|bottom_up)$", description="Reconciliación: 'mint' (por defecto; en jerarquías grandes pasa a 'wls' o 'bottom_up') o 'bottom_up'."),
+    base_model: str = Query("exp_smoothing", pattern="^(exp_smoothing|prophet)$", description="Modelo de cada nodo: 'exp_smoothing' (vectorizado) o 'prophet' (en paralelo; solo jerarquías pequeñas)."),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """Pronóstico coherente del total, cada producto, cada canal y cada producto x canal en una sola pasada.
+    Con Prophet, si la jerarquía tiene más de PROPHET_SYNC_MAX_NODES nodos hay que usar POST /hierarchy/jobs."""
+    try:
+        # Prophet se ajusta fuera del proceso HTTP, en el pool de procesos de pronóstico
+        executor = forecast_jobs.get_executor() if base_model == "prophet" else None
+        # La conexión solo se retiene mientras se leen las series, no durante los ajustes
+        with database.get_db_connection() as conn:
+            inputs = hierarchical_forecast.load_inputs(conn, current_user.tenant_id, base_model)
+        if inputs is None: raise HTTPException(status_code=404, detail="No hay ventas para generar el pronóstico jerárquico.")
+        nodes = hierarchical_forecast.node_count(inputs['bottom'])
+        if base_model == "prophet" and nodes > hierarchical_forecast.PROPHET_SYNC_MAX_NODES:
+            raise HTTPException(
+                status_code=422,
+                detail=f"La jerarquía tiene {nodes} series: con Prophet, encola el pronóstico con POST /api/forecast/hierarchy/jobs."
+            )
+        result = hierarchical_forecast.run_hierarchical_forecast(inputs, periods, method, base_model, executor)
+    except HTTPException:
+        raise
+    except hierarchical_forecast.HierarchyTooLargeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        print(f"Error en el pronóstico jerárquico: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
+    return FastJSONResponse(result)
+
+@router.post("/hierarchy/jobs", response_model=schemas.ForecastJobSubmitted, status_code=202)
+def submit_hierarchical_forecast_job(
+    periods: int = Query(90, ge=1, le=365),
+    method: str = Query("mint", pattern="^(mint|bottom_up)$"),
+    base_model: str = Query("prophet", pattern="^(exp_smoothing|prophet)$"),
+    current_user: schemas.User = Depends(get_current_user)
+):
+    """Encola el pronóstico jerárquico (pensado para Prophet en jerarquías grandes). El resultado,
+    con el mismo formato que GET /hierarchy, se consulta en GET /jobs/{job_id}."""
+    try:
+        job_id = forecast_jobs.submit_hierarchy_job(current_user.tenant_id, periods, method, base_model)
+    except forecast_jobs.TenantJobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        print(f"Error al encolar el pronóstico jerárquico: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
+    return schemas.ForecastJobSubmitted(job_id=job_id, status="queued")
+
+# --- CONFIGURACIÓN DEL MODELO ---
+
+@router.get("/settings", response_model=schemas.ForecastSettings)
+def get_forecast_settings(current_user: schemas.User = Depends(get_current_user)):
+    """Política de selección de modelo de la cuenta (Prophet, modelos ligeros o automática)."""
+    with database.get_db_connection() as conn:
+        return advanced_forecast.get_forecast_settings(conn, current_user.tenant_id)
+
+@router.put("/settings", response_model=schemas.ForecastSettings)
+def update_forecast_settings(settings: schemas.ForecastSettings, current_user: schemas.UserInDB = Depends(role_checker(["admin"]))):
+    """Cambia la política de selección de modelo. Los pronósticos siguientes ya la aplican."""
+    try:
+        with database.get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO forecast_settings (tenant_id, model_policy, fallback_model, min_history_days, min_active_ratio, updated_at)
+                    VALUES (%s, %s, %s, %s, %s, NOW())
+                    ON CONFLICT (tenant_id) DO UPDATE SET
+                        model_policy = EXCLUDED.model_policy, fallback_model = EXCLUDED.fallback_model,
+                        min_history_days = EXCLUDED.min_history_days, min_active_ratio = EXCLUDED.min_active_ratio,
+                        updated_at = EXCLUDED.updated_at;
+                    """,
+                    (str(current_user.tenant_id), settings.model_policy, settings.fallback_model, settings.min_history_days, settings.min_active_ratio)
+                )
+            conn.commit()
+    except Exception as e:
+        print(f"Error al guardar la configuración de pronóstico: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
+    return settings
+
+# --- COLA DE TRABAJOS ASÍNCRONOS ---
+
+@router.post("/jobs", response_model=schemas.ForecastJobSubmitted, status_code=202)
+def submit_forecast_job(scenario_request: schemas.ScenarioRequest, current_user: schemas.User = Depends(get_current_user)):
+    """Encola un pronóstico (total, por producto o escenario) y devuelve su identificador."""
+    if scenario_request.product_id and scenario_request.product_id != 'total':
+        try:
+            uuid.UUID(scenario_request.product_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="El product_id debe ser 'total' o un UUID válido.")
+    try:
+        job_id = forecast_jobs.submit_job(current_user.tenant_id, scenario_request.model_dump(mode='json'))
+    except forecast_jobs.TenantJobLimitError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        print(f"Error al encolar el pronóstico: {e}"); raise HTTPException(status_code=500, detail=f"Error interno del servidor: {e}")
+    return schemas.ForecastJobSubmitted(job_id=job_id, status="queued")
+
+@router.get("/jobs/{job_id}", response_model=schemas.ForecastJobStatus)
+def get_forecast_job(job_id: uuid.UUID, current_user: schemas.User = Depends(get_current_user)):
+    """Consulta el estado, el progreso y, al terminar, el resultado de un trabajo."""
+    job = forecast_jobs.get_job(current_user.tenant_id, job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Trabajo de pronóstico no encontrado.")
+    return job
+
+@router.delete("/jobs/{job_id}", response_model=schemas.ForecastJobStatus)
+def cancel_forecast_job(job_id: uuid.UUID, current_user: schemas.User = Depends(get_current_user)):
+    """Cancela un trabajo en cola o en ejecución."""
+    job = forecast_jobs.cancel_job(current_user.tenant_id, job_id)
+    if job is None: raise HTTPException(status_code=404, detail="Trabajo de pronóstico no encontrado.")
+    return job
\ No newline at end of file
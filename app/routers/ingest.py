@@ -1,4 +1,3 @@
-import pandas as pd
 import os
 import shutil
 from datetime import date
@@ -7,6 +6,7 @@ import psycopg2.extras
 
 from ..database import get_db_connection
 from ..services.security import get_current_user
+from ..services import sales_rollups, analytics_cache, forecast_cache
 
 router = APIRouter(
     prefix="/api/ingest",
@@ -21,6 +21,9 @@ def process_sales_csv(file_path: str, tenant_id: str):
     Procesa un archivo CSV de ventas subido por el usuario.
     """
     global task_statuses
+    # pandas solo se carga cuando se procesa un CSV, no al arrancar la API
+    import pandas as pd
+
     try:
         task_statuses[tenant_id] = "processing"
         chunk_size = 10000
@@ -103,6 +106,16 @@ def process_sales_csv(file_path: str, tenant_id: str):
         print(f"Error procesando CSV para el tenant {tenant_id}: {e}")
         task_statuses[tenant_id] = f"failed: {str(e)}"
     finally:
+        # La ingesta reemplaza las ventas del tenant: sus agregados se recalculan siempre, también
+        # si ha fallado a mitad, para que reflejen lo que haya quedado en la base de datos
+        try:
+            with get_db_connection() as conn:
+                sales_count = sales_rollups.rebuild(conn, tenant_id)
+            print(f"Agregados de ventas recalculados para el tenant {tenant_id} ({sales_count} ventas).")
+            analytics_cache.invalidate_tenant(tenant_id)
+            forecast_cache.invalidate_tenant(tenant_id)
+        except Exception as e:
+            print(f"Error recalculando los agregados de ventas del tenant {tenant_id}: {e}")
         if os.path.exists(file_path):
             try:
                 os.remove(file_path)
@@ -7,7 +7,7 @@ from psycopg2.extras import RealDictCursor
 import json # <--- 1. IMPORTANTE: Importar el módulo json
 
 from .. import schemas
-from ..services import security
+from ..services import security, cost_summaries
 from ..database import get_db_connection
 
 router = APIRouter(
@@ -38,6 +38,7 @@ def create_parcel(parcel: schemas.ParcelCreate, current_user: schemas.UserInDB =
                 ))
                 new_parcel = cur.fetchone()
                 conn.commit()
+                cost_summaries.refresh_after_write(conn)
                 return schemas.Parcel.model_validate(new_parcel)
     except Exception as e:
         conn.rollback()
@@ -93,6 +94,7 @@ def update_parcel(parcel_id: uuid.UUID, parcel: schemas.ParcelCreate, current_us
                 if not updated_parcel:
                     raise HTTPException(status_code=404, detail="Parcela no encontrada.")
                 conn.commit()
+                cost_summaries.refresh_after_write(conn)
                 return updated_parcel
     except Exception as e:
         conn.rollback()
@@ -107,6 +109,7 @@ def delete_parcel(parcel_id: uuid.UUID, current_user: schemas.UserInDB = Depends
                 if cur.rowcount == 0:
                     raise HTTPException(status_code=404, detail="Parcela no encontrada.")
                 conn.commit()
+                cost_summaries.refresh_after_write(conn)
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Error en la base de datos: {e}")
\ No newline at end of file
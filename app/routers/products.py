@@ -1,6 +1,6 @@
 # Saas_GrapeIQ_V1.0/app/routers/products.py
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from typing import Optional, List
 import uuid
 from psycopg2.extras import RealDictCursor
@@ -8,6 +8,7 @@ from psycopg2.extras import RealDictCursor
 from .. import schemas
 from ..services.security import get_current_user, role_checker, get_current_active_user
 from ..database import get_db_connection
+from ..services import catalog_search, cost_summaries
 
 router = APIRouter(
     prefix="/api/products",
@@ -16,44 +17,31 @@ router = APIRouter(
 
 @router.get("/", response_model=List[schemas.Product])
 def get_products(
+    response: Response,
     user: schemas.UserInDB = Depends(get_current_active_user),
     limit: int = Query(100, ge=1, le=200),
-    offset: int = Query(0, ge=0),
-    sku_filter: Optional[str] = Query(None, alias="sku")
+    offset: int = Query(0, ge=0, description="Obsoleto: usa `cursor`. Solo se aplica si no se envía cursor."),
+    sku_filter: Optional[str] = Query(None, alias="sku"),
+    q: Optional[str] = Query(None, description="Busca en nombre y SKU."),
+    cursor: Optional[str] = Query(None, description="Cursor de la cabecera X-Next-Cursor de la página anterior."),
+    count: str = Query("none", pattern="^(none|estimate|exact)$", description="Total en la cabecera X-Total-Estimate (estimado) o X-Total-Count (exacto).")
 ):
     """
-    Recupera una lista de todos los productos del tenant actual.
+    Recupera una lista de todos los productos del tenant actual, paginada por cursor.
     Este endpoint es usado por el frontend de pronóstico para poblar el selector.
     """
-    tenant_id = str(user.tenant_id)
-    products = []
-    
-    base_query = """
-        SELECT id, name, sku, description, price, unit_cost, wine_lot_origin_id, stock_units, variety 
-        FROM products 
-        WHERE tenant_id = %s
-    """
-    params = [tenant_id]
-
-    if sku_filter:
-        base_query += " AND sku ILIKE %s"
-        params.append(f"%{sku_filter}%")
-
-    base_query += " ORDER BY name LIMIT %s OFFSET %s"
-    params.extend([limit, offset])
-
+    select_sql = "id, name, sku, description, price, unit_cost, wine_lot_origin_id, stock_units, variety"
     try:
         with get_db_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(base_query, tuple(params))
-                results = cur.fetchall()
-                for row in results:
-                    # Usar model_validate para una conversión segura
-                    products.append(schemas.Product.model_validate(row))
-            return products
+            rows, next_cursor, total = catalog_search.search_products(conn, user.tenant_id, select_sql, q, sku_filter, limit, cursor, offset, count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error detallado al obtener productos: {e}")
         raise HTTPException(status_code=500, detail="Error interno al consultar los productos.")
+    catalog_search.set_pagination_headers(response, next_cursor, total, count)
+    # Usar model_validate para una conversión segura
+    return [schemas.Product.model_validate(row) for row in rows]
 
 
 @router.post("/", status_code=201, response_model=schemas.Product)
@@ -113,6 +101,7 @@ def delete_product(product_id: uuid.UUID, current_user: schemas.UserInDB = Depen
                     cur.execute("DELETE FROM wine_lots WHERE id = %s AND tenant_id = %s", (str(wine_lot_id), str(current_user.tenant_id)))
                 
                 conn.commit()
+                cost_summaries.refresh_after_write(conn)
 
     except Exception as e:
         conn.rollback()
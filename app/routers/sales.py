@@ -3,10 +3,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from typing import List
 import uuid
-from datetime import datetime
 
 from .. import schemas
-from ..services import security
+from ..services import security, analytics_cache, sales_rollups
 from ..database import get_db_connection
 
 router = APIRouter(
@@ -25,6 +24,7 @@ def create_sale(
     """
     total_amount = sum(item.quantity * item.unit_price for item in sale_data.details)
     sale_id = uuid.uuid4()
+    is_weekend = sale_data.is_weekend if sale_data.is_weekend is not None else sale_data.sale_date.weekday() >= 5
 
     try:
         with get_db_connection() as conn:
@@ -32,10 +32,11 @@ def create_sale(
                 # 1. Crear la venta principal
                 cur.execute(
                     """
-                    INSERT INTO sales (id, tenant_id, customer_name, total_amount, notes, sale_date)
-                    VALUES (%s, %s, %s, %s, %s, %s)
+                    INSERT INTO sales (id, tenant_id, customer_name, total_amount, notes, sale_date, is_weekend, holiday_name, avg_temperature)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
                     """,
-                    (str(sale_id), str(current_user.tenant_id), sale_data.customer_name, total_amount, sale_data.notes, datetime.utcnow())
+                    (str(sale_id), str(current_user.tenant_id), sale_data.customer_name, total_amount, sale_data.notes,
+                     sale_data.sale_date, is_weekend, sale_data.holiday_name, sale_data.avg_temperature)
                 )
 
                 # 2. Registrar los detalles y actualizar el stock
@@ -43,10 +44,10 @@ def create_sale(
                     # Insertar el detalle de la venta
                     cur.execute(
                         """
-                        INSERT INTO sale_details (sale_id, product_id, quantity, unit_price)
-                        VALUES (%s, %s, %s, %s)
+                        INSERT INTO sale_details (id, sale_id, tenant_id, product_id, quantity, unit_price)
+                        VALUES (%s, %s, %s, %s, %s, %s)
                         """,
-                        (str(sale_id), str(item.product_id), item.quantity, item.unit_price)
+                        (str(uuid.uuid4()), str(sale_id), str(current_user.tenant_id), str(item.product_id), item.quantity, item.unit_price)
                     )
 
                     # Actualizar el stock del producto
@@ -54,22 +55,31 @@ def create_sale(
                         "UPDATE products SET stock_units = stock_units - %s WHERE id = %s AND tenant_id = %s",
                         (item.quantity, str(item.product_id), str(current_user.tenant_id))
                     )
-                
+
+                # 3. Sumar la venta a los agregados de los cuadros de mando (misma transacción)
+                sales_rollups.apply_sales(cur, current_user.tenant_id, [sale_id])
+
                 conn.commit()
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en la base de datos: {e}")
 
+    # Los precios óptimos calculados con las ventas anteriores ya no son válidos
+    analytics_cache.invalidate_sales(current_user.tenant_id, [item.product_id for item in sale_data.details])
+
     # Devolvemos el objeto completo para la confirmación
     sale_details_for_response = [schemas.SaleDetail.model_validate({**item.model_dump(), "id": uuid.uuid4(), "sale_id": sale_id}) for item in sale_data.details]
     
     return schemas.Sale(
         id=sale_id,
-        sale_date=datetime.utcnow(),
+        sale_date=sale_data.sale_date,
         total_amount=total_amount,
         customer_name=sale_data.customer_name,
         notes=sale_data.notes,
-        details=sale_details_for_response
+        details=sale_details_for_response,
+        is_weekend=is_weekend,
+        holiday_name=sale_data.holiday_name,
+        avg_temperature=sale_data.avg_temperature
     )
 
 @router.get("/", response_model=List[schemas.Sale])
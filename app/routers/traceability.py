@@ -9,7 +9,7 @@ from psycopg2.extras import RealDictCursor, Json
 import psycopg2
 
 from .. import schemas
-from ..services import security
+from ..services import security, cost_summaries
 from ..database import get_db_connection
 
 
@@ -160,6 +160,7 @@ def create_wine_lot(lot: schemas.WineLotCreate, current_user: schemas.UserInDB =
                 cur.execute(query, (str(uuid.uuid4()), lot.name, lot.grape_variety, lot.vintage_year, str(current_user.tenant_id), lot.initial_grape_kg, total_liters, total_liters, str(lot.origin_parcel_id)))
                 new_lot = cur.fetchone()
                 conn.commit()
+                cost_summaries.refresh_after_write(conn)
                 return new_lot
     except Exception as e:
         conn.rollback()
@@ -194,6 +195,7 @@ def delete_wine_lot(lot_id: uuid.UUID, current_user: schemas.UserInDB = Depends(
                 cur.execute("DELETE FROM costs WHERE related_lot_id = %s AND tenant_id = %s", (str(lot_id), str(current_user.tenant_id)))
                 cur.execute("DELETE FROM wine_lots WHERE id = %s AND tenant_id = %s", (str(lot_id), str(current_user.tenant_id)))
                 conn.commit()
+                cost_summaries.refresh_after_write(conn)
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=f"Error al eliminar lote: {e}")
@@ -247,6 +249,7 @@ def prepare_lot_for_bottling(lot_id: uuid.UUID, current_user: schemas.UserInDB =
                     )
                     
                     conn.commit()
+                    cost_summaries.refresh_after_write(conn)
                     return new_lot
                 else:
                     cur.execute(
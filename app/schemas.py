@@ -1,7 +1,7 @@
 # Saas_GrapeIQ_V1.0/app/schemas.py
 
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Union, Dict, Any
+from typing import List, Optional, Union, Dict, Any, Literal
 from datetime import date, datetime
 import uuid
 
@@ -497,9 +497,46 @@ class ForecastPoint(BaseModel):
     forecast_lower: float
     forecast_upper: float
 
+class ForecastMetadata(BaseModel):
+    series: str
+    model: str
+    selection_reason: str
+    source: str = 'live' # 'precomputed' si se sirve desde la tabla 'forecasts'
+    model_version: Optional[str] = None
+    generated_at: Optional[datetime] = None
+
+    class Config:
+        protected_namespaces = ()
+
 class ForecastResponse(BaseModel):
     prediction: List[ForecastPoint]
     components: Dict[str, List[float]]
+    metadata: Optional[ForecastMetadata] = None
+
+class HierarchicalLevels(BaseModel):
+    total: List[float]
+    products: Dict[str, List[float]]
+    channels: Dict[str, List[float]]
+    product_channels: Dict[str, Dict[str, List[float]]]
+
+class HierarchicalForecastResponse(BaseModel):
+    method: str
+    base_model: str
+    dates: List[str]
+    product_names: Dict[str, str]
+    levels: HierarchicalLevels
+    series_count: int
+    elapsed_seconds: float
+
+class ForecastSettings(BaseModel):
+    # 'auto' elige Prophet para series densas y `fallback_model` para las de poco volumen
+    model_policy: Literal['auto', 'prophet', 'seasonal_naive', 'exp_smoothing'] = 'auto'
+    fallback_model: Literal['seasonal_naive', 'exp_smoothing'] = 'exp_smoothing'
+    min_history_days: int = Field(365, ge=1)
+    min_active_ratio: float = Field(0.5, ge=0, le=1)
+
+    class Config:
+        protected_namespaces = ()
 
 class ScenarioRegressor(BaseModel):
     start_date: date
@@ -515,4 +552,47 @@ class ScenarioRequest(BaseModel):
     product_id: Optional[str] = 'total'
     periods: int = 90
     future_regressors: List[ScenarioRegressor] = []
-    future_events: List[FutureEvent] = []
\ No newline at end of file
+    future_events: List[FutureEvent] = []
+
+class ScenarioDefinition(BaseModel):
+    name: str
+    future_regressors: List[ScenarioRegressor] = []
+    future_events: List[FutureEvent] = []
+
+class ScenarioComparisonRequest(BaseModel):
+    product_id: Optional[str] = 'total'
+    periods: int = 90
+    scenarios: List[ScenarioDefinition] = Field(..., min_length=1, max_length=20)
+
+class ScenarioForecast(BaseModel):
+    name: str
+    forecast: ForecastResponse
+
+class ScenarioComparisonResponse(BaseModel):
+    scenarios: List[ScenarioForecast]
+
+# --- Esquemas para la cola de trabajos de pronóstico ---
+class ForecastJobSubmitted(BaseModel):
+    job_id: uuid.UUID
+    status: str
+
+class BatchForecastSummary(BaseModel):
+    run_id: uuid.UUID
+    series_total: int
+    series_succeeded: int
+    series_failed: int
+    series_skipped: int = 0
+    models: Dict[str, int] = {}
+    elapsed_seconds: float
+    skus_per_second: float
+
+class ForecastJobStatus(BaseModel):
+    job_id: uuid.UUID
+    status: str
+    progress: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[Union[ForecastResponse, BatchForecastSummary, HierarchicalForecastResponse]] = None # Según el tipo de trabajo
+
@@ -1,165 +1,952 @@
 # Saas_GrapeIQ_V1.0/app/services/advanced_forecast.py (VERSIÓN CORREGIDA Y ROBUSTA)
 
+import os
+import time
+import hashlib
 import pandas as pd
-from prophet import Prophet
 import uuid
+import json
 import logging
-from typing import List, Dict, Optional
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain, groupby
+from operator import itemgetter
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
 import numpy as np
+from psycopg2.extras import execute_values
+
+from .. import database, schemas
+from . import forecast_cache, event_calendar, fast_models
 
 logging.getLogger('prophet').setLevel(logging.WARNING)
 logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
 
-def _run_prophet_forecast(
-    db_connection,
-    query: str,
-    query_params: Optional[Dict],
-    periods: int,
-    future_regressors: List[Dict] = [],
-    future_events: List[Dict] = []
-):
-    """Función interna para ejecutar el modelo Prophet con parámetros ajustados y regresores dinámicos."""
-    
-    # 1. Cargar eventos (sin cambios)
-    try:
-        events_query = "SELECT event_name as holiday, start_date as ds FROM special_events;"
-        special_events_df = pd.read_sql(events_query, db_connection)
-        special_events_df['ds'] = pd.to_datetime(special_events_df['ds'])
-        
-        if future_events:
-            user_events_df = pd.DataFrame(future_events)
-            user_events_df['ds'] = pd.to_datetime(user_events_df['ds'])
-            special_events_df = pd.concat([special_events_df, user_events_df], ignore_index=True)
-            
-    except Exception:
-        special_events_df = pd.DataFrame(future_events) if future_events else None
-        if special_events_df is not None:
-             special_events_df['ds'] = pd.to_datetime(special_events_df['ds'])
-
-    # 2. Cargar y procesar datos históricos (sin cambios)
-    try:
-        df = pd.read_sql(query, db_connection, params=query_params)
-        if df.empty or len(df) < 20: return None, None
-        df['ds'] = pd.to_datetime(df['ds'])
+# Hiperparámetros del modelo. Forman parte de la clave de la caché de modelos,
+# por lo que cualquier cambio aquí invalida los modelos ya entrenados.
+PROPHET_PARAMS = {
+    'growth': 'linear',
+    'yearly_seasonality': True,
+    'weekly_seasonality': True,
+    'daily_seasonality': False,
+    'changepoint_prior_scale': 0.5,
+    'seasonality_prior_scale': 25.0,
+    'interval_width': 0.90,
+}
+BASE_REGRESSORS = ['avg_temperature', 'is_weekend', 'on_promotion']
+
+# Refresco incremental: cuando llegan datos nuevos se parte del último modelo de la serie.
+# Si los datos nuevos caen dentro de su intervalo de predicción se reutiliza sin reentrenar
+# (como mucho MAX_REFRESH_SKIP_DAYS días seguidos); si no, se reentrena en caliente.
+INCREMENTAL_REFRESH = os.getenv("FORECAST_INCREMENTAL_REFRESH", "true").lower() == "true"
+MAX_REFRESH_SKIP_DAYS = int(os.getenv("FORECAST_MAX_REFRESH_SKIP_DAYS", 7))
+
+# Mínimo de líneas de venta para entrenar un modelo
+MIN_TRAINING_LINES = 20
+
+# La agregación diaria se hace en PostgreSQL: se recibe una fila por día (no por línea de venta)
+# con la cantidad total, los canales y sus cantidades en dos arrays paralelos y el flag de promoción.
+TRAINING_QUERY = """
+    WITH per_channel AS (
+        SELECT
+            s.sale_date::date AS ds,
+            s.channel,
+            SUM(sd.quantity) AS quantity,
+            COUNT(*) AS line_count,
+            AVG(s.avg_temperature) AS avg_temperature,
+            BOOL_OR(s.is_weekend) AS is_weekend,
+            MAX(CAST(sd.on_promotion AS INT)) AS on_promotion
+        FROM sales s
+        JOIN sale_details sd ON s.id = sd.sale_id
+        WHERE s.tenant_id = %(tenant_id)s {product_filter}
+        GROUP BY s.sale_date::date, s.channel
+    )
+    SELECT
+        ds, SUM(quantity) AS y, SUM(line_count) AS line_count,
+        AVG(avg_temperature) AS avg_temperature, BOOL_OR(is_weekend) AS is_weekend, MAX(on_promotion) AS on_promotion,
+        ARRAY_AGG(channel) AS channels, ARRAY_AGG(quantity) AS channel_quantities
+    FROM per_channel
+    GROUP BY ds
+    ORDER BY ds;
+"""
+
+# Marca de agua (nº de líneas y última fecha) y densidad de la serie (primer día y días con ventas)
+WATERMARK_QUERY = """
+    SELECT COUNT(sd.id), MAX(s.sale_date), MIN(s.sale_date), COUNT(DISTINCT s.sale_date::date)
+    FROM sales s
+    JOIN sale_details sd ON s.id = sd.sale_id
+    WHERE s.tenant_id = %(tenant_id)s {product_filter};
+"""
+
+
+# --- REGISTRO DE MODELOS Y POLÍTICA DE SELECCIÓN ---
+# 'prophet' tiene su propio circuito (caché en disco, refresco incremental). Los modelos de
+# FAST_MODELS se ajustan en milisegundos en cada llamada; para añadir uno basta con registrar
+# aquí una clase con fit(df) / predict(future) / component_modes (ver fast_models).
+FAST_MODELS = {
+    fast_models.SeasonalNaiveModel.name: fast_models.SeasonalNaiveModel,
+    fast_models.ExponentialSmoothingModel.name: fast_models.ExponentialSmoothingModel,
+}
+MODEL_POLICIES = ['auto', 'prophet'] + list(FAST_MODELS)
+
+# Con la política 'auto' se usa Prophet si la serie es densa (histórico y proporción de días
+# con ventas suficientes) y `fallback_model` en caso contrario. Configurable por tenant.
+DEFAULT_FORECAST_SETTINGS = {
+    'model_policy': 'auto',
+    'fallback_model': fast_models.ExponentialSmoothingModel.name,
+    'min_history_days': 365,
+    'min_active_ratio': 0.5,
+}
+
+SETTINGS_QUERY = """
+    SELECT model_policy, fallback_model, min_history_days, min_active_ratio
+    FROM forecast_settings WHERE tenant_id = %s;
+"""
+
 
-        df_daily = df.groupby('ds').agg(
-            y=('y', 'sum'),
-            avg_temperature=('avg_temperature', 'first'),
-            is_weekend=('is_weekend', 'first'),
-            on_promotion=('on_promotion', 'max')
-        ).reset_index()
+def get_forecast_settings(db_connection, tenant_id) -> Dict:
+    """Configuración de pronóstico del tenant, con los valores por defecto si no tiene."""
+    with db_connection.cursor() as cur:
+        cur.execute(SETTINGS_QUERY, (str(tenant_id),))
+        row = cur.fetchone()
+    if row is None: return dict(DEFAULT_FORECAST_SETTINGS)
+    return dict(zip(['model_policy', 'fallback_model', 'min_history_days', 'min_active_ratio'], row))
 
-        channel_pivot = df.pivot_table(index='ds', columns='channel', values='y', aggfunc='sum').fillna(0)
-        df = pd.merge(df_daily, channel_pivot, on='ds', how='left').fillna(0)
 
+def select_model(settings: Dict, profile: Dict):
+    """Devuelve (nombre del modelo, motivo) para una serie según la política del tenant."""
+    policy = settings['model_policy']
+    if policy != 'auto':
+        return policy, f"Modelo fijado por la configuración de la cuenta: {policy}."
+    if profile['first_date'] is None:
+        return settings['fallback_model'], "Serie sin ventas."
+
+    span_days = (pd.Timestamp(profile['last_date']).normalize() - pd.Timestamp(profile['first_date']).normalize()).days + 1
+    active_ratio = profile['active_days'] / span_days
+    summary = f"{profile['active_days']} días con ventas en {span_days} días de histórico"
+    if span_days >= settings['min_history_days'] and active_ratio >= settings['min_active_ratio']:
+        return 'prophet', f"Serie densa ({summary})."
+    return settings['fallback_model'], f"Serie poco densa ({summary})."
+
+
+def _series_key(product_id: Optional[uuid.UUID]) -> str:
+    return str(product_id) if product_id else 'total'
+
+
+def _cache_params(future_events: List[Dict], events_version: str, model_name: str = 'prophet') -> Dict:
+    return {
+        'model': model_name,
+        'regressor_projection': REGRESSOR_PROJECTION_VERSION,
+        'prophet': PROPHET_PARAMS,
+        'regressors': BASE_REGRESSORS,
+        'country_holidays': event_calendar.COUNTRY,
+        'events_version': events_version,
+        'future_events': future_events,
+    }
+
+
+def _series_query(template: str, tenant_id, product_id: Optional[uuid.UUID]):
+    """Rellena la plantilla SQL con el filtro de la serie (total o producto) del tenant."""
+    params = {'tenant_id': str(tenant_id)}
+    product_filter = ""
+    if product_id:
+        product_filter = "AND sd.product_id = %(product_id)s"
+        params['product_id'] = str(product_id)
+    return template.format(product_filter=product_filter), params
+
+
+def _profile(count, last_date, first_date, active_days) -> Dict:
+    return {'watermark': f"{count}:{last_date}", 'first_date': first_date, 'last_date': last_date, 'active_days': active_days}
+
+
+def get_series_profile(db_connection, tenant_id, product_id: Optional[uuid.UUID] = None) -> Dict:
+    """Marca de agua barata de los datos de una serie (nº de líneas de venta y última fecha)
+    y su densidad, que decide el modelo a usar."""
+    query, params = _series_query(WATERMARK_QUERY, tenant_id, product_id)
+    with db_connection.cursor() as cur:
+        cur.execute(query, params)
+        return _profile(*cur.fetchone())
+
+
+def get_series_watermark(db_connection, tenant_id, product_id: Optional[uuid.UUID] = None) -> str:
+    return get_series_profile(db_connection, tenant_id, product_id)['watermark']
+
+
+def _daily_frame(rows):
+    """Convierte las filas diarias de TRAINING_QUERY en el dataframe de entrenamiento,
+    con una columna por canal de venta. Los regresores se guardan en float32."""
+    if not rows or sum(row[2] for row in rows) < MIN_TRAINING_LINES: return None, None
+    ds, y, _, temperature, weekend, promotion, channels, quantities = zip(*rows)
+
+    channel_columns = sorted({name for names in channels for name in names if name is not None})
+    position = {name: i for i, name in enumerate(channel_columns)}
+    channel_matrix = np.zeros((len(rows), len(channel_columns)), dtype=np.float32)
+    for i, (names, values) in enumerate(zip(channels, quantities)):
+        for name, value in zip(names, values):
+            if name is not None: channel_matrix[i, position[name]] = value
+
+    df = pd.DataFrame({
+        'ds': pd.to_datetime(list(ds)),
+        'y': np.asarray(y, dtype=np.float64),
+        'avg_temperature': pd.Series(temperature, dtype='float32').fillna(0).to_numpy(),
+        'is_weekend': np.asarray([bool(w) for w in weekend]),
+        'on_promotion': np.asarray([p or 0 for p in promotion], dtype=np.int8),
+    })
+    for i, name in enumerate(channel_columns):
+        df[name] = channel_matrix[:, i]
+    return df, channel_columns
+
+
+def _load_training_frame(db_connection, query: str, query_params: Optional[Dict]):
+    """Carga el histórico ya agregado por día, con una columna por canal de venta."""
+    try:
+        with db_connection.cursor() as cur:
+            cur.execute(query, query_params)
+            return _daily_frame(cur.fetchall())
     except Exception as e:
         print(f"❌ Error al consultar o procesar datos: {e}"); return None, None
 
-    # 3. Configurar y entrenar el modelo (sin cambios)
-    model = Prophet(
-        growth='linear',
-        yearly_seasonality=True,
-        weekly_seasonality=True,
-        daily_seasonality=False,
-        changepoint_prior_scale=0.5,
-        seasonality_prior_scale=25.0,
-        interval_width=0.90,
-        holidays=special_events_df
-    )
-    
-    channel_columns = list(channel_pivot.columns)
-    regressors_to_add = ['avg_temperature', 'is_weekend', 'on_promotion'] + channel_columns
-    for regressor in regressors_to_add: model.add_regressor(regressor)
-    model.add_country_holidays(country_name='ES')
-    model.fit(df)
-
-    # 4. Crear dataframe futuro y rellenar TODOS los regresores
-    future = model.make_future_dataframe(periods=periods)
-    
-    # --- INICIO DE LA CORRECCIÓN ---
-
-    # Copiamos los regresores históricos del dataframe original
-    # Esto llena los valores pasados para que no sean NaN
-    regressor_cols_to_merge = ['ds'] + regressors_to_add
-    future = pd.merge(future, df[regressor_cols_to_merge], on='ds', how='left')
-
-    # Identificamos las filas que son del futuro
-    last_date = df['ds'].max()
-    future_dates_mask = future['ds'] > last_date
-    
-    # Rellenamos los NaN que puedan haber quedado en las filas futuras
-    future['is_weekend'] = future['ds'].dt.weekday >= 5
-    future['on_promotion'].fillna(0, inplace=True) # La promo por defecto es 0
-
-    # Proyectamos la temperatura con un ciclo anual
-    future_dates = pd.to_datetime(future[future_dates_mask]['ds'])
-    day_of_year = future_dates.dt.dayofyear 
-    temp_simulation = 15 + 10 * np.sin((day_of_year - 80) * (2 * np.pi / 365))
-    future.loc[future_dates_mask, 'avg_temperature'] = temp_simulation
-    future['avg_temperature'].fillna(df['avg_temperature'].mean(), inplace=True) # Rellenar por si acaso
-
-    # Proyectamos los canales de venta con variabilidad
-    channel_means = df[channel_columns].mean()
-    channel_std = df[channel_columns].std().fillna(0)
-
-    for col in channel_columns:
-        # Rellenamos los NaN históricos que puedan quedar (aunque no deberían)
-        future[col].fillna(0, inplace=True)
-        mean_val = channel_means[col]
-        std_val = channel_std[col]
-        
-        if std_val > 0:
-            # np.random.normal necesita saber el tamaño exacto del futuro
-            num_future_periods = len(future[future_dates_mask])
-            noise = np.random.normal(0, std_val / 4, num_future_periods)
-            future.loc[future_dates_mask, col] = np.maximum(0, mean_val + noise)
+
+def _fit_prophet(df: pd.DataFrame, channel_columns: List[str], special_events_df, init: Optional[Dict] = None):
+    """Configura y entrena el modelo Prophet con todos los regresores.
+    Los festivos nacionales ya vienen incluidos en el calendario (ver event_calendar).
+    Con `init` el optimizador arranca desde los parámetros de un ajuste anterior."""
+    # Prophet (y cmdstanpy) solo se importan si una serie lo necesita: los modelos ligeros no lo usan
+    from prophet import Prophet
+
+    model = Prophet(holidays=special_events_df, **PROPHET_PARAMS)
+    for regressor in BASE_REGRESSORS + channel_columns: model.add_regressor(regressor)
+    if init is not None:
+        model.fit(df, init=init)
+    else:
+        model.fit(df)
+    return model
+
+
+def warm_up() -> float:
+    """Importa Prophet y ajusta un modelo mínimo para que el primer pronóstico real no pague la
+    carga de cmdstanpy ni del modelo de Stan. Devuelve los segundos empleados."""
+    from prophet import Prophet
+
+    started = time.perf_counter()
+    df = pd.DataFrame({'ds': pd.date_range('2024-01-01', periods=30, freq='D'), 'y': np.arange(30, dtype=np.float64) % 7})
+    Prophet(yearly_seasonality=False, daily_seasonality=False, uncertainty_samples=0).fit(df)
+    return time.perf_counter() - started
+
+
+def _warm_start_params(model) -> Dict:
+    """Parámetros ajustados de un modelo en el formato 'init' de Stan."""
+    return {
+        'k': model.params['k'][0][0],
+        'm': model.params['m'][0][0],
+        'sigma_obs': model.params['sigma_obs'][0][0],
+        'delta': model.params['delta'][0],
+        'beta': model.params['beta'][0],
+    }
+
+
+def _refresh_model(previous, previous_stats: Dict, df: pd.DataFrame, channel_columns: List[str], special_events_df):
+    """Actualiza el modelo anterior de la serie con los datos nuevos.
+    Devuelve (modelo, modo) con modo 'reused', 'warm' o 'full'."""
+    if previous_stats.get('channel_columns') != channel_columns:
+        return _fit_prophet(df, channel_columns, special_events_df), 'full'
+
+    fitted_last_date = pd.to_datetime(previous_stats.get('fitted_last_date', previous_stats['last_date']))
+    new_rows = df[df['ds'] > pd.to_datetime(previous_stats['last_date'])]
+    if not new_rows.empty and (new_rows['ds'].max() - fitted_last_date).days <= MAX_REFRESH_SKIP_DAYS:
+        check = previous.predict(new_rows.drop(columns='y'))
+        actual = new_rows['y'].to_numpy()
+        if ((actual >= check['yhat_lower'].to_numpy()) & (actual <= check['yhat_upper'].to_numpy())).all():
+            return previous, 'reused'
+
+    try:
+        return _fit_prophet(df, channel_columns, special_events_df, init=_warm_start_params(previous)), 'warm'
+    except Exception as e:
+        # Cambió la dimensión de los parámetros (p. ej. aparecieron festivos nuevos en el histórico)
+        print(f"⚠️ No se pudo reentrenar en caliente, se reentrena desde cero: {e}")
+        return _fit_prophet(df, channel_columns, special_events_df), 'full'
+
+
+# --- PROYECCIÓN DE REGRESORES FUTUROS ---
+# La proyección es determinista: la variabilidad de los canales sale de un generador con
+# semilla derivada de (tenant, serie, horizonte), así que dos peticiones iguales devuelven
+# exactamente el mismo pronóstico. La temperatura futura sale de la climatología del tenant
+# (armónicos anuales ajustados a las temperaturas diarias guardadas en 'sales'); si no hay
+# histórico suficiente se usa el ciclo anual genérico. Cambiar la proyección exige subir
+# REGRESSOR_PROJECTION_VERSION, que forma parte de la clave de la caché de modelos.
+REGRESSOR_PROJECTION_VERSION = 2
+CLIMATOLOGY_HARMONICS = 2
+MIN_CLIMATOLOGY_DAYS_OF_YEAR = 120 # Días del año distintos con temperatura para fiarse del ajuste
+
+CLIMATOLOGY_QUERY = """
+    SELECT EXTRACT(DOY FROM s.sale_date)::int, AVG(s.avg_temperature), COUNT(DISTINCT s.sale_date::date)
+    FROM sales s
+    WHERE s.tenant_id = %s AND s.avg_temperature IS NOT NULL
+    GROUP BY 1;
+"""
+
+
+def _annual_harmonics(day_of_year: np.ndarray) -> np.ndarray:
+    angle = 2 * np.pi * np.asarray(day_of_year, dtype=np.float64) / 365.25
+    columns = [np.ones_like(angle)]
+    for k in range(1, CLIMATOLOGY_HARMONICS + 1):
+        columns += [np.sin(k * angle), np.cos(k * angle)]
+    return np.column_stack(columns)
+
+
+def get_temperature_climatology(db_connection, tenant_id) -> Optional[List[float]]:
+    """Coeficientes de la climatología de temperatura del tenant (media por día del año
+    suavizada con armónicos anuales), o None si el histórico no cubre bien el año."""
+    with db_connection.cursor() as cur:
+        cur.execute(CLIMATOLOGY_QUERY, (str(tenant_id),))
+        rows = cur.fetchall()
+    if len(rows) < MIN_CLIMATOLOGY_DAYS_OF_YEAR: return None
+
+    day_of_year, temperature, days = (np.array(column, dtype=np.float64) for column in zip(*rows))
+    # Mínimos cuadrados ponderados por el número de días observados de cada día del año
+    weights = np.sqrt(days)
+    coefficients, *_ = np.linalg.lstsq(_annual_harmonics(day_of_year) * weights[:, None], temperature * weights, rcond=None)
+    return np.round(coefficients, 4).tolist()
+
+
+def projection_seed(tenant_id, series: str, periods: int) -> int:
+    """Semilla estable de la proyección de regresores para (tenant, serie, horizonte)."""
+    digest = hashlib.sha256(f"{tenant_id}|{series}|{periods}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+_random_lock = threading.Lock()
+
+
+@contextmanager
+def _seeded_random(seed: int):
+    """Prophet muestrea los intervalos de incertidumbre con el generador global de numpy: se
+    fija la semilla (y se restaura el estado al salir) para que también sean reproducibles."""
+    with _random_lock:
+        state = np.random.get_state()
+        np.random.seed(seed % (2 ** 32))
+        try:
+            yield
+        finally:
+            np.random.set_state(state)
+
+
+def _regressor_stats(df: pd.DataFrame, channel_columns: List[str], climatology: Optional[List[float]] = None) -> Dict:
+    """Resumen del histórico necesario para proyectar regresores sin volver a leer los datos."""
+    return {
+        'last_date': df['ds'].max().strftime('%Y-%m-%d'),
+        'channel_columns': channel_columns,
+        'channel_means': {col: float(df[col].mean()) for col in channel_columns},
+        'channel_std': {col: float(np.nan_to_num(df[col].std())) for col in channel_columns},
+        'temperature_mean': float(np.nan_to_num(df['avg_temperature'].mean())),
+        'temperature_climatology': climatology,
+    }
+
+
+def _base_future_frame(stats: Dict, periods: int, seed: int) -> pd.DataFrame:
+    """Crea el dataframe de los días futuros con TODOS los regresores rellenos."""
+    last_date = pd.to_datetime(stats['last_date'])
+    ds = pd.date_range(last_date + pd.Timedelta(days=1), periods=periods, freq='D')
+    day_of_year = ds.dayofyear.to_numpy()
+
+    climatology = stats.get('temperature_climatology')
+    if climatology:
+        temperature = _annual_harmonics(day_of_year) @ np.asarray(climatology)
+    else:
+        temperature = 15 + 10 * np.sin((day_of_year - 80) * (2 * np.pi / 365))
+
+    future = pd.DataFrame({
+        'ds': ds,
+        'is_weekend': ds.weekday >= 5,
+        'on_promotion': 0, # La promo por defecto es 0
+        'avg_temperature': temperature,
+    })
+
+    # Canales de venta: media histórica con variabilidad reproducible, todos a la vez
+    channel_columns = stats['channel_columns']
+    if channel_columns:
+        means = np.array([stats['channel_means'][col] for col in channel_columns])
+        stds = np.array([stats['channel_std'][col] for col in channel_columns])
+        noise = np.random.default_rng(seed).normal(0, 1, (periods, len(channel_columns))) * (stds / 4)
+        future[channel_columns] = np.maximum(0, means + noise)
+    return future
+
+
+def _apply_future_regressors(future: pd.DataFrame, future_regressors: List[Dict]) -> pd.DataFrame:
+    """Sobrescribe los regresores en las fechas indicadas por el escenario."""
+    for reg in future_regressors:
+        mask = (future['ds'] >= pd.to_datetime(reg['start_date'])) & (future['ds'] <= pd.to_datetime(reg['end_date']))
+        if reg['name'] in future.columns:
+            future.loc[mask, reg['name']] = reg['value']
+    return future
+
+
+def _build_future_frame(stats: Dict, periods: int, future_regressors: List[Dict], seed: int) -> pd.DataFrame:
+    return _apply_future_regressors(_base_future_frame(stats, periods, seed), future_regressors)
+
+
+def prepare_forecast(
+    db_connection,
+    tenant_id,
+    product_id: Optional[uuid.UUID],
+    future_events: List[Dict] = []
+) -> Optional[Dict]:
+    """Fase que necesita la base de datos: marca de agua, consulta a la caché y, si no hay
+    modelo entrenado, carga del histórico y de los eventos. Devuelve None si no hay datos suficientes."""
+    series = _series_key(product_id)
+    profile = get_series_profile(db_connection, tenant_id, product_id)
+    model_name, selection_reason = select_model(get_forecast_settings(db_connection, tenant_id), profile)
+    events_version, tenant_events = event_calendar.get_tenant_events(db_connection, tenant_id)
+    cache_params = _cache_params(future_events, events_version, model_name)
+    prepared = {
+        'tenant_id': tenant_id,
+        'series': series,
+        'model_name': model_name,
+        'selection_reason': selection_reason,
+        'cache_key': forecast_cache.build_cache_key(tenant_id, series, profile['watermark'], cache_params),
+        'params_key': forecast_cache.build_cache_key(tenant_id, series, None, cache_params),
+    }
+
+    if model_name == 'prophet':
+        cached = forecast_cache.load_model(tenant_id, series, prepared['params_key'], prepared['cache_key'])
+        if cached is not None:
+            prepared['model'], prepared['stats'] = cached
+            return prepared
+
+    query, params = _series_query(TRAINING_QUERY, tenant_id, product_id)
+    df, channel_columns = _load_training_frame(db_connection, query, params)
+    if df is None: return None
+    prepared.update({
+        'model': None,
+        'df': df,
+        'channel_columns': channel_columns,
+        'climatology': get_temperature_climatology(db_connection, tenant_id),
+        # Los modelos ligeros no usan calendario de eventos
+        'holidays': event_calendar.build_holidays(tenant_events, df['ds'].min(), df['ds'].max(), future_events) if model_name == 'prophet' else None,
+    })
+    return prepared
+
+
+def _model_version(prepared: Dict) -> str:
+    # Modelo + configuración (hiperparámetros y calendario de eventos) con que se generó el pronóstico
+    return f"{prepared['model_name']}:{prepared['params_key'][:12]}"
+
+
+def forecast_metadata(prepared: Dict) -> Dict:
+    """Modelo usado y motivo de la elección, para incluirlo en la respuesta."""
+    return {
+        'series': prepared['series'],
+        'model': prepared['model_name'],
+        'selection_reason': prepared['selection_reason'],
+        'source': 'live',
+        'model_version': _model_version(prepared),
+    }
+
+
+def _ensure_model(prepared: Dict):
+    """Devuelve el modelo de 'prepared', entrenándolo (o refrescándolo) y guardándolo si hace falta."""
+    model = prepared['model']
+    if model is None and prepared['model_name'] in FAST_MODELS:
+        # Los modelos ligeros se ajustan en milisegundos: no se guardan en la caché de disco
+        model = FAST_MODELS[prepared['model_name']](interval_width=PROPHET_PARAMS['interval_width']).fit(prepared['df'])
+        prepared['stats'] = _regressor_stats(prepared['df'], prepared['channel_columns'], prepared['climatology'])
+        prepared['model'] = model
+    elif model is None:
+        df, channel_columns = prepared['df'], prepared['channel_columns']
+        previous = None
+        if INCREMENTAL_REFRESH:
+            previous = forecast_cache.load_latest(prepared['tenant_id'], prepared['series'], prepared['params_key'])
+        if previous is None:
+            model, refresh = _fit_prophet(df, channel_columns, prepared['holidays']), 'full'
         else:
-            future.loc[future_dates_mask, col] = mean_val
-        # Rellenamos cualquier NaN que pueda haber quedado en columnas de canal
-        future[col].fillna(0, inplace=True)
-            
-    # --- FIN DE LA CORRECCIÓN ---
-
-    if future_regressors:
-        for reg in future_regressors:
-            mask = (future['ds'] >= pd.to_datetime(reg['start_date'])) & (future['ds'] <= pd.to_datetime(reg['end_date']))
-            if reg['name'] in future.columns:
-                future.loc[mask, reg['name']] = reg['value']
-
-    # 5. Predecir y devolver
-    forecast = model.predict(future)
+            model, refresh = _refresh_model(*previous, df, channel_columns, prepared['holidays'])
+
+        stats = _regressor_stats(df, channel_columns, prepared['climatology'])
+        stats['params_key'] = prepared['params_key']
+        stats['refresh'] = refresh
+        stats['fitted_last_date'] = previous[1].get('fitted_last_date', previous[1]['last_date']) if refresh == 'reused' else stats['last_date']
+        prepared['stats'] = stats
+        prepared['model'] = model
+        forecast_cache.save_model(prepared['tenant_id'], prepared['series'], prepared['params_key'], prepared['cache_key'], model, stats)
+    return model
+
+
+def execute_forecast(prepared: Optional[Dict], periods: int, future_regressors: List[Dict] = []):
+    """Fase de cálculo, sin conexión a la base de datos: entrena si hace falta y predice."""
+    if prepared is None: return None, None
+
+    model = _ensure_model(prepared)
+    seed = projection_seed(prepared['tenant_id'], prepared['series'], periods)
+    future = _build_future_frame(prepared['stats'], periods, future_regressors, seed)
+    with _seeded_random(seed):
+        forecast = model.predict(future)
     return forecast, model.component_modes
 
-def get_advanced_forecast(db_connection, product_id: uuid.UUID, periods: int = 90, future_regressors: List[Dict] = [], future_events: List[Dict] = []):
+
+# --- ESCENARIOS (WHAT-IF) ---
+
+def _known_holidays(prepared: Dict) -> set:
+    """Nombres de eventos para los que el modelo base tiene (o tendrá al entrenarse) un efecto estimado."""
+    if prepared['model'] is not None:
+        names = prepared['model'].train_holiday_names
+        return set(names) if names is not None else set()
+    return set(prepared['holidays']['holiday']) if prepared['holidays'] is not None else set()
+
+
+def prepare_scenarios(db_connection, tenant_id, product_id: Optional[uuid.UUID], scenarios: List[Dict]) -> Optional[Dict]:
+    """Fase con base de datos para evaluar varios escenarios sobre una misma serie.
+
+    Todos los escenarios reutilizan el modelo base (en caché o entrenado una sola vez); sus
+    regresores solo cambian el dataframe futuro. Los eventos futuros cuyo nombre ya conoce el
+    modelo se añaden al calendario en el momento de predecir. Solo si un escenario trae eventos
+    nuevos se prepara (y se reentrena) una variante del modelo, compartida por los escenarios
+    con los mismos eventos.
+    """
+    baseline = prepare_forecast(db_connection, tenant_id, product_id)
+    if baseline is None: return None
+
+    known = _known_holidays(baseline)
+    variants, plan = {}, []
+    for scenario in scenarios:
+        events = scenario.get('future_events', [])
+        if all(event['holiday'] in known for event in events):
+            plan.append((scenario, None))
+            continue
+        variant_key = json.dumps(events, sort_keys=True, default=str)
+        if variant_key not in variants:
+            variants[variant_key] = prepare_forecast(db_connection, tenant_id, product_id, events)
+        plan.append((scenario, variant_key))
+    return {'baseline': baseline, 'variants': variants, 'plan': plan}
+
+
+def _predict_with_events(model, future: pd.DataFrame, events: List[Dict]) -> pd.DataFrame:
+    """Predice añadiendo temporalmente al calendario del modelo eventos ya conocidos."""
+    if not events: return model.predict(future)
+    extra = pd.DataFrame(events)[['holiday', 'ds']]
+    extra['ds'] = pd.to_datetime(extra['ds'])
+    original = model.holidays
+    model.holidays = pd.concat([original, extra], ignore_index=True) if original is not None else extra
+    try:
+        return model.predict(future)
+    finally:
+        model.holidays = original
+
+
+def execute_scenarios(prepared_scenarios: Optional[Dict], periods: int) -> Optional[List]:
+    """Fase de cálculo de prepare_scenarios. Devuelve una lista de (forecast, component_modes,
+    metadatos) en el orden de los escenarios. Todos parten del mismo dataframe futuro base, de modo que
+    las diferencias entre escenarios se deben solo a sus regresores y eventos."""
+    if prepared_scenarios is None: return None
+
+    baseline = prepared_scenarios['baseline']
+    model = _ensure_model(baseline)
+    seed = projection_seed(baseline['tenant_id'], baseline['series'], periods)
+    base_future = _base_future_frame(baseline['stats'], periods, seed)
+
+    results = []
+    for scenario, variant_key in prepared_scenarios['plan']:
+        future = _apply_future_regressors(base_future.copy(), scenario.get('future_regressors', []))
+        if variant_key is None:
+            with _seeded_random(seed):
+                forecast = _predict_with_events(model, future, scenario.get('future_events', []))
+            results.append((forecast, model.component_modes, forecast_metadata(baseline)))
+            continue
+        variant = prepared_scenarios['variants'][variant_key]
+        if variant is None:
+            results.append((None, None, None))
+            continue
+        variant_model = _ensure_model(variant)
+        with _seeded_random(seed):
+            forecast = variant_model.predict(future)
+        results.append((forecast, variant_model.component_modes, forecast_metadata(variant)))
+    return results
+
+
+def _run_prophet_forecast(
+    db_connection,
+    tenant_id,
+    product_id: Optional[uuid.UUID],
+    periods: int,
+    future_regressors: List[Dict] = [],
+    future_events: List[Dict] = []
+):
+    """Función interna para ejecutar el modelo Prophet con parámetros ajustados y regresores dinámicos.
+
+    El modelo entrenado se reutiliza desde la caché en disco mientras la marca de agua
+    de los datos de la serie no cambie; en ese caso solo se ejecuta `predict`.
+    """
+    prepared = prepare_forecast(db_connection, tenant_id, product_id, future_events)
+    return execute_forecast(prepared, periods, future_regressors)
+
+def get_advanced_forecast(db_connection, tenant_id, product_id: uuid.UUID, periods: int = 90, future_regressors: List[Dict] = [], future_events: List[Dict] = []):
     """Genera un pronóstico para un producto específico."""
     print(f"📈 Iniciando pronóstico para PRODUCTO: {product_id}")
-    query = """
-        SELECT
-            s.sale_date::date AS ds,
-            s.channel,
-            sd.quantity as y,
-            s.avg_temperature,
-            s.is_weekend,
-            CAST(sd.on_promotion AS INT) as on_promotion
-        FROM sales s
-        JOIN sale_details sd ON s.id = sd.sale_id
-        WHERE sd.product_id = %(product_id)s;
-    """
-    params = {'product_id': str(product_id)}
-    return _run_prophet_forecast(db_connection, query, params, periods, future_regressors, future_events)
+    return _run_prophet_forecast(db_connection, tenant_id, product_id, periods, future_regressors, future_events)
 
-def get_total_sales_forecast(db_connection, periods: int = 90, future_regressors: List[Dict] = [], future_events: List[Dict] = []):
+def get_total_sales_forecast(db_connection, tenant_id, periods: int = 90, future_regressors: List[Dict] = [], future_events: List[Dict] = []):
     """Genera un pronóstico para las ventas totales."""
     print(f"📈 Iniciando pronóstico para VENTAS TOTALES...")
-    query = """
+    return _run_prophet_forecast(db_connection, tenant_id, None, periods, future_regressors, future_events)
+
+def _regressor_component(future_forecast: pd.DataFrame, component_modes, periods: int) -> List[float]:
+    regressor_cols = [col for col in future_forecast.columns if col not in ['ds', 'yhat', 'yhat_lower', 'yhat_upper', 'trend', 'yearly', 'weekly']]
+    if component_modes and component_modes.get('additive'):
+         return future_forecast[regressor_cols].sum(axis=1).round(2).tolist()
+    return [0] * periods
+
+
+def _non_negative(values: pd.Series) -> np.ndarray:
+    # El '+ 0.0' convierte los -0.0 del redondeo en 0.0
+    return np.maximum(0, np.round(values.to_numpy(dtype=np.float64), 2)) + 0.0
+
+
+def format_forecast_columnar(forecast_df, component_modes, periods=90, metadata: Optional[Dict] = None) -> Optional[Dict]:
+    """Pronóstico en formato columnar: arrays paralelos calculados de forma vectorizada y sin
+    validación por fila. Pensado para serializarse con app.responses.FastJSONResponse."""
+    if forecast_df is None: return None
+    future_forecast = forecast_df.tail(periods)
+
+    return {
+        'format': 'columnar',
+        'dates': np.datetime_as_string(future_forecast['ds'].to_numpy(dtype='datetime64[D]'), unit='D').tolist(),
+        'forecast': _non_negative(future_forecast['yhat']),
+        'forecast_lower': _non_negative(future_forecast['yhat_lower']),
+        'forecast_upper': _non_negative(future_forecast['yhat_upper']),
+        'components': {
+            'trend': np.round(future_forecast['trend'].to_numpy(dtype=np.float64), 2),
+            'yearly': np.round(future_forecast['yearly'].to_numpy(dtype=np.float64), 2),
+            'weekly': np.round(future_forecast['weekly'].to_numpy(dtype=np.float64), 2),
+            'regressors': np.asarray(_regressor_component(future_forecast, component_modes, periods), dtype=np.float64),
+        },
+        'metadata': metadata,
+    }
+
+
+def format_forecast_output(forecast_df, component_modes, periods=90, metadata: Optional[Dict] = None):
+    """Formato por filas (un ForecastPoint por día) que usan los clientes existentes."""
+    return columnar_to_rows(format_forecast_columnar(forecast_df, component_modes, periods, metadata))
+
+
+def columnar_to_rows(columns: Optional[Dict]):
+    """Convierte la salida de format_forecast_columnar (o la de un pronóstico guardado) al formato por filas."""
+    if columns is None: return None
+
+    prediction = [
+        schemas.ForecastPoint(date=day, forecast=value, forecast_lower=lower, forecast_upper=upper)
+        for day, value, lower, upper in zip(
+            columns['dates'], columns['forecast'].tolist(), columns['forecast_lower'].tolist(), columns['forecast_upper'].tolist()
+        )
+    ]
+    components = {name: values.tolist() for name, values in columns['components'].items()}
+    return schemas.ForecastResponse(prediction=prediction, components=components, metadata=columns['metadata'])
+
+
+# --- PRONÓSTICO MASIVO DE TODO EL CATÁLOGO ---
+
+BATCH_WORKERS = int(os.getenv("FORECAST_BATCH_WORKERS", os.cpu_count() or 1))
+
+BATCH_TRAINING_QUERY = """
+    WITH per_channel AS (
         SELECT
+            sd.product_id,
             s.sale_date::date AS ds,
             s.channel,
-            sd.quantity as y,
-            s.avg_temperature,
-            s.is_weekend,
-            CAST(sd.on_promotion AS INT) as on_promotion
+            SUM(sd.quantity) AS quantity,
+            COUNT(*) AS line_count,
+            AVG(s.avg_temperature) AS avg_temperature,
+            BOOL_OR(s.is_weekend) AS is_weekend,
+            MAX(CAST(sd.on_promotion AS INT)) AS on_promotion
         FROM sales s
-        JOIN sale_details sd ON s.id = sd.sale_id;
+        JOIN sale_details sd ON s.id = sd.sale_id
+        WHERE s.tenant_id = %(tenant_id)s AND sd.product_id = ANY(%(product_ids)s::uuid[])
+        GROUP BY sd.product_id, s.sale_date::date, s.channel
+    )
+    SELECT
+        product_id, ds, SUM(quantity) AS y, SUM(line_count) AS line_count,
+        AVG(avg_temperature) AS avg_temperature, BOOL_OR(is_weekend) AS is_weekend, MAX(on_promotion) AS on_promotion,
+        ARRAY_AGG(channel) AS channels, ARRAY_AGG(quantity) AS channel_quantities
+    FROM per_channel
+    GROUP BY product_id, ds
+    ORDER BY product_id, ds;
+"""
+
+BATCH_WATERMARK_QUERY = """
+    SELECT sd.product_id, COUNT(sd.id), MAX(s.sale_date), MIN(s.sale_date), COUNT(DISTINCT s.sale_date::date)
+    FROM sales s
+    JOIN sale_details sd ON s.id = sd.sale_id
+    WHERE s.tenant_id = %(tenant_id)s
+    GROUP BY sd.product_id;
+"""
+
+STORED_WATERMARKS_QUERY = "SELECT series, data_key, periods FROM forecast_watermarks WHERE tenant_id = %s;"
+
+WATERMARKS_UPSERT = """
+    INSERT INTO forecast_watermarks (tenant_id, series, data_key, periods, selection_reason, refreshed_at) VALUES %s
+    ON CONFLICT (tenant_id, series) DO UPDATE
+    SET data_key = EXCLUDED.data_key, periods = EXCLUDED.periods,
+        selection_reason = EXCLUDED.selection_reason, refreshed_at = EXCLUDED.refreshed_at
+"""
+
+FORECASTS_INSERT = """
+    INSERT INTO forecasts (
+        id, tenant_id, product_id, series, run_id, ds, yhat, yhat_lower, yhat_upper,
+        trend, yearly, weekly, regressors, model_version, generated_at
+    ) VALUES %s
+"""
+
+# Lectura del pronóstico guardado de una serie (índice tenant_id, series, ds)
+STORED_FORECAST_QUERY = """
+    SELECT
+        f.ds, f.yhat, f.yhat_lower, f.yhat_upper, f.trend, f.yearly, f.weekly, f.regressors,
+        f.model_version, f.generated_at, w.selection_reason
+    FROM forecasts f
+    LEFT JOIN forecast_watermarks w ON w.tenant_id = f.tenant_id AND w.series = f.series
+    WHERE f.tenant_id = %s AND f.series = %s
+    ORDER BY f.ds
+    LIMIT %s;
+"""
+
+
+def prepare_batch_forecast(
+    db_connection,
+    tenant_id,
+    periods: int = 90,
+    only_changed: bool = False,
+    include_total: bool = True
+) -> Tuple[List[Dict], int]:
+    """Carga con una sola consulta el histórico de todos los productos del tenant y devuelve
+    un 'prepared' (ver prepare_forecast) por cada producto con datos suficientes y, con
+    `include_total`, otro para la serie 'total'.
+
+    Con `only_changed` solo se cargan los productos cuya marca de agua (o configuración)
+    difiere de la del último pronóstico guardado en 'forecasts'. Devuelve también el número
+    de series omitidas por no haber cambiado.
+    """
+    params = {'tenant_id': str(tenant_id)}
+    events_version, tenant_events = event_calendar.get_tenant_events(db_connection, tenant_id)
+    settings = get_forecast_settings(db_connection, tenant_id)
+
+    with db_connection.cursor() as cur:
+        cur.execute(BATCH_WATERMARK_QUERY, params)
+        profiles = {str(row[0]): _profile(*row[1:]) for row in cur.fetchall()}
+        if include_total and profiles:
+            profiles['total'] = get_series_profile(db_connection, tenant_id, None)
+        selections = {series: select_model(settings, profile) for series, profile in profiles.items()}
+        series_params = {series: _cache_params([], events_version, model_name) for series, (model_name, _) in selections.items()}
+        cache_keys = {
+            series: forecast_cache.build_cache_key(tenant_id, series, profile['watermark'], series_params[series])
+            for series, profile in profiles.items()
+        }
+        if only_changed:
+            cur.execute(STORED_WATERMARKS_QUERY, (str(tenant_id),))
+            stored = {series: (data_key, stored_periods) for series, data_key, stored_periods in cur.fetchall()}
+            changed = {series: key for series, key in cache_keys.items() if stored.get(series) != (key, periods)}
+            skipped, cache_keys = len(cache_keys) - len(changed), changed
+        else:
+            skipped = 0
+        if not cache_keys: return [], skipped
+        cur.execute(BATCH_TRAINING_QUERY, {**params, 'product_ids': [series for series in cache_keys if series != 'total']})
+        daily_rows = cur.fetchall()
+    params_keys = {series: forecast_cache.build_cache_key(tenant_id, series, None, series_params[series]) for series in cache_keys}
+
+    frames = (
+        (str(product_id), _daily_frame([row[1:] for row in product_rows]))
+        for product_id, product_rows in groupby(daily_rows, key=itemgetter(0))
+    )
+    if 'total' in cache_keys:
+        frames = chain(frames, [('total', _load_training_frame(db_connection, *_series_query(TRAINING_QUERY, tenant_id, None)))])
+
+    climatology = get_temperature_climatology(db_connection, tenant_id)
+    prepared_list = []
+    for series, (df, channel_columns) in frames:
+        if df is None: continue
+        prepared_list.append({
+            'tenant_id': tenant_id,
+            'series': series,
+            'model_name': selections[series][0],
+            'selection_reason': selections[series][1],
+            'cache_key': cache_keys[series],
+            'params_key': params_keys[series],
+            'model': None,
+            'df': df,
+            'channel_columns': channel_columns,
+            'climatology': climatology,
+        })
+
+    # Un único calendario, que cubre el histórico de todos los productos, compartido por todo el lote
+    prophet_list = [prepared for prepared in prepared_list if prepared['model_name'] == 'prophet']
+    holidays = None
+    if prophet_list:
+        holidays = event_calendar.build_holidays(
+            tenant_events,
+            min(prepared['df']['ds'].min() for prepared in prophet_list),
+            max(prepared['df']['ds'].max() for prepared in prophet_list),
+        )
+    for prepared in prepared_list:
+        prepared['holidays'] = holidays if prepared['model_name'] == 'prophet' else None
+    return prepared_list, skipped
+
+
+def _forecast_points(forecast_df: pd.DataFrame, component_modes, periods: int) -> List[Tuple]:
+    """Filas (ds, yhat, yhat_lower, yhat_upper, trend, yearly, weekly, regressors) a guardar en 'forecasts'."""
+    future = forecast_df.tail(periods)
+    return list(zip(
+        future['ds'].dt.date.tolist(),
+        future['yhat'].clip(lower=0).round(2).tolist(),
+        future['yhat_lower'].clip(lower=0).round(2).tolist(),
+        future['yhat_upper'].clip(lower=0).round(2).tolist(),
+        future['trend'].round(2).tolist(),
+        future['yearly'].round(2).tolist(),
+        future['weekly'].round(2).tolist(),
+        _regressor_component(future, component_modes, periods),
+    ))
+
+
+def _store_forecasts(tenant_id, prepared_by_series: Dict[str, Dict], points_by_series: Dict[str, List[Tuple]], periods: int, run_id: str, generated_at) -> None:
+    """Sustituye en una transacción el pronóstico guardado de cada serie y su marca de agua."""
+    rows = [
+        (str(uuid.uuid4()), str(tenant_id), None if series == 'total' else series, series, run_id, *point,
+         _model_version(prepared_by_series[series]), generated_at)
+        for series, points in points_by_series.items() for point in points
+    ]
+    watermarks = [
+        (str(tenant_id), series, prepared_by_series[series]['cache_key'], periods, prepared_by_series[series]['selection_reason'], generated_at)
+        for series in points_by_series
+    ]
+    with database.get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM forecasts WHERE tenant_id = %s AND series = ANY(%s)", (str(tenant_id), list(points_by_series)))
+                execute_values(cur, FORECASTS_INSERT, rows, page_size=len(rows))
+                execute_values(cur, WATERMARKS_UPSERT, watermarks)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def store_forecast(prepared: Dict, forecast_df: pd.DataFrame, component_modes, periods: int) -> None:
+    """Guarda un pronóstico calculado bajo demanda para que las siguientes lecturas lo sirvan desde la tabla."""
+    points = {prepared['series']: _forecast_points(forecast_df, component_modes, periods)}
+    _store_forecasts(prepared['tenant_id'], {prepared['series']: prepared}, points, periods, str(uuid.uuid4()), datetime.utcnow())
+
+
+def load_stored_forecast(db_connection, tenant_id, series: str, periods: int = 90) -> Optional[Dict]:
+    """Pronóstico precalculado de una serie en el formato de format_forecast_columnar, o None
+    si no hay uno guardado que cubra los `periods` días pedidos."""
+    with db_connection.cursor() as cur:
+        cur.execute(STORED_FORECAST_QUERY, (str(tenant_id), series, periods))
+        rows = cur.fetchall()
+    if len(rows) < periods: return None
+
+    ds, yhat, lower, upper, trend, yearly, weekly, regressors, model_versions, generated_at, reasons = zip(*rows)
+    columns = lambda values: np.array(values, dtype=np.float64)
+    return {
+        'format': 'columnar',
+        'dates': [day.isoformat() for day in ds],
+        'forecast': columns(yhat),
+        'forecast_lower': columns(lower),
+        'forecast_upper': columns(upper),
+        'components': {
+            'trend': columns(trend),
+            'yearly': columns(yearly),
+            'weekly': columns(weekly),
+            'regressors': columns(regressors),
+        },
+        'metadata': {
+            'series': series,
+            'model': (model_versions[0] or '').split(':')[0],
+            'selection_reason': reasons[0] or '',
+            'source': 'precomputed',
+            'model_version': model_versions[0],
+            'generated_at': generated_at[0].isoformat(),
+        },
+    }
+
+
+def _batch_forecast_worker(prepared: Dict, periods: int):
+    """Pronóstico de una serie del lote: reutiliza el modelo en caché o entrena uno nuevo.
+    Las series con Prophet se ejecutan en un proceso del pool; las ligeras, en el propio proceso."""
+    if prepared['model_name'] == 'prophet':
+        cached = forecast_cache.load_model(prepared['tenant_id'], prepared['series'], prepared['params_key'], prepared['cache_key'])
+        if cached is not None:
+            prepared['model'], prepared['stats'] = cached
+
+    forecast_df, component_modes = execute_forecast(prepared, periods)
+    return prepared['series'], _forecast_points(forecast_df, component_modes, periods)
+
+
+def run_batch_forecast(
+    tenant_id,
+    periods: int = 90,
+    executor: Optional[ProcessPoolExecutor] = None,
+    max_workers: Optional[int] = None,
+    only_changed: bool = False,
+    include_total: bool = True
+) -> Dict:
+    """Pronostica todos los productos del tenant (y la serie 'total') en paralelo y guarda el
+    resultado en 'forecasts', de donde lo sirven los endpoints GET.
+
+    Si no se pasa un executor se crea un pool propio (uso desde la línea de comandos).
+    Con `only_changed` (ejecución nocturna) se omiten las series sin datos nuevos.
+    Devuelve un resumen con el rendimiento en SKUs por segundo.
     """
-    return _run_prophet_forecast(db_connection, query, None, periods, future_regressors, future_events)
\ No newline at end of file
+    started = time.perf_counter()
+    with database.get_db_connection() as conn:
+        prepared_list, skipped = prepare_batch_forecast(conn, tenant_id, periods, only_changed, include_total)
+    prepared_by_series = {prepared['series']: prepared for prepared in prepared_list}
+
+    run_id = str(uuid.uuid4())
+    generated_at = datetime.utcnow()
+    points_by_series, failed = {}, 0
+    models_used = {}
+
+    def collect(result_getter):
+        nonlocal failed
+        try:
+            series, points = result_getter()
+        except Exception as e:
+            print(f"❌ Error en el pronóstico masivo de una serie: {e}")
+            failed += 1
+            return
+        points_by_series[series] = points
+
+    for prepared in prepared_list:
+        models_used[prepared['model_name']] = models_used.get(prepared['model_name'], 0) + 1
+
+    # Los modelos ligeros tardan milisegundos: se ejecutan aquí, sin pasar por el pool
+    prophet_list = [prepared for prepared in prepared_list if prepared['model_name'] == 'prophet']
+    for prepared in prepared_list:
+        if prepared['model_name'] != 'prophet':
+            collect(lambda: _batch_forecast_worker(prepared, periods))
+
+    if prophet_list:
+        own_executor = executor is None
+        if own_executor:
+            executor = ProcessPoolExecutor(max_workers=max_workers or BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            futures = [executor.submit(_batch_forecast_worker, prepared, periods) for prepared in prophet_list]
+            for future in as_completed(futures):
+                collect(future.result)
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+    if points_by_series:
+        _store_forecasts(tenant_id, prepared_by_series, points_by_series, periods, run_id, generated_at)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        'run_id': run_id,
+        'series_total': len(prepared_list),
+        'series_succeeded': len(points_by_series),
+        'series_failed': failed,
+        'series_skipped': skipped,
+        'models': models_used,
+        'elapsed_seconds': round(elapsed, 3),
+        'skus_per_second': round(len(points_by_series) / elapsed, 3) if elapsed > 0 else 0.0,
+    }
+    print(f"📦 Pronóstico masivo completado: {summary}")
+    return summary
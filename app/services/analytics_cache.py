@@ -0,0 +1,103 @@
+# Saas_GrapeIQ_V1.0/app/services/analytics_cache.py
+
+# Caché en memoria de resultados de analítica costosos (optimización de precios, KPIs...).
+# Las claves empiezan siempre por (tenant, ámbito) e incluyen una marca de agua barata de las
+# ventas, de modo que datos nuevos producen una clave distinta aunque la venta se registre en
+# otro proceso. Además, /api/sales/ invalida explícitamente las entradas de los productos
+# vendidos. Cada entrada caduca tras su TTL y el tamaño se acota con expulsión LRU.
+# No importa numpy ni pandas: consultarla no carga el stack científico. Las invalidaciones
+# marcan además como obsoleto el cubo de ventas en memoria (sales_cube).
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Iterable, Optional
+
+from . import sales_cube
+
+PRICE_CACHE_TTL_SECONDS = int(os.getenv("PRICE_CACHE_TTL_SECONDS", 3600))
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", 1024))
+KPI_CACHE_TTL_SECONDS = int(os.getenv("KPI_CACHE_TTL_SECONDS", 300))
+KPI_CACHE_MAX_ENTRIES = int(os.getenv("KPI_CACHE_MAX_ENTRIES", 1024))
+
+# Ámbito de las entradas que dependen de todo el catálogo del tenant
+CATALOG_SCOPE = 'catalog'
+KPI_SCOPE = 'kpis'
+
+SALES_WATERMARK_QUERY = """
+    SELECT COUNT(*), COALESCE(SUM(sd.quantity), 0), MAX(s.sale_date)
+    FROM sale_details sd
+    JOIN sales s ON s.id = sd.sale_id
+    WHERE sd.tenant_id = %(tenant_id)s AND (%(product_ids)s::uuid[] IS NULL OR sd.product_id = ANY(%(product_ids)s::uuid[]));
+"""
+
+
+class ResultCache:
+    """Caché LRU con TTL, segura entre hilos. Las claves son tuplas (tenant, ámbito, ...)."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable):
+        """Valor guardado o None si no existe o ha caducado."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate: Callable[[tuple], bool]) -> int:
+        """Elimina las entradas cuya clave cumple `predicate`. Devuelve cuántas se eliminaron."""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+price_results = ResultCache(PRICE_CACHE_MAX_ENTRIES, PRICE_CACHE_TTL_SECONDS)
+# Sin marca de agua en la clave: las ventas de otros procesos se reflejan al caducar el TTL
+kpi_results = ResultCache(KPI_CACHE_MAX_ENTRIES, KPI_CACHE_TTL_SECONDS)
+
+
+def sales_watermark(db_connection, tenant_id, product_ids: Optional[Iterable[str]] = None) -> tuple:
+    """(nº de líneas, unidades, última fecha) de las ventas del tenant o de los productos indicados."""
+    with db_connection.cursor() as cur:
+        cur.execute(SALES_WATERMARK_QUERY, {'tenant_id': str(tenant_id), 'product_ids': list(product_ids) if product_ids else None})
+        count, quantity, last_date = cur.fetchone()
+    return count, int(quantity), str(last_date)
+
+
+def invalidate_sales(tenant_id, product_ids: Iterable[str]) -> None:
+    """Descarta los resultados que dependen de las ventas de esos productos (y los de catálogo y KPIs)."""
+    tenant_key, scopes = str(tenant_id), {str(product_id) for product_id in product_ids} | {CATALOG_SCOPE}
+    price_results.invalidate(lambda key: key[0] == tenant_key and key[1] in scopes)
+    kpi_results.invalidate(lambda key: key[0] == tenant_key)
+    sales_cube.mark_stale(tenant_key)
+
+
+def invalidate_tenant(tenant_id) -> None:
+    """Descarta todos los resultados del tenant (p. ej. tras una ingesta que reemplaza sus ventas)."""
+    tenant_key = str(tenant_id)
+    for cache in (price_results, kpi_results):
+        cache.invalidate(lambda key: key[0] == tenant_key)
+    sales_cube.mark_stale(tenant_key)
@@ -0,0 +1,117 @@
+# Saas_GrapeIQ_V1.0/app/services/catalog_search.py
+
+# Búsqueda y paginación del catálogo de productos, con coste estable aunque el tenant tenga
+# decenas de miles de SKU.
+# - Búsqueda por índice: con 3 o más caracteres, "contiene" (ILIKE '%x%') sobre nombre/SKU con
+#   índices GIN de trigramas (pg_trgm); con menos, `q` busca por prefijo con índices btree sobre
+#   lower(). El parámetro heredado `sku` siempre es "contiene", como antes.
+#   Si la extensión pg_trgm no está disponible la búsqueda funciona igual, sin índice.
+# - Paginación por cursor (keyset) ordenada por (name, id): cada página es una búsqueda en el
+#   índice (tenant_id, name, id), no un OFFSET que recorre todas las filas anteriores.
+# - Total opcional: estimación del planificador (EXPLAIN) o recuento exacto.
+
+import json
+import base64
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2.extras import RealDictCursor
+
+TRIGRAM_MIN_LENGTH = 3
+COUNT_MODES = ['none', 'estimate', 'exact']
+
+
+def encode_cursor(name: str, product_id) -> str:
+    return base64.urlsafe_b64encode(json.dumps([name, str(product_id)]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        name, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return str(name), str(product_id)
+    except Exception:
+        raise ValueError("Cursor de paginación no válido.")
+
+
+def _like_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _text_filter(columns: List[str], value: str, allow_prefix: bool = True) -> Tuple[str, List[str]]:
+    """Filtro "contiene" (trigramas) o, si `allow_prefix` y el texto es corto, "empieza por" (btree)
+    sobre una o varias columnas."""
+    if len(value) >= TRIGRAM_MIN_LENGTH or not allow_prefix:
+        pattern, template = f"%{_like_escape(value)}%", "{} ILIKE %s"
+    else:
+        pattern, template = f"{_like_escape(value.lower())}%", "lower({}) LIKE %s"
+    clause = " OR ".join(template.format(column) for column in columns)
+    return f"({clause})", [pattern] * len(columns)
+
+
+def _where(tenant_id, q: Optional[str], sku: Optional[str]) -> Tuple[str, List]:
+    clauses, params = ["tenant_id = %s"], [str(tenant_id)]
+    for columns, value, allow_prefix in ((['name', 'sku'], q, True), (['sku'], sku, False)):
+        if value and value.strip():
+            clause, values = _text_filter(columns, value.strip(), allow_prefix)
+            clauses.append(clause)
+            params.extend(values)
+    return " AND ".join(clauses), params
+
+
+def count_products(cur, where: str, params: List, mode: str) -> Optional[int]:
+    """Total de productos que cumplen el filtro: exacto, estimado por el planificador o None."""
+    if mode == 'exact':
+        cur.execute(f"SELECT COUNT(*) AS total FROM products WHERE {where};", params)
+        return cur.fetchone()['total']
+    if mode == 'estimate':
+        cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM products WHERE {where};", params)
+        plan = list(cur.fetchone().values())[0]
+        if isinstance(plan, str): plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return None
+
+
+def search_products(
+    db_connection,
+    tenant_id,
+    select_sql: str,
+    q: Optional[str] = None,
+    sku: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    count: str = 'none'
+) -> Tuple[List[Dict], Optional[str], Optional[int]]:
+    """Página de productos ordenada por (name, id). Devuelve (filas, cursor de la página siguiente
+    o None si es la última, total según `count`). `offset` solo se usa si no hay cursor."""
+    if count not in COUNT_MODES: raise ValueError(f"Modo de recuento desconocido: {count}")
+    where, params = _where(tenant_id, q, sku)
+    page_where, page_params = where, list(params)
+    if cursor:
+        after_name, after_id = decode_cursor(cursor)
+        page_where += " AND (name, id) > (%s, %s::uuid)"
+        page_params.extend([after_name, after_id])
+
+    query = f"SELECT {select_sql}, name AS _cursor_name, id AS _cursor_id FROM products WHERE {page_where} ORDER BY name, id LIMIT %s"
+    page_params.append(limit + 1)
+    if offset and not cursor:
+        query += " OFFSET %s"
+        page_params.append(offset)
+
+    with db_connection.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(query, page_params)
+        rows = cur.fetchall()
+        total = count_products(cur, where, params, count)
+
+    next_cursor = encode_cursor(rows[limit - 1]['_cursor_name'], rows[limit - 1]['_cursor_id']) if len(rows) > limit else None
+    rows = rows[:limit]
+    for row in rows:
+        del row['_cursor_name'], row['_cursor_id']
+    return rows, next_cursor, total
+
+
+def set_pagination_headers(response, next_cursor: Optional[str], total: Optional[int], count: str) -> None:
+    """Cabeceras de paginación: el cuerpo sigue siendo una lista, compatible con los clientes existentes."""
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    if total is not None:
+        response.headers['X-Total-Count' if count == 'exact' else 'X-Total-Estimate'] = str(total)
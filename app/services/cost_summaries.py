@@ -0,0 +1,74 @@
+# Saas_GrapeIQ_V1.0/app/services/cost_summaries.py
+
+# Resúmenes de costes precalculados para la analítica: coste y producción por parcela
+# (cost_summary_parcels) y total por categoría y tipo de coste (cost_summary_categories).
+# Son vistas materializadas (ver migrations.py) que se refrescan con REFRESH MATERIALIZED VIEW
+# CONCURRENTLY: los datos nuevos se calculan aparte y se aplican como diferencias, así que las
+# lecturas de los endpoints nunca esperan a un refresco.
+# Política de refresco: triggers por sentencia sobre costs, cost_parameters, wine_lots y parcels
+# incrementan la versión de summary_changes, y cada refresco guarda en summary_refreshes la versión
+# que ha incorporado. El incremento es transaccional: un refresco solo ve la versión de escrituras
+# ya confirmadas, cuyas filas también ve, así que nunca marca como incorporadas filas que no leyó.
+# Los endpoints que escriben esas tablas refrescan tras su commit; las lecturas refrescan solo si
+# detectan cambios hechos por otra vía (cargas masivas, scripts).
+# Si otro proceso ya está refrescando no se espera: se leen las filas actuales.
+
+SUMMARY_NAME = 'cost_summaries'
+SUMMARY_VIEWS = ['cost_summary_parcels', 'cost_summary_categories']
+
+# Clave del advisory lock que serializa los refrescos entre procesos
+REFRESH_LOCK_KEY = 7310023
+
+# (versión de los datos de origen, versión incorporada a las vistas o -1 si nunca se han refrescado)
+CHANGE_STATE_QUERY = """
+    SELECT COALESCE((SELECT version FROM summary_changes WHERE name = %(name)s), 0),
+           COALESCE((SELECT version FROM summary_refreshes WHERE name = %(name)s), -1);
+"""
+
+
+def is_stale(cur) -> bool:
+    cur.execute(CHANGE_STATE_QUERY, {'name': SUMMARY_NAME})
+    current_version, refreshed_version = cur.fetchone()
+    return current_version != refreshed_version
+
+
+def refresh(db_connection, force: bool = False) -> bool:
+    """Refresca las vistas si hay cambios pendientes (o siempre con `force`) y hace commit.
+    Devuelve False si otro proceso estaba refrescando y no se ha hecho nada."""
+    with db_connection.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s);", (REFRESH_LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            db_connection.rollback()
+            return False
+        cur.execute(CHANGE_STATE_QUERY, {'name': SUMMARY_NAME})
+        current_version, refreshed_version = cur.fetchone()
+        if force or current_version != refreshed_version:
+            for view in SUMMARY_VIEWS:
+                cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
+            cur.execute(
+                """
+                INSERT INTO summary_refreshes (name, version, refreshed_at) VALUES (%s, %s, NOW())
+                ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version, refreshed_at = EXCLUDED.refreshed_at;
+                """,
+                (SUMMARY_NAME, current_version)
+            )
+    db_connection.commit()
+    return True
+
+
+def ensure_fresh(db_connection) -> None:
+    """Antes de leer los resúmenes: refresca solo si hay cambios que aún no incorporan."""
+    with db_connection.cursor() as cur:
+        stale = is_stale(cur)
+    if stale:
+        refresh(db_connection)
+
+
+def refresh_after_write(db_connection) -> None:
+    """Tras el commit de una escritura en las tablas de origen. Un fallo aquí no anula la escritura:
+    la siguiente lectura volverá a intentarlo."""
+    try:
+        refresh(db_connection)
+    except Exception as e:
+        db_connection.rollback()
+        print(f"ADVERTENCIA: No se pudieron refrescar los resúmenes de costes: {e}")
@@ -0,0 +1,77 @@
+# Saas_GrapeIQ_V1.0/app/services/dashboard_bundle.py
+
+# Todo el cuadro de mando de analítica en una sola consulta: KPIs, serie mensual, ventas por día
+# de la semana, productos top y matriz de rendimiento. Las secciones comparten los mismos CTE
+# sobre los agregados de ventas (ver sales_rollups.py) y PostgreSQL construye directamente el JSON,
+# que se devuelve tal cual, sin decodificarlo ni volver a codificarlo en Python.
+# Cada sección tiene la misma forma que la respuesta de su endpoint individual de /api/analytics;
+# los KPIs usan la misma expresión que kpis-summary (kpi_metrics.KPI_JSON_SQL).
+
+from datetime import date
+from typing import List
+
+from psycopg2 import sql
+
+from . import kpi_metrics
+
+BUNDLE_CTES = """
+    WITH monthly AS (
+        SELECT month, sale_count, total_amount, quantity
+        FROM sales_rollup_monthly
+        WHERE tenant_id = %(tenant_id)s
+    ),
+    weekday AS (
+        SELECT weekday, total_amount
+        FROM sales_rollup_weekday
+        WHERE tenant_id = %(tenant_id)s
+    ),
+    product_sales AS (
+        SELECT p.name, p.sku, SUM(r.quantity) AS quantity, SUM(r.revenue - r.quantity * p.unit_cost) AS profit
+        FROM sales_rollup_products r
+        JOIN products p ON r.product_id = p.id
+        WHERE r.tenant_id = %(tenant_id)s
+        GROUP BY p.name, p.sku
+    ),
+    product_names AS (
+        SELECT name, SUM(quantity) AS quantity, SUM(profit) AS profit
+        FROM product_sales
+        GROUP BY name
+    )
+"""
+
+# Expresión JSON de cada sección, en el orden en que se devuelven
+SECTIONS = {
+    'kpis': kpi_metrics.KPI_JSON_SQL,
+    'monthly_sales': """(
+        SELECT COALESCE(json_agg(json_build_object('Month', TO_CHAR(month, 'YYYY-MM'), 'TotalSale', total_amount) ORDER BY month), '[]')
+        FROM monthly
+    )""",
+    'sales_by_weekday': """(
+        SELECT COALESCE(json_agg(json_build_object('weekday_num', weekday, 'total_sales', total_amount) ORDER BY weekday), '[]')
+        FROM weekday
+    )""",
+    'top_profitable_products': """(
+        SELECT COALESCE(json_agg(json_build_object('ProductName', name, 'Profit', profit) ORDER BY profit DESC), '[]')
+        FROM (SELECT name, profit FROM product_names ORDER BY profit DESC LIMIT %(limit)s) t
+    )""",
+    'top_units_products': """(
+        SELECT COALESCE(json_agg(json_build_object('ProductName', name, 'SKU', sku, 'Quantity', quantity) ORDER BY quantity DESC), '[]')
+        FROM (SELECT name, sku, quantity FROM product_sales ORDER BY quantity DESC LIMIT %(limit)s) t
+    )""",
+    'product_performance_matrix': """(
+        SELECT COALESCE(json_agg(json_build_object('ProductName', name, 'Quantity', quantity, 'Profit', profit) ORDER BY profit DESC), '[]')
+        FROM (SELECT name, quantity, profit FROM product_names ORDER BY profit DESC LIMIT %(matrix_limit)s) t
+    )""",
+}
+
+
+def build_bundle(db_connection, tenant_id, fields: List[str], limit: int = 10, matrix_limit: int = 7) -> str:
+    """JSON (texto) con las secciones pedidas del cuadro de mando, calculado en una sola consulta."""
+    unknown = set(fields) - set(SECTIONS)
+    if unknown: raise ValueError(f"Secciones desconocidas: {', '.join(sorted(unknown))}")
+    selected = [name for name in SECTIONS if name in fields]
+    pairs = sql.SQL(', ').join(sql.SQL("{}, {}").format(sql.Literal(name), sql.SQL(SECTIONS[name])) for name in selected)
+    query = sql.SQL(BUNDLE_CTES + "SELECT json_build_object({})::text;").format(pairs)
+    with db_connection.cursor() as cur:
+        cur.execute(query, {'tenant_id': str(tenant_id), **kpi_metrics.kpi_params(date.today()), 'limit': limit, 'matrix_limit': matrix_limit})
+        return cur.fetchone()[0]
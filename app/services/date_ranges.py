@@ -0,0 +1,67 @@
+# Saas_GrapeIQ_V1.0/app/services/date_ranges.py
+
+# Selectores de periodo de la analítica (mes, trimestre, año) convertidos en rangos de fechas
+# semiabiertos [inicio, fin). Filtrar con `sale_date >= inicio AND sale_date < fin` deja usar el
+# índice (tenant_id, sale_date); expresiones como TO_CHAR(sale_date, 'YYYY-MM') = '...' no pueden.
+
+import re
+from datetime import date
+from typing import List, Optional, Tuple
+
+DateRange = Tuple[date, date]
+
+_PERIOD_PATTERNS = [
+    (re.compile(r"^(\d{4})$"), 'year'),
+    (re.compile(r"^(\d{4})-(0[1-9]|1[0-2])$"), 'month'),
+    (re.compile(r"^(\d{4})-[Qq]([1-4])$"), 'quarter'),
+]
+
+
+def month_range(year: int, month: int) -> DateRange:
+    start = date(year, month, 1)
+    return start, date(year + month // 12, month % 12 + 1, 1)
+
+
+def quarter_range(year: int, quarter: int) -> DateRange:
+    start, _ = month_range(year, 3 * quarter - 2)
+    _, end = month_range(year, 3 * quarter)
+    return start, end
+
+
+def year_range(year: int) -> DateRange:
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def previous_month_range(day: date) -> DateRange:
+    """Mes anterior al de `day`."""
+    return month_range(day.year - 1, 12) if day.month == 1 else month_range(day.year, day.month - 1)
+
+
+def parse_period(value: str) -> DateRange:
+    """'AAAA', 'AAAA-MM' o 'AAAA-Qn' como rango semiabierto."""
+    for pattern, kind in _PERIOD_PATTERNS:
+        match = pattern.match(value.strip())
+        if match:
+            numbers = [int(group) for group in match.groups()]
+            if kind == 'year': return year_range(*numbers)
+            if kind == 'month': return month_range(*numbers)
+            return quarter_range(*numbers)
+    raise ValueError(f"Periodo no válido: '{value}'. Usa AAAA, AAAA-MM o AAAA-Qn.")
+
+
+def resolve_period(month: Optional[str] = None, quarter: Optional[str] = None, year: Optional[str] = None) -> Optional[DateRange]:
+    """Rango del único selector informado (mes, trimestre o año), o None si no hay ninguno."""
+    selected = [(name, value) for name, value in (('month', month), ('quarter', quarter), ('year', year)) if value]
+    if not selected: return None
+    if len(selected) > 1: raise ValueError("Indica solo uno de: month, quarter, year.")
+    name, value = selected[0]
+    expected = {'month': r"^\d{4}-\d{2}$", 'quarter': r"^\d{4}-[Qq]\d$", 'year': r"^\d{4}$"}[name]
+    if not re.match(expected, value.strip()):
+        raise ValueError(f"Valor no válido para {name}: '{value}'.")
+    return parse_period(value)
+
+
+def range_clause(column: str, period: Optional[DateRange]) -> Tuple[str, List[date]]:
+    """Condición SQL sargable para `column` dentro del rango (vacía si no hay rango)."""
+    if period is None: return "", []
+    return f" AND {column} >= %s AND {column} < %s", [period[0], period[1]]
@@ -0,0 +1,106 @@
+# Saas_GrapeIQ_V1.0/app/services/event_calendar.py
+
+# Calendario de eventos y festivos para los pronósticos.
+# Los eventos especiales de cada tenant se cargan una vez y se guardan en memoria junto con
+# una versión (hash de la tabla 'special_events' del tenant); si los eventos cambian, la
+# versión cambia y el calendario se recarga. Los festivos nacionales de España se calculan
+# una sola vez por rango de años y se añaden al calendario, de modo que Prophet no tiene que
+# regenerarlos en cada ajuste con add_country_holidays.
+
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+COUNTRY = 'ES'
+# Horizonte máximo de pronóstico admitido por la API; los festivos se precalculan hasta cubrirlo
+MAX_HORIZON_DAYS = 365
+EVENT_CALENDAR_MAX_TENANTS = int(os.getenv("EVENT_CALENDAR_MAX_TENANTS", 256))
+
+EVENTS_VERSION_QUERY = """
+    SELECT md5(COALESCE(string_agg(event_name || '|' || start_date::text, ',' ORDER BY start_date, event_name), ''))
+    FROM special_events
+    WHERE tenant_id = %s;
+"""
+
+EVENTS_QUERY = """
+    SELECT event_name AS holiday, start_date AS ds
+    FROM special_events
+    WHERE tenant_id = %s
+    ORDER BY start_date;
+"""
+
+_tenant_events: "OrderedDict[str, Tuple[str, pd.DataFrame]]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _empty_events() -> pd.DataFrame:
+    return pd.DataFrame({'holiday': pd.Series(dtype=str), 'ds': pd.Series(dtype='datetime64[ns]')})
+
+
+@lru_cache(maxsize=32)
+def _country_holidays(first_year: int, last_year: int) -> pd.DataFrame:
+    """Festivos nacionales de COUNTRY para el rango de años (ambos incluidos)."""
+    from prophet.make_holidays import make_holidays_df
+    holidays = make_holidays_df(year_list=list(range(first_year, last_year + 1)), country=COUNTRY)
+    return holidays[['holiday', 'ds']]
+
+
+def get_tenant_events(db_connection, tenant_id) -> Tuple[str, pd.DataFrame]:
+    """Devuelve (versión, eventos) del tenant, desde memoria si la versión no ha cambiado.
+    El dataframe devuelto es compartido: no debe modificarse."""
+    tenant_key = str(tenant_id)
+    try:
+        with db_connection.cursor() as cur:
+            cur.execute(EVENTS_VERSION_QUERY, (tenant_key,))
+            version = cur.fetchone()[0]
+
+            with _lock:
+                cached = _tenant_events.get(tenant_key)
+                if cached is not None and cached[0] == version:
+                    _tenant_events.move_to_end(tenant_key)
+                    return cached
+
+            cur.execute(EVENTS_QUERY, (tenant_key,))
+            rows = cur.fetchall()
+    except Exception as e:
+        print(f"⚠️ No se pudieron cargar los eventos especiales: {e}")
+        return 'sin-eventos', _empty_events()
+
+    events = pd.DataFrame(rows, columns=['holiday', 'ds']) if rows else _empty_events()
+    events['ds'] = pd.to_datetime(events['ds'])
+
+    with _lock:
+        _tenant_events[tenant_key] = (version, events)
+        _tenant_events.move_to_end(tenant_key)
+        while len(_tenant_events) > EVENT_CALENDAR_MAX_TENANTS:
+            _tenant_events.popitem(last=False)
+    return version, events
+
+
+def invalidate_tenant(tenant_id) -> None:
+    """Descarta el calendario en memoria de un tenant (p. ej. tras editar sus eventos)."""
+    with _lock:
+        _tenant_events.pop(str(tenant_id), None)
+
+
+def build_holidays(
+    tenant_events: pd.DataFrame,
+    first_date,
+    last_date,
+    future_events: Optional[List[Dict]] = None
+) -> pd.DataFrame:
+    """Calendario completo para Prophet: eventos del tenant, eventos futuros del escenario y
+    festivos nacionales desde el inicio del histórico hasta el final del horizonte máximo."""
+    last_year = (pd.Timestamp(last_date) + pd.Timedelta(days=MAX_HORIZON_DAYS)).year
+    frames = [tenant_events, _country_holidays(pd.Timestamp(first_date).year, last_year)]
+
+    if future_events:
+        user_events = pd.DataFrame(future_events)[['holiday', 'ds']]
+        user_events['ds'] = pd.to_datetime(user_events['ds'])
+        frames.append(user_events)
+
+    return pd.concat(frames, ignore_index=True)
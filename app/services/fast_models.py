@@ -0,0 +1,138 @@
+# Saas_GrapeIQ_V1.0/app/services/fast_models.py
+
+# Modelos de pronóstico ligeros, solo con numpy, para series con poco volumen.
+# Se ajustan en milisegundos y exponen la misma interfaz que usa advanced_forecast con
+# Prophet: fit(df) y predict(future) -> dataframe con ds, yhat, yhat_lower, yhat_upper,
+# trend, yearly y weekly, además de `component_modes`. Ignoran los regresores externos.
+
+from statistics import NormalDist
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+SEASON = 7 # Estacionalidad semanal
+
+
+def _complete_daily(df: pd.DataFrame):
+    """Serie diaria completa: los días sin ventas (que no llegan de la consulta) valen 0."""
+    daily = df.set_index('ds')['y'].astype(np.float64)
+    index = pd.date_range(daily.index.min(), daily.index.max(), freq='D')
+    return index, daily.reindex(index, fill_value=0.0).to_numpy()
+
+
+def _z_score(interval_width: float) -> float:
+    return NormalDist().inv_cdf(0.5 + interval_width / 2)
+
+
+class _FastModel:
+    name = None
+    # Sin regresores: el componente 'regressors' de la respuesta es 0
+    component_modes = {'additive': [], 'multiplicative': []}
+
+    def __init__(self, interval_width: float = 0.90):
+        self.interval_width = interval_width
+
+    def _horizon(self, future: pd.DataFrame) -> np.ndarray:
+        return (future['ds'] - self.last_date).dt.days.to_numpy()
+
+    def _frame(self, future: pd.DataFrame, trend: np.ndarray, weekly: np.ndarray, spread: np.ndarray) -> pd.DataFrame:
+        yhat = trend + weekly
+        return pd.DataFrame({
+            'ds': future['ds'].to_numpy(),
+            'yhat': yhat,
+            'yhat_lower': yhat - spread,
+            'yhat_upper': yhat + spread,
+            'trend': trend,
+            'yearly': np.zeros_like(yhat),
+            'weekly': weekly,
+        })
+
+
+class SeasonalNaiveModel(_FastModel):
+    """Repite el perfil semanal medio de las últimas `seasons` semanas."""
+    name = 'seasonal_naive'
+
+    def __init__(self, interval_width: float = 0.90, seasons: int = 4):
+        super().__init__(interval_width)
+        self.seasons = seasons
+
+    def fit(self, df: pd.DataFrame):
+        index, y = _complete_daily(df)
+        self.last_date = index[-1]
+        weeks = max(1, min(self.seasons, len(y) // SEASON))
+        tail = y[-weeks * SEASON:]
+        if len(tail) < SEASON: tail = np.resize(tail, SEASON)
+        # La última columna corresponde a last_date
+        self.profile = tail.reshape(-1, SEASON).mean(axis=0)
+        residuals = y[SEASON:] - y[:-SEASON]
+        self.sigma = float(residuals.std()) if residuals.size else float(y.std())
+        return self
+
+    def predict(self, future: pd.DataFrame) -> pd.DataFrame:
+        h = self._horizon(future)
+        values = self.profile[(h - 1) % SEASON]
+        level = np.full(len(h), self.profile.mean())
+        spread = _z_score(self.interval_width) * self.sigma * np.sqrt(np.ceil(h / SEASON))
+        return self._frame(future, level, values - level, spread)
+
+
+ALPHAS = np.array([0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.7])
+
+
+def fit_exp_smoothing(Y: np.ndarray, weekday: np.ndarray, seasonal_weeks: int = 26) -> Dict[str, np.ndarray]:
+    """Suavizado exponencial simple con efecto aditivo por día de la semana, vectorizado sobre
+    las filas de Y (una serie diaria completa por fila, todas con las mismas fechas). El alfa
+    de cada serie se elige por mínimo error cuadrático a un paso en la rejilla ALPHAS.
+    Devuelve por serie: offsets (n x 7), alpha, level (último nivel) y errors (errores a un paso)."""
+    from scipy.signal import lfilter
+
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    recent = slice(-seasonal_weeks * SEASON, None)
+    Y_recent, weekday_recent = Y[:, recent], weekday[recent]
+    mean_recent = Y_recent.mean(axis=1, keepdims=True)
+    offsets = np.zeros((Y.shape[0], SEASON))
+    for day in range(SEASON):
+        mask = weekday_recent == day
+        if mask.any(): offsets[:, day] = Y_recent[:, mask].mean(axis=1) - mean_recent[:, 0]
+    adjusted = Y - offsets[:, weekday]
+
+    # level_t = alpha * x_t + (1 - alpha) * level_{t-1}, para todas las series a la vez
+    best_sse = np.full(Y.shape[0], np.inf)
+    alpha, level = np.zeros(Y.shape[0]), np.zeros(Y.shape[0])
+    errors = np.zeros((Y.shape[0], max(Y.shape[1] - 1, 0)))
+    for candidate in ALPHAS:
+        levels = lfilter([candidate], [1, candidate - 1], adjusted, axis=1, zi=(1 - candidate) * adjusted[:, :1])[0]
+        candidate_errors = adjusted[:, 1:] - levels[:, :-1]
+        sse = np.einsum('ij,ij->i', candidate_errors, candidate_errors)
+        better = sse < best_sse
+        best_sse[better], alpha[better], level[better] = sse[better], candidate, levels[better, -1]
+        errors[better] = candidate_errors[better]
+    return {'offsets': offsets, 'alpha': alpha, 'level': level, 'errors': errors}
+
+
+class ExponentialSmoothingModel(_FastModel):
+    """Suavizado exponencial simple sobre la serie desestacionalizada (efecto aditivo por día
+    de la semana). El alfa se elige por mínimo error cuadrático a un paso en una rejilla."""
+    name = 'exp_smoothing'
+
+    def __init__(self, interval_width: float = 0.90, seasonal_weeks: int = 26):
+        super().__init__(interval_width)
+        self.seasonal_weeks = seasonal_weeks
+
+    def fit(self, df: pd.DataFrame):
+        index, y = _complete_daily(df)
+        self.last_date = index[-1]
+        fitted = fit_exp_smoothing(y, index.weekday.to_numpy(), self.seasonal_weeks)
+        self.offsets = fitted['offsets'][0]
+        self.alpha, self.level = float(fitted['alpha'][0]), float(fitted['level'][0])
+        errors = fitted['errors'][0]
+        self.sigma = float(errors.std()) if errors.size else 0.0
+        return self
+
+    def predict(self, future: pd.DataFrame) -> pd.DataFrame:
+        h = self._horizon(future)
+        weekly = self.offsets[future['ds'].dt.weekday.to_numpy()]
+        level = np.full(len(h), self.level)
+        spread = _z_score(self.interval_width) * self.sigma * np.sqrt(1 + (h - 1) * self.alpha ** 2)
+        return self._frame(future, level, weekly, spread)
@@ -0,0 +1,226 @@
+# Saas_GrapeIQ_V1.0/app/services/forecast_backtest.py
+
+# Backtesting del pronóstico: validación cruzada con origen móvil (rolling origin).
+# Para cada configuración y cada corte se entrena con los datos hasta el corte, se predicen
+# los `horizon` días siguientes con los regresores proyectados igual que en producción y se
+# compara con lo vendido. Las tareas (configuración x corte) se reparten en un pool de procesos
+# y no usan la base de datos: los datos se cargan una sola vez antes de empezar.
+# El resultado es un JSON estable (claves ordenadas, cifras redondeadas) para poder comparar
+# dos ejecuciones en una revisión con compare_results.
+
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from . import advanced_forecast, event_calendar
+
+RESULTS_SCHEMA_VERSION = 1
+
+# 'produccion' reproduce la configuración actual de advanced_forecast; el resto son variantes
+# habituales para comparar. Cada configuración puede sobrescribir parámetros de Prophet,
+# elegir los regresores base y activar o no los regresores por canal.
+DEFAULT_CONFIGS = [
+    {'name': 'produccion'},
+    {'name': 'sin_canales', 'use_channels': False},
+    {'name': 'changepoints_suaves', 'prophet': {'changepoint_prior_scale': 0.05}},
+]
+
+
+def load_series(db_connection, tenant_id, product_id=None) -> Optional[Dict]:
+    """Carga la serie diaria y el calendario de eventos tal y como los usa el pronóstico."""
+    query, params = advanced_forecast._series_query(advanced_forecast.TRAINING_QUERY, tenant_id, product_id)
+    df, channel_columns = advanced_forecast._load_training_frame(db_connection, query, params)
+    if df is None: return None
+    _, tenant_events = event_calendar.get_tenant_events(db_connection, tenant_id)
+    return {
+        'tenant_id': str(tenant_id),
+        'series': advanced_forecast._series_key(product_id),
+        'df': df,
+        'channel_columns': channel_columns,
+        'holidays': event_calendar.build_holidays(tenant_events, df['ds'].min(), df['ds'].max()),
+        'climatology': advanced_forecast.get_temperature_climatology(db_connection, tenant_id),
+    }
+
+
+def rolling_origin_cutoffs(df: pd.DataFrame, folds: int, horizon: int, step: Optional[int] = None) -> List[pd.Timestamp]:
+    """Fechas de corte, de la más antigua a la más reciente. El último corte deja `horizon`
+    días de prueba al final del histórico; los anteriores retroceden `step` días cada uno."""
+    step = step or horizon
+    last_cutoff = df['ds'].max() - pd.Timedelta(days=horizon)
+    cutoffs = [last_cutoff - pd.Timedelta(days=step * i) for i in range(folds)]
+    return sorted(c for c in cutoffs if c > df['ds'].min())
+
+
+def _error_metrics(actual: np.ndarray, predicted: np.ndarray) -> Dict:
+    nonzero = actual != 0
+    mape = float(np.mean(np.abs(actual[nonzero] - predicted[nonzero]) / np.abs(actual[nonzero])) * 100) if nonzero.any() else None
+    denominator = np.abs(actual) + np.abs(predicted)
+    valid = denominator > 0
+    smape = float(np.mean(2 * np.abs(actual[valid] - predicted[valid]) / denominator[valid]) * 100) if valid.any() else None
+    return {'mape': mape, 'smape': smape}
+
+
+def _max_rss_mb() -> float:
+    # Pico de memoria residente del proceso trabajador, que solo ejecuta una tarea (max_tasks_per_child=1).
+    # En Linux ru_maxrss está en KB; en macOS, en bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def _evaluate_fold(config: Dict, series: Dict, cutoff: pd.Timestamp, horizon: int) -> Dict:
+    """Entrena y evalúa una configuración en un corte. Se ejecuta en un proceso del pool."""
+    from prophet import Prophet
+
+    df = series['df']
+    train = df[df['ds'] <= cutoff]
+    test = df[(df['ds'] > cutoff) & (df['ds'] <= cutoff + pd.Timedelta(days=horizon))]
+    channel_columns = series['channel_columns'] if config.get('use_channels', True) else []
+    regressors = config.get('regressors', advanced_forecast.BASE_REGRESSORS) + channel_columns
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    model = Prophet(holidays=series['holidays'], **{**advanced_forecast.PROPHET_PARAMS, **config.get('prophet', {})})
+    for regressor in regressors: model.add_regressor(regressor)
+    model.fit(train[['ds', 'y'] + regressors])
+    fit_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    # Misma proyección de regresores (y misma semilla que en producción) en todas las configuraciones de un corte
+    stats = advanced_forecast._regressor_stats(train, series['channel_columns'], series.get('climatology'))
+    # El histórico solo tiene los días con ventas: la proyección empieza tras la última venta, que
+    # puede ser anterior al corte, así que se alarga hasta cubrir la ventana completa del corte
+    gap_days = max(0, (cutoff - pd.to_datetime(stats['last_date'])).days)
+    future = advanced_forecast._base_future_frame(
+        stats, horizon + gap_days, advanced_forecast.projection_seed(series['tenant_id'], series['series'], horizon)
+    )
+    future = future[future['ds'] > cutoff]
+    forecast = model.predict(future[['ds'] + regressors])
+    predict_seconds = time.perf_counter() - started
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    merged = test[['ds', 'y']].merge(forecast[['ds', 'yhat']], on='ds', how='inner')
+    return {
+        'config': config['name'],
+        'cutoff': cutoff.strftime('%Y-%m-%d'),
+        'test_days': len(merged),
+        **_error_metrics(merged['y'].to_numpy(dtype=np.float64), np.maximum(0, merged['yhat'].to_numpy(dtype=np.float64))),
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+        'peak_python_mb': peak_traced / (1024 * 1024),
+        'max_rss_mb': _max_rss_mb(),
+    }
+
+
+def _summarize(folds: List[Dict]) -> Dict:
+    def mean(key):
+        values = [fold[key] for fold in folds if fold[key] is not None]
+        return float(np.mean(values)) if values else None
+    return {
+        'mape': mean('mape'),
+        'smape': mean('smape'),
+        'fit_seconds': mean('fit_seconds'),
+        'predict_seconds': mean('predict_seconds'),
+        'peak_python_mb': max(fold['peak_python_mb'] for fold in folds),
+        'max_rss_mb': max(fold['max_rss_mb'] for fold in folds),
+    }
+
+
+def _rounded(value):
+    if isinstance(value, float): return round(value, 4)
+    if isinstance(value, dict): return {k: _rounded(v) for k, v in value.items()}
+    if isinstance(value, list): return [_rounded(v) for v in value]
+    return value
+
+
+def run_backtest(
+    series: Dict,
+    configs: Optional[List[Dict]] = None,
+    folds: int = 4,
+    horizon: int = 30,
+    step: Optional[int] = None,
+    max_workers: Optional[int] = None
+) -> Dict:
+    """Ejecuta todas las combinaciones configuración x corte en paralelo y devuelve el informe."""
+    configs = configs or DEFAULT_CONFIGS
+    cutoffs = rolling_origin_cutoffs(series['df'], folds, horizon, step)
+    if not cutoffs: raise ValueError("El histórico es demasiado corto para los cortes y el horizonte pedidos.")
+
+    started = time.perf_counter()
+    # Un proceso nuevo por tarea: ru_maxrss es el pico de toda la vida del proceso y, si se reutilizara,
+    # arrastraría la memoria de los ajustes anteriores
+    with ProcessPoolExecutor(
+        max_workers=max_workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1
+    ) as executor:
+        tasks = [(config, executor.submit(_evaluate_fold, config, series, cutoff, horizon)) for config in configs for cutoff in cutoffs]
+        fold_results = {}
+        for config, task in tasks:
+            fold_results.setdefault(config['name'], []).append(task.result())
+
+    import prophet
+    report = {
+        'schema_version': RESULTS_SCHEMA_VERSION,
+        'generated_at': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'environment': {
+            'python': platform.python_version(),
+            'prophet': prophet.__version__,
+            'pandas': pd.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'series': series['series'],
+        'history_days': len(series['df']),
+        'folds': len(cutoffs),
+        'horizon': horizon,
+        'step': step or horizon,
+        'elapsed_seconds': time.perf_counter() - started,
+        'configs': [
+            {
+                'name': config['name'],
+                'params': {k: v for k, v in config.items() if k != 'name'},
+                'summary': _summarize(fold_results[config['name']]),
+                'folds': fold_results[config['name']],
+            }
+            for config in configs
+        ],
+    }
+    return _rounded(report)
+
+
+def save_results(report: Dict, path: str) -> None:
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2, sort_keys=True, ensure_ascii=False)
+        fh.write('\n')
+
+
+def compare_results(baseline: Dict, candidate: Dict, accuracy_tolerance: float = 0.5, speed_tolerance: float = 0.2) -> List[Dict]:
+    """Compara dos informes configuración a configuración. Marca como regresión un aumento del
+    sMAPE de más de `accuracy_tolerance` puntos o del tiempo de ajuste de más de `speed_tolerance` (20%)."""
+    previous = {config['name']: config['summary'] for config in baseline['configs']}
+    rows = []
+    for config in candidate['configs']:
+        old = previous.get(config['name'])
+        if old is None: continue
+        new = config['summary']
+        row = {'config': config['name']}
+        for metric in ('mape', 'smape', 'fit_seconds', 'predict_seconds', 'peak_python_mb', 'max_rss_mb'):
+            if old.get(metric) is not None and new.get(metric) is not None:
+                row[metric] = {'before': old[metric], 'after': new[metric], 'delta': round(new[metric] - old[metric], 4)}
+        regressions = []
+        if 'smape' in row and row['smape']['delta'] > accuracy_tolerance:
+            regressions.append('precisión')
+        if 'fit_seconds' in row and old['fit_seconds'] > 0 and row['fit_seconds']['delta'] / old['fit_seconds'] > speed_tolerance:
+            regressions.append('velocidad')
+        row['regressions'] = regressions
+        rows.append(row)
+    return rows
@@ -0,0 +1,136 @@
+# Saas_GrapeIQ_V1.0/app/services/forecast_cache.py
+
+# Almacén persistente de modelos Prophet ya entrenados.
+# Cada modelo se guarda en disco (JSON de Prophet + metadatos) bajo una clave que combina
+# tenant, serie ('total' o product_id), marca de agua de los datos e hiperparámetros.
+# Como la marca de agua forma parte de la clave, la llegada de nuevas ventas produce una
+# clave distinta y el modelo antiguo deja de servirse tal cual, aunque se conserva como punto
+# de partida del refresco incremental (load_latest). Se guarda la última versión de cada
+# combinación serie + hiperparámetros (params_key). El disco se acota con expulsión LRU.
+
+import os
+import json
+import glob
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Optional, Tuple
+
+MODEL_CACHE_DIR = os.getenv("FORECAST_MODEL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "grapeiq_forecast_models"))
+MODEL_CACHE_MAX_ENTRIES = int(os.getenv("FORECAST_MODEL_CACHE_MAX_ENTRIES", 200))
+
+_lock = threading.Lock()
+
+
+def _digest(value: str, length: int) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()[:length]
+
+
+def _series_prefix(tenant_id, series: str) -> str:
+    """Prefijo de fichero común a todas las versiones de una misma serie."""
+    return f"{_digest(str(tenant_id), 12)}_{_digest(str(series), 12)}"
+
+
+def build_cache_key(tenant_id, series: str, watermark, params: Dict) -> str:
+    """Clave determinista para (tenant, serie, marca de agua, hiperparámetros)."""
+    raw = json.dumps(
+        {"tenant": str(tenant_id), "series": str(series), "watermark": watermark, "params": params},
+        sort_keys=True, default=str
+    )
+    return _digest(raw, 32)
+
+
+def _variant_prefix(tenant_id, series: str, params_key: str) -> str:
+    """Prefijo de fichero de todas las versiones de una serie con unos mismos hiperparámetros."""
+    return f"{_series_prefix(tenant_id, series)}_{params_key[:12]}"
+
+
+def _path_for(tenant_id, series: str, params_key: str, key: str) -> str:
+    return os.path.join(MODEL_CACHE_DIR, f"{_variant_prefix(tenant_id, series, params_key)}_{key}.json")
+
+
+def load_model(tenant_id, series: str, params_key: str, key: str) -> Optional[Tuple[object, Dict]]:
+    """Devuelve (modelo, metadatos) si existe en disco, o None."""
+    from prophet.serialize import model_from_json
+
+    path = _path_for(tenant_id, series, params_key, key)
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            payload = json.load(fh)
+        # Se actualiza la fecha de modificación para que la expulsión sea LRU
+        os.utime(path, None)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        return model_from_json(payload["model"]), payload.get("metadata", {})
+    except Exception as e:
+        print(f"⚠️ Modelo en caché corrupto ({path}), se descarta: {e}")
+        _remove(path)
+        return None
+
+
+def load_latest(tenant_id, series: str, params_key: str) -> Optional[Tuple[object, Dict]]:
+    """Último modelo guardado de la serie, con independencia de la marca de agua, siempre que
+    se entrenara con los mismos hiperparámetros. Es el punto de partida del refresco incremental."""
+    from prophet.serialize import model_from_json
+
+    paths = glob.glob(os.path.join(MODEL_CACHE_DIR, f"{_variant_prefix(tenant_id, series, params_key)}_*.json"))
+    for path in sorted(paths, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0, reverse=True):
+        try:
+            with open(path, "r", encoding="utf-8") as fh:
+                payload = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        try:
+            return model_from_json(payload["model"]), payload.get("metadata", {})
+        except Exception as e:
+            print(f"⚠️ Modelo en caché corrupto ({path}), se descarta: {e}")
+            _remove(path)
+    return None
+
+
+def save_model(tenant_id, series: str, params_key: str, key: str, model, metadata: Dict) -> None:
+    """Serializa el modelo en disco, elimina versiones antiguas de la serie y aplica LRU."""
+    from prophet.serialize import model_to_json
+
+    payload = json.dumps({"model": model_to_json(model), "metadata": metadata}, default=str)
+    path = _path_for(tenant_id, series, params_key, key)
+
+    with _lock:
+        os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=MODEL_CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(payload)
+        os.replace(tmp_path, path)
+
+        # Cualquier otra versión de la misma serie y configuración corresponde a datos ya superados
+        for stale in glob.glob(os.path.join(MODEL_CACHE_DIR, f"{_variant_prefix(tenant_id, series, params_key)}_*.json")):
+            if stale != path:
+                _remove(stale)
+
+        _evict_lru()
+
+
+def invalidate_tenant(tenant_id) -> None:
+    """Borra del disco todos los modelos de un tenant (tras reemplazar sus ventas, ya no sirven
+    ni como punto de partida del refresco incremental)."""
+    with _lock:
+        for path in glob.glob(os.path.join(MODEL_CACHE_DIR, f"{_digest(str(tenant_id), 12)}_*.json")):
+            _remove(path)
+
+
+def _evict_lru() -> None:
+    entries = glob.glob(os.path.join(MODEL_CACHE_DIR, "*.json"))
+    if len(entries) <= MODEL_CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+    for path in entries[:len(entries) - MODEL_CACHE_MAX_ENTRIES]:
+        _remove(path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
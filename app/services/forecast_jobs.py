@@ -0,0 +1,298 @@
+# Saas_GrapeIQ_V1.0/app/services/forecast_jobs.py
+
+# Cola asíncrona de trabajos de pronóstico.
+# La API solo inserta el trabajo en la tabla 'forecast_jobs' y lo encola; un pool de procesos
+# ejecuta Prophet fuera del proceso HTTP. Cada proceso trabajador tiene su propio pool de
+# conexiones y solo las usa para cargar datos y guardar el resultado, nunca durante el ajuste.
+# Los pronósticos masivos del catálogo ('kind': 'batch') y los jerárquicos ('kind': 'hierarchy')
+# usan la misma tabla y el mismo límite por tenant, pero su coordinador corre en un hilo de la API
+# y reparte los ajustes en el pool.
+
+import os
+import json
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+from psycopg2.extras import Json, RealDictCursor
+
+from .. import database
+
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+MAX_JOBS_PER_TENANT = int(os.getenv("FORECAST_MAX_JOBS_PER_TENANT", 2))
+JOB_TIMEOUT_MINUTES = int(os.getenv("FORECAST_JOB_TIMEOUT_MINUTES", 30))
+# Con FORECAST_WARMUP=true cada proceso trabajador precarga Prophet y ajusta un modelo mínimo al arrancar
+WARMUP = os.getenv("FORECAST_WARMUP", "false").lower() == "true"
+ACTIVE_STATUSES = ('queued', 'running')
+
+_executor = None
+_futures = {}
+_lock = threading.Lock()
+
+
+class TenantJobLimitError(Exception):
+    """El tenant ya tiene el máximo de trabajos de pronóstico activos."""
+
+
+def _init_worker():
+    database.connect_to_db()
+    if WARMUP:
+        from . import advanced_forecast
+        try:
+            print(f"🔥 Proceso de pronóstico {os.getpid()} precalentado en {advanced_forecast.warm_up():.2f} s")
+        except Exception as e:
+            print(f"⚠️ Falló el precalentamiento de Prophet: {e}")
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def warm_up_workers() -> None:
+    """Arranca ya todos los procesos del pool (y su precalentamiento) para que el primer
+    trabajo no pague el arranque. No bloquea: los procesos se inician en segundo plano."""
+    executor = get_executor()
+    for _ in range(FORECAST_WORKERS):
+        executor.submit(_ping)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            # 'spawn' evita heredar los sockets del pool de conexiones del proceso padre
+            _executor = ProcessPoolExecutor(
+                max_workers=FORECAST_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        return _executor
+
+
+def shutdown():
+    """Detiene el pool de procesos descartando los trabajos que aún no han empezado."""
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _register_job(tenant_id, params: Dict) -> str:
+    """Inserta el trabajo en 'forecast_jobs' en estado 'queued'. Lanza TenantJobLimitError si el
+    tenant está al límite."""
+    tenant_id_str = str(tenant_id)
+    with database.get_db_connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                # Serializa los envíos de un mismo tenant para que el límite sea exacto
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (tenant_id_str,))
+                # Los trabajos huérfanos (p. ej. tras reiniciar la API) no deben bloquear al tenant
+                cur.execute(
+                    """
+                    UPDATE forecast_jobs SET status = 'failed', error = 'Tiempo de ejecución agotado.', finished_at = NOW()
+                    WHERE tenant_id = %s AND status IN %s AND created_at < NOW() - make_interval(mins => %s)
+                    """,
+                    (tenant_id_str, ACTIVE_STATUSES, JOB_TIMEOUT_MINUTES)
+                )
+                cur.execute(
+                    "SELECT COUNT(*) FROM forecast_jobs WHERE tenant_id = %s AND status IN %s",
+                    (tenant_id_str, ACTIVE_STATUSES)
+                )
+                if cur.fetchone()[0] >= MAX_JOBS_PER_TENANT:
+                    raise TenantJobLimitError(f"Máximo de {MAX_JOBS_PER_TENANT} pronósticos simultáneos por cuenta.")
+                job_id = str(uuid.uuid4())
+                cur.execute(
+                    """
+                    INSERT INTO forecast_jobs (id, tenant_id, status, progress, params, created_at)
+                    VALUES (%s, %s, 'queued', 0, %s, NOW())
+                    """,
+                    (job_id, tenant_id_str, Json(params))
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return job_id
+
+
+def submit_job(tenant_id, params: Dict) -> str:
+    """Registra un trabajo y lo encola. Lanza TenantJobLimitError si el tenant está al límite."""
+    job_id = _register_job(tenant_id, params)
+    future = get_executor().submit(run_job, job_id)
+    with _lock:
+        _futures[job_id] = future
+    future.add_done_callback(lambda _: _futures.pop(job_id, None))
+    return job_id
+
+
+def submit_batch_job(tenant_id, periods: int, only_changed: bool = False) -> str:
+    """Registra un pronóstico masivo del catálogo y lo lanza en segundo plano. El reparto de las
+    series se hace en un hilo de la API, porque los ajustes de Prophet van al pool de procesos
+    compartido y un proceso trabajador no puede repartir trabajo en ese pool."""
+    job_id = _register_job(tenant_id, {'kind': 'batch', 'periods': periods, 'only_changed': only_changed})
+    threading.Thread(target=run_batch_job, args=(job_id,), name=f"forecast-batch-{job_id}", daemon=True).start()
+    return job_id
+
+
+def submit_hierarchy_job(tenant_id, periods: int, method: str, base_model: str) -> str:
+    """Registra un pronóstico jerárquico y lo lanza en segundo plano, como submit_batch_job:
+    con Prophet son tantos ajustes como nodos tenga la jerarquía."""
+    job_id = _register_job(tenant_id, {'kind': 'hierarchy', 'periods': periods, 'method': method, 'base_model': base_model})
+    threading.Thread(target=run_hierarchy_job, args=(job_id,), name=f"forecast-hierarchy-{job_id}", daemon=True).start()
+    return job_id
+
+
+def get_job(tenant_id, job_id: str) -> Optional[Dict]:
+    query = """
+        SELECT id AS job_id, status, progress, error, result, created_at, started_at, finished_at
+        FROM forecast_jobs WHERE id = %s AND tenant_id = %s
+    """
+    with database.get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(query, (str(job_id), str(tenant_id)))
+            return cur.fetchone()
+
+
+def cancel_job(tenant_id, job_id: str) -> Optional[Dict]:
+    """Marca el trabajo como cancelado. Si aún no ha empezado, se retira de la cola; si ya está
+    en ejecución, el trabajador lo abandona en el siguiente punto de control."""
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE forecast_jobs SET status = 'cancelled', finished_at = NOW()
+                WHERE id = %s AND tenant_id = %s AND status IN %s
+                """,
+                (str(job_id), str(tenant_id), ACTIVE_STATUSES)
+            )
+        conn.commit()
+
+    with _lock:
+        future = _futures.get(str(job_id))
+    if future is not None:
+        future.cancel()
+    return get_job(tenant_id, job_id)
+
+
+# --- Código que se ejecuta en los procesos trabajadores ---
+
+def _set_progress(job_id: str, progress: int) -> bool:
+    """Actualiza el progreso. Devuelve False si el trabajo ya no está en ejecución (cancelado)."""
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE forecast_jobs SET progress = %s WHERE id = %s AND status = 'running' RETURNING id",
+                (progress, job_id)
+            )
+            still_running = cur.fetchone() is not None
+        conn.commit()
+    return still_running
+
+
+def _finish_job(job_id: str, status: str, result: Optional[Dict] = None, error: Optional[str] = None):
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE forecast_jobs
+                SET status = %s, progress = CASE WHEN %s = 'completed' THEN 100 ELSE progress END,
+                    result = %s, error = %s, finished_at = NOW()
+                WHERE id = %s AND status = 'running'
+                """,
+                (status, status, Json(result) if result is not None else None, error, job_id)
+            )
+        conn.commit()
+
+
+def _start_job(conn, job_id: str) -> Optional[Dict]:
+    """Pasa el trabajo a 'running'. Devuelve None si se canceló antes de empezar."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(
+            """
+            UPDATE forecast_jobs SET status = 'running', started_at = NOW(), progress = 5
+            WHERE id = %s AND status = 'queued' RETURNING tenant_id, params
+            """,
+            (job_id,)
+        )
+        job = cur.fetchone()
+    conn.commit()
+    return job
+
+
+def run_batch_job(job_id: str):
+    """Ejecuta un pronóstico masivo del catálogo (hilo de la API; ver submit_batch_job).
+    La cancelación solo tiene efecto antes de empezar: el lote en curso termina y se guarda."""
+    from . import advanced_forecast
+
+    try:
+        with database.get_db_connection() as conn:
+            job = _start_job(conn, job_id)
+        if job is None: return
+        params = job['params']
+        summary = advanced_forecast.run_batch_forecast(
+            job['tenant_id'], params.get('periods', 90), executor=get_executor(), only_changed=params.get('only_changed', False)
+        )
+        _finish_job(job_id, 'completed', result=summary)
+    except Exception as e:
+        print(f"❌ Error en el pronóstico masivo {job_id}: {e}")
+        _finish_job(job_id, 'failed', error=str(e))
+
+
+def run_hierarchy_job(job_id: str):
+    """Ejecuta un pronóstico jerárquico (hilo de la API; ver submit_hierarchy_job)."""
+    from . import hierarchical_forecast
+    from ..responses import dumps
+
+    try:
+        with database.get_db_connection() as conn:
+            job = _start_job(conn, job_id)
+            if job is None: return
+            params = job['params']
+            inputs = hierarchical_forecast.load_inputs(conn, job['tenant_id'], params['base_model'])
+        if inputs is None:
+            _finish_job(job_id, 'failed', error="No hay ventas para generar el pronóstico jerárquico.")
+            return
+        result = hierarchical_forecast.run_hierarchical_forecast(
+            inputs, params.get('periods', 90), params['method'], params['base_model'], get_executor()
+        )
+        # Los niveles son arrays de numpy: se pasan a listas para guardarlos en JSONB
+        _finish_job(job_id, 'completed', result=json.loads(dumps(result)))
+    except Exception as e:
+        print(f"❌ Error en el pronóstico jerárquico {job_id}: {e}")
+        _finish_job(job_id, 'failed', error=str(e))
+
+
+def run_job(job_id: str):
+    """Ejecuta un trabajo de pronóstico dentro de un proceso trabajador."""
+    from . import advanced_forecast
+
+    try:
+        with database.get_db_connection() as conn:
+            job = _start_job(conn, job_id)
+            if job is None:
+                return # Cancelado antes de empezar
+
+            params = job['params']
+            product_id = params.get('product_id')
+            product_uuid = uuid.UUID(product_id) if product_id and product_id != 'total' else None
+            scenario = {'future_events': params.get('future_events', []), 'future_regressors': params.get('future_regressors', [])}
+            prepared = advanced_forecast.prepare_scenarios(conn, job['tenant_id'], product_uuid, [scenario])
+
+        # A partir de aquí no se retiene ninguna conexión durante el ajuste del modelo
+        if not _set_progress(job_id, 30): return
+
+        periods = params.get('periods', 90)
+        results = advanced_forecast.execute_scenarios(prepared, periods)
+        forecast_df, component_modes, metadata = results[0] if results else (None, None, None)
+        if not _set_progress(job_id, 90): return
+
+        output = advanced_forecast.format_forecast_output(forecast_df, component_modes, periods, metadata)
+        if output is None:
+            _finish_job(job_id, 'failed', error="No se pudo generar el pronóstico. Datos insuficientes o producto no encontrado.")
+        else:
+            _finish_job(job_id, 'completed', result=output.model_dump())
+    except Exception as e:
+        print(f"❌ Error en el trabajo de pronóstico {job_id}: {e}")
+        _finish_job(job_id, 'failed', error=str(e))
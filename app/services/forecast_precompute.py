@@ -0,0 +1,100 @@
+# Saas_GrapeIQ_V1.0/app/services/forecast_precompute.py
+
+# Precálculo programado (nocturno) de los pronósticos de todos los tenants.
+# Para cada tenant se ejecuta el pronóstico masivo (run_batch_forecast), que guarda en la
+# tabla 'forecasts' el total y cada SKU con su model_version y generated_at; los GET de
+# /api/forecast los sirven desde ahí.
+# - Reanudable: el estado de cada tenant en la ejecución del día se guarda en
+#   'forecast_precompute_runs'; al relanzar se omiten los tenants ya completados, y dentro de
+#   un tenant las series cuya marca de agua no ha cambiado (only_changed).
+# - Particionado: con `shard_count` > 1 cada proceso solo atiende a los tenants cuyo hash cae
+#   en su partición, de modo que varios procesos pueden repartirse la ejecución sin coordinarse.
+
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional
+from psycopg2.extras import Json
+
+from .. import database
+from . import advanced_forecast
+
+PENDING_TENANTS_QUERY = """
+    SELECT t.id
+    FROM tenants t
+    LEFT JOIN forecast_precompute_runs r ON r.tenant_id = t.id AND r.run_date = %s AND r.status = 'completed'
+    WHERE r.tenant_id IS NULL
+    ORDER BY t.id;
+"""
+
+MARK_RUNNING = """
+    INSERT INTO forecast_precompute_runs (run_date, tenant_id, status, started_at) VALUES (%s, %s, 'running', NOW())
+    ON CONFLICT (run_date, tenant_id) DO UPDATE
+    SET status = 'running', summary = NULL, error = NULL, started_at = NOW(), finished_at = NULL;
+"""
+
+MARK_FINISHED = """
+    UPDATE forecast_precompute_runs SET status = %s, summary = %s, error = %s, finished_at = NOW()
+    WHERE run_date = %s AND tenant_id = %s;
+"""
+
+
+def tenant_shard(tenant_id, shard_count: int) -> int:
+    """Partición estable de un tenant (no depende del orden ni del número de tenants)."""
+    return int(hashlib.sha256(str(tenant_id).encode("utf-8")).hexdigest(), 16) % shard_count
+
+
+def pending_tenants(run_date: date, shard_index: int = 0, shard_count: int = 1) -> List[str]:
+    """Tenants de la partición que aún no han completado la ejecución de `run_date`."""
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(PENDING_TENANTS_QUERY, (run_date,))
+            tenant_ids = [str(row[0]) for row in cur.fetchall()]
+    return [tenant_id for tenant_id in tenant_ids if tenant_shard(tenant_id, shard_count) == shard_index]
+
+
+def _mark(query: str, params) -> None:
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+        conn.commit()
+
+
+def run_precompute(
+    run_date: Optional[date] = None,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    periods: int = 90,
+    max_workers: Optional[int] = None,
+    force: bool = False
+) -> Dict:
+    """Precalcula los pronósticos de los tenants pendientes de la partición. Un pool de procesos
+    para Prophet se comparte entre todos los tenants. Con `force` se recalculan todas las series
+    aunque sus datos no hayan cambiado. Devuelve un resumen por tenant."""
+    run_date = run_date or date.today()
+    if not 0 <= shard_index < shard_count: raise ValueError("La partición debe estar entre 0 y shard_count - 1.")
+    tenants = pending_tenants(run_date, shard_index, shard_count)
+    print(f"🌙 Precálculo de pronósticos {run_date} (partición {shard_index + 1}/{shard_count}): {len(tenants)} tenants pendientes.")
+
+    results = {'run_date': run_date.isoformat(), 'completed': {}, 'failed': {}}
+    if not tenants: return results
+
+    executor = ProcessPoolExecutor(max_workers=max_workers or advanced_forecast.BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for tenant_id in tenants:
+            _mark(MARK_RUNNING, (run_date, tenant_id))
+            try:
+                summary = advanced_forecast.run_batch_forecast(tenant_id, periods, executor=executor, only_changed=not force)
+            except Exception as e:
+                print(f"❌ Error en el precálculo del tenant {tenant_id}: {e}")
+                _mark(MARK_FINISHED, ('failed', None, str(e), run_date, tenant_id))
+                results['failed'][tenant_id] = str(e)
+                continue
+            # Una serie fallida deja el tenant pendiente para el siguiente intento
+            status = 'completed' if summary['series_failed'] == 0 else 'failed'
+            _mark(MARK_FINISHED, (status, Json(summary), None, run_date, tenant_id))
+            results['completed' if status == 'completed' else 'failed'][tenant_id] = summary
+    finally:
+        executor.shutdown()
+    return results
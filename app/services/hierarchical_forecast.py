@@ -0,0 +1,256 @@
+# Saas_GrapeIQ_V1.0/app/services/hierarchical_forecast.py
+
+# Pronóstico jerárquico y coherente: total -> producto / canal -> producto x canal.
+# Se carga en una sola consulta la matriz de ventas diarias de las series base (producto x
+# canal), se agregan todos los niveles con la matriz de sumas S y se pronostica cada nodo:
+# con suavizado exponencial vectorizado (todas las series a la vez, en el propio proceso) o
+# con Prophet (un ajuste por nodo, en paralelo en el pool de procesos). La reconciliación
+# (bottom-up o MinT con covarianza de los residuos estimada por contracción) devuelve números
+# coherentes: cada producto y cada canal suman exactamente el total. Es determinista.
+# Coste acotado: S es dispersa y la covarianza completa (nodos x nodos) solo se usa hasta
+# MINT_MAX_NODES nodos; por encima, MinT usa pesos diagonales (WLS) mientras el sistema de
+# series base quepa (WLS_MAX_BOTTOM) y, si no, bottom-up. Más de MAX_NODES nodos se rechaza.
+# Con Prophet la petición síncrona solo admite PROPHET_SYNC_MAX_NODES nodos; las jerarquías
+# mayores van por la cola de trabajos (forecast_jobs.submit_hierarchy_job).
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from . import advanced_forecast, event_calendar, fast_models
+
+METHODS = ['bottom_up', 'mint']
+BASE_MODELS = ['exp_smoothing', 'prophet']
+NO_CHANNEL = 'Sin canal'
+
+MAX_NODES = int(os.getenv("HIERARCHY_MAX_NODES", 12000))
+MINT_MAX_NODES = int(os.getenv("HIERARCHY_MINT_MAX_NODES", 1000))
+WLS_MAX_BOTTOM = int(os.getenv("HIERARCHY_WLS_MAX_BOTTOM", 2000))
+PROPHET_SYNC_MAX_NODES = int(os.getenv("HIERARCHY_PROPHET_SYNC_MAX_NODES", 30))
+
+
+class HierarchyTooLargeError(ValueError):
+    """La jerarquía del tenant supera MAX_NODES nodos."""
+
+HIERARCHY_QUERY = """
+    SELECT sd.product_id, COALESCE(s.channel, %(no_channel)s), s.sale_date::date, SUM(sd.quantity)
+    FROM sales s
+    JOIN sale_details sd ON s.id = sd.sale_id
+    WHERE s.tenant_id = %(tenant_id)s
+    GROUP BY 1, 2, 3;
+"""
+
+PRODUCT_NAMES_QUERY = "SELECT id, name FROM products WHERE tenant_id = %s AND id = ANY(%s::uuid[]);"
+
+
+def load_hierarchy(db_connection, tenant_id) -> Optional[Dict]:
+    """Matriz diaria (series base x días) de producto x canal, con los días sin ventas a 0."""
+    with db_connection.cursor() as cur:
+        cur.execute(HIERARCHY_QUERY, {'tenant_id': str(tenant_id), 'no_channel': NO_CHANNEL})
+        rows = cur.fetchall()
+        if not rows: return None
+        product_ids, channels, days, quantities = zip(*rows)
+        product_ids = [str(product_id) for product_id in product_ids]
+        cur.execute(PRODUCT_NAMES_QUERY, (str(tenant_id), sorted(set(product_ids))))
+        names = {str(product_id): name for product_id, name in cur.fetchall()}
+
+    days = np.array(days, dtype='datetime64[D]')
+    first_day = days.min()
+    day_index = (days - first_day).astype(np.int64)
+    bottom_keys, bottom_index = np.unique(np.array([f"{p}|{c}" for p, c in zip(product_ids, channels)]), return_inverse=True)
+    bottom = [tuple(key.split('|', 1)) for key in bottom_keys]
+    nodes = node_count(bottom)
+    if nodes > MAX_NODES:
+        raise HierarchyTooLargeError(f"La jerarquía tiene {nodes} series y el máximo es {MAX_NODES}.")
+
+    Y = np.zeros((len(bottom_keys), day_index.max() + 1))
+    np.add.at(Y, (bottom_index, day_index), np.array(quantities, dtype=np.float64))
+    return {
+        'dates': pd.date_range(pd.Timestamp(first_day), periods=Y.shape[1], freq='D'),
+        'bottom': bottom,
+        'Y': Y,
+        'names': names,
+    }
+
+
+def node_count(bottom: List[tuple]) -> int:
+    """Total, productos, canales y producto x canal."""
+    return 1 + len({product for product, _ in bottom}) + len({channel for _, channel in bottom}) + len(bottom)
+
+
+def summing_matrix(bottom: List[tuple]):
+    """Matriz S dispersa (nodos x series base) y etiqueta de cada nodo, en el orden total,
+    productos, canales y producto x canal."""
+    products = sorted({product for product, _ in bottom})
+    channels = sorted({channel for _, channel in bottom})
+    product_position = {product: i for i, product in enumerate(products)}
+    channel_position = {channel: i for i, channel in enumerate(channels)}
+    product_of = np.array([product_position[product] for product, _ in bottom], dtype=np.int64)
+    channel_of = np.array([channel_position[channel] for _, channel in bottom], dtype=np.int64)
+
+    # Cada serie base suma en cuatro nodos: el total, su producto, su canal y ella misma
+    n_bottom = len(bottom)
+    columns = np.arange(n_bottom)
+    rows = np.concatenate([
+        np.zeros(n_bottom, dtype=np.int64),
+        1 + product_of,
+        1 + len(products) + channel_of,
+        1 + len(products) + len(channels) + columns,
+    ])
+    S = sparse.csr_matrix(
+        (np.ones(4 * n_bottom), (rows, np.tile(columns, 4))),
+        shape=(1 + len(products) + len(channels) + n_bottom, n_bottom)
+    )
+    nodes = [('total', None)] + [('product', p) for p in products] + [('channel', c) for c in channels] + [('product_channel', b) for b in bottom]
+    return S, nodes
+
+
+def _shrunk_covariance(residuals: np.ndarray) -> np.ndarray:
+    """Covarianza de los residuos con contracción hacia la diagonal (Schäfer-Strimmer), que
+    es invertible aunque haya más nodos que días de histórico."""
+    n = residuals.shape[1]
+    centered = residuals - residuals.mean(axis=1, keepdims=True)
+    sample = centered @ centered.T / n
+    variances = np.diag(sample).copy()
+    variances[variances <= 0] = 1e-9
+    std = np.sqrt(variances)
+    correlation = sample / np.outer(std, std)
+    # Varianza de cada correlación muestral sin materializar el tensor nodos x nodos x días
+    standardized = centered / std[:, None]
+    mean_products = standardized @ standardized.T / n
+    squared = standardized ** 2
+    var_correlation = n / ((n - 1) ** 3) * (squared @ squared.T - n * mean_products ** 2)
+    off_diagonal = ~np.eye(len(std), dtype=bool)
+    denominator = (correlation[off_diagonal] ** 2).sum()
+    shrinkage = 1.0 if denominator == 0 else float(np.clip(var_correlation[off_diagonal].sum() / denominator, 0, 1))
+    shrunk = correlation * (1 - shrinkage)
+    np.fill_diagonal(shrunk, 1.0)
+    return shrunk * np.outer(std, std)
+
+
+def applied_method(method: str, S) -> str:
+    """Reconciliación que se aplica de verdad: 'mint' con covarianza completa solo en jerarquías
+    pequeñas, 'wls' (MinT con W diagonal) en las medianas y 'bottom_up' en las grandes."""
+    if method != 'mint' or S.shape[0] <= MINT_MAX_NODES:
+        return method
+    return 'wls' if S.shape[1] <= WLS_MAX_BOTTOM else 'bottom_up'
+
+
+def reconcile(S, base: np.ndarray, residuals: np.ndarray, method: str) -> np.ndarray:
+    """Pronóstico reconciliado de las series base a partir de los pronósticos de cada nodo
+    (nodos x horizonte); el de cualquier nodo es S @ resultado. No puede quedar en negativo.
+    `method` es el de applied_method(): aquí no se comprueba el tamaño."""
+    n_bottom = S.shape[1]
+    if method == 'bottom_up':
+        bottom = base[-n_bottom:]
+    elif method == 'mint':
+        # G = (S' W^-1 S)^-1 S' W^-1, con W la covarianza de los errores a un paso
+        W_inv_S = np.linalg.solve(_shrunk_covariance(residuals), S.toarray())
+        bottom = np.linalg.solve(S.T @ W_inv_S, W_inv_S.T @ base)
+    elif method == 'wls':
+        # Misma fórmula con W = diag(varianza de los residuos de cada nodo): S' W^-1 es dispersa
+        # y el único sistema denso es el de las series base
+        variances = residuals.var(axis=1)
+        variances[variances <= 0] = 1e-9
+        St_W_inv = (S.T @ sparse.diags(1.0 / variances)).tocsr()
+        bottom = np.linalg.solve((St_W_inv @ S).toarray(), St_W_inv @ base)
+    else:
+        raise ValueError(f"Método de reconciliación desconocido: {method}")
+    return np.maximum(bottom, 0)
+
+
+def _exp_smoothing_base(Y_all: np.ndarray, dates: pd.DatetimeIndex, future_dates: pd.DatetimeIndex):
+    fitted = fast_models.fit_exp_smoothing(Y_all, dates.weekday.to_numpy())
+    base = fitted['level'][:, None] + fitted['offsets'][:, future_dates.weekday.to_numpy()]
+    return base, fitted['errors']
+
+
+def _prophet_node(y: np.ndarray, dates: pd.DatetimeIndex, periods: int, holidays) -> tuple:
+    """Ajusta Prophet a un nodo de la jerarquía. Se ejecuta en un proceso del pool."""
+    from prophet import Prophet
+
+    model = Prophet(holidays=holidays, **advanced_forecast.PROPHET_PARAMS)
+    model.fit(pd.DataFrame({'ds': dates, 'y': y}))
+    forecast = model.predict(model.make_future_dataframe(periods=periods, include_history=True))
+    yhat = forecast['yhat'].to_numpy(dtype=np.float64)
+    return yhat[-periods:], y - yhat[:-periods]
+
+
+def _prophet_base(Y_all: np.ndarray, dates: pd.DatetimeIndex, periods: int, holidays, executor: Optional[ProcessPoolExecutor]):
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=advanced_forecast.BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [executor.submit(_prophet_node, y, dates, periods, holidays) for y in Y_all]
+        results = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+    return np.vstack([base for base, _ in results]), np.vstack([residuals for _, residuals in results])
+
+
+def load_inputs(db_connection, tenant_id, base_model: str = 'exp_smoothing') -> Optional[Dict]:
+    """Todo lo que el pronóstico necesita de la base de datos: la jerarquía y, para Prophet, los
+    eventos del tenant. Se lee aparte para no retener la conexión durante los ajustes."""
+    hierarchy = load_hierarchy(db_connection, tenant_id)
+    if hierarchy is None: return None
+    hierarchy['tenant_events'] = None
+    if base_model == 'prophet':
+        _, hierarchy['tenant_events'] = event_calendar.get_tenant_events(db_connection, tenant_id)
+    return hierarchy
+
+
+def run_hierarchical_forecast(
+    hierarchy: Dict,
+    periods: int = 90,
+    method: str = 'mint',
+    base_model: str = 'exp_smoothing',
+    executor: Optional[ProcessPoolExecutor] = None
+) -> Dict:
+    """Pronóstico coherente de total, productos, canales y producto x canal en una sola pasada,
+    a partir de los datos de load_inputs()."""
+    if method not in METHODS: raise ValueError(f"Método de reconciliación desconocido: {method}")
+    if base_model not in BASE_MODELS: raise ValueError(f"Modelo base desconocido: {base_model}")
+
+    started = time.perf_counter()
+    dates = hierarchy['dates']
+    future_dates = pd.date_range(dates[-1] + pd.Timedelta(days=1), periods=periods, freq='D')
+    holidays = None
+    if base_model == 'prophet':
+        holidays = event_calendar.build_holidays(hierarchy['tenant_events'], dates[0], dates[-1])
+
+    S, nodes = summing_matrix(hierarchy['bottom'])
+    method = applied_method(method, S)
+    Y_all = S @ hierarchy['Y']
+    if base_model == 'prophet':
+        base, residuals = _prophet_base(Y_all, dates, periods, holidays, executor)
+    else:
+        base, residuals = _exp_smoothing_base(Y_all, dates, future_dates)
+    # Se redondean las series base antes de agregar para que las sumas cuadren al céntimo
+    bottom = np.round(reconcile(S, base, residuals, method), 2)
+    coherent = np.round(S @ bottom, 2) + 0.0
+
+    levels = {'total': coherent[0], 'products': {}, 'channels': {}, 'product_channels': {}}
+    for (level, key), values in zip(nodes[1:], coherent[1:]):
+        if level == 'product':
+            levels['products'][key] = values
+        elif level == 'channel':
+            levels['channels'][key] = values
+        else:
+            levels['product_channels'].setdefault(key[0], {})[key[1]] = values
+
+    return {
+        'method': method,
+        'base_model': base_model,
+        'dates': np.datetime_as_string(future_dates.to_numpy(dtype='datetime64[D]'), unit='D').tolist(),
+        'product_names': hierarchy['names'],
+        'levels': levels,
+        'series_count': len(nodes),
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,97 @@
+# Saas_GrapeIQ_V1.0/app/services/kpi_metrics.py
+
+# KPIs del cuadro de mando: totales históricos, mes en curso frente al anterior (ventas, clientes
+# distintos y ticket medio) y variación mensual. Los importes salen de los agregados de ventas
+# (ver sales_rollups.py), así que no hay join ventas x líneas que multiplique los totales; solo
+# los clientes distintos de cada mes se cuentan sobre `sales`, limitado a esos dos meses.
+# La variación mensual compara el mes en curso hasta hoy con el mismo tramo del mes anterior.
+# El resultado se guarda por tenant en analytics_cache.kpi_results y las ventas lo invalidan.
+
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+from . import analytics_cache, date_ranges
+
+# Expresión SQL (un objeto JSON) reutilizable dentro de otras consultas, como la del dashboard-bundle.
+# Parámetros: %(tenant_id)s y los de kpi_params(). Los rangos son semiabiertos (ver date_ranges.py).
+KPI_JSON_SQL = """(
+    WITH periods AS (
+        SELECT %(current_start)s::date AS current_start, %(previous_start)s::date AS previous_start,
+               %(previous_to_date_end)s::date AS previous_to_date_end
+    ),
+    totals AS (
+        SELECT COALESCE(SUM(total_amount), 0) AS total_amount, COALESCE(SUM(quantity), 0) AS quantity, COALESCE(SUM(sale_count), 0) AS sale_count
+        FROM sales_rollup_monthly
+        WHERE tenant_id = %(tenant_id)s
+    ),
+    months AS (
+        SELECT
+            COALESCE(SUM(d.total_amount) FILTER (WHERE d.sale_date >= p.current_start), 0) AS current_amount,
+            COALESCE(SUM(d.sale_count) FILTER (WHERE d.sale_date >= p.current_start), 0) AS current_count,
+            COALESCE(SUM(d.total_amount) FILTER (WHERE d.sale_date < p.current_start), 0) AS previous_amount,
+            COALESCE(SUM(d.sale_count) FILTER (WHERE d.sale_date < p.current_start), 0) AS previous_count,
+            SUM(d.total_amount) FILTER (WHERE d.sale_date < p.previous_to_date_end) AS previous_to_date
+        FROM periods p
+        LEFT JOIN sales_rollup_daily d
+            ON d.tenant_id = %(tenant_id)s AND d.sale_date >= p.previous_start AND d.sale_date < %(current_end)s::date
+    ),
+    customers AS (
+        SELECT
+            COUNT(DISTINCT s.customer_name) FILTER (WHERE s.sale_date >= p.current_start) AS current_customers,
+            COUNT(DISTINCT s.customer_name) FILTER (WHERE s.sale_date < p.current_start) AS previous_customers
+        FROM periods p
+        LEFT JOIN sales s
+            ON s.tenant_id = %(tenant_id)s AND s.sale_date >= p.previous_start AND s.sale_date < %(current_end)s::date
+    )
+    SELECT json_build_object(
+        'TotalSale', t.total_amount,
+        'Quantity', t.quantity,
+        'UniqueCustomers', (SELECT COUNT(*) FROM sales_rollup_customers c WHERE c.tenant_id = %(tenant_id)s),
+        'AverageSaleValue', COALESCE(t.total_amount / NULLIF(t.sale_count, 0), 0),
+        'Profit', (
+            SELECT COALESCE(SUM(r.revenue - r.quantity * p.unit_cost), 0)
+            FROM sales_rollup_products r
+            JOIN products p ON r.product_id = p.id
+            WHERE r.tenant_id = %(tenant_id)s
+        ),
+        'CurrentMonthSales', m.current_amount,
+        'PreviousMonthSales', m.previous_amount,
+        'CurrentMonthCustomers', c.current_customers,
+        'PreviousMonthCustomers', c.previous_customers,
+        'CurrentMonthAverageTicket', COALESCE(m.current_amount / NULLIF(m.current_count, 0), 0),
+        'PreviousMonthAverageTicket', COALESCE(m.previous_amount / NULLIF(m.previous_count, 0), 0),
+        'MonthOverMonthChange', COALESCE((m.current_amount / NULLIF(m.previous_to_date, 0) - 1) * 100, 0)
+    )
+    FROM totals t, months m, customers c
+)"""
+
+
+def kpi_params(today: date) -> Dict:
+    """Rangos del mes en curso (hasta hoy incluido), del mes anterior y del mismo tramo del mes anterior."""
+    current_start, _ = date_ranges.month_range(today.year, today.month)
+    previous_start, _ = date_ranges.previous_month_range(today)
+    elapsed = today - current_start
+    return {
+        'current_start': current_start,
+        'current_end': today + timedelta(days=1),
+        'previous_start': previous_start,
+        'previous_to_date_end': min(previous_start + elapsed + timedelta(days=1), current_start),
+    }
+
+
+def compute_kpis(db_connection, tenant_id, today: Optional[date] = None) -> Dict:
+    """KPIs del tenant calculados en una sola consulta sobre los agregados de ventas."""
+    with db_connection.cursor() as cur:
+        cur.execute(f"SELECT {KPI_JSON_SQL};", {'tenant_id': str(tenant_id), **kpi_params(today or date.today())})
+        return cur.fetchone()[0]
+
+
+def get_kpis(db_connection, tenant_id) -> Dict:
+    """KPIs del tenant, desde la caché si no ha habido ventas nuevas desde el último cálculo."""
+    today = date.today()
+    cache_key = (str(tenant_id), analytics_cache.KPI_SCOPE, today)
+    kpis = analytics_cache.kpi_results.get(cache_key)
+    if kpis is None:
+        kpis = compute_kpis(db_connection, tenant_id, today)
+        analytics_cache.kpi_results.set(cache_key, kpis)
+    return kpis
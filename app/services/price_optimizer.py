@@ -0,0 +1,118 @@
+# Saas_GrapeIQ_V1.0/app/services/price_optimizer.py
+
+# Optimización de precios de todo el catálogo en una sola pasada.
+# Se cargan con una consulta las ventas del tenant agregadas por (producto, precio) y se
+# ajusta por mínimos cuadrados agrupados (np.bincount, sin bucles por producto) una curva de
+# demanda log-log por producto: log(q) = a + b·log(p), donde b es la elasticidad precio.
+# Después se evalúa una rejilla de precios alrededor del precio mediano de cada producto
+# como una matriz productos x precios y se elige el precio que maximiza ingresos o margen.
+
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MIN_SALE_LINES = 10
+GRID_POINTS = 30
+GRID_RANGE = (0.75, 1.25) # Rejilla de precios relativa al precio mediano de venta
+OBJECTIVES = ['revenue', 'profit']
+
+PRICE_DATA_QUERY = """
+    WITH lines AS (
+        SELECT sd.product_id, sd.unit_price, sd.quantity
+        FROM sale_details sd
+        WHERE sd.tenant_id = %(tenant_id)s AND (%(product_ids)s::uuid[] IS NULL OR sd.product_id = ANY(%(product_ids)s::uuid[]))
+    ),
+    per_product AS (
+        SELECT product_id, PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY unit_price) AS base_price, COUNT(*) AS line_count
+        FROM lines
+        GROUP BY product_id
+    )
+    SELECT l.product_id, p.name, p.unit_cost, pp.base_price, pp.line_count, l.unit_price, AVG(l.quantity), COUNT(*)
+    FROM lines l
+    JOIN per_product pp ON pp.product_id = l.product_id
+    JOIN products p ON p.id = l.product_id
+    GROUP BY l.product_id, p.name, p.unit_cost, pp.base_price, pp.line_count, l.unit_price
+    ORDER BY l.product_id, l.unit_price;
+"""
+
+
+def load_price_data(db_connection, tenant_id, product_ids: Optional[List[str]] = None) -> List[tuple]:
+    with db_connection.cursor() as cur:
+        cur.execute(PRICE_DATA_QUERY, {'tenant_id': str(tenant_id), 'product_ids': product_ids})
+        return cur.fetchall()
+
+
+def fit_elasticities(group: np.ndarray, log_price: np.ndarray, log_demand: np.ndarray, weights: np.ndarray, n_groups: int):
+    """Regresión lineal ponderada log_demand ~ log_price para cada grupo a la vez. Devuelve
+    (intercepto, pendiente); la pendiente es NaN si el grupo no tiene precios distintos."""
+    sums = lambda values: np.bincount(group, weights=weights * values, minlength=n_groups)
+    w, sx, sy = sums(1.0), sums(log_price), sums(log_demand)
+    sxx, sxy = sums(log_price * log_price), sums(log_price * log_demand)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = w * sxx - sx * sx
+        slope = np.where(np.abs(denominator) > 1e-12, (w * sxy - sx * sy) / denominator, np.nan)
+        intercept = (sy - slope * sx) / w
+    return intercept, slope
+
+
+def optimize_catalog(rows: List[tuple], objective: str = 'revenue', include_grid: bool = False) -> Dict:
+    """Precio óptimo de cada producto a partir de las filas de PRICE_DATA_QUERY."""
+    if objective not in OBJECTIVES: raise ValueError(f"Objetivo desconocido: {objective}")
+    if not rows: return {'objective': objective, 'products': [], 'skipped': []}
+
+    product_ids, names, unit_costs, base_prices, line_counts, prices, demands, counts = zip(*rows)
+    keys, group = np.unique(np.array([str(product_id) for product_id in product_ids]), return_inverse=True)
+    first = np.unique(group, return_index=True)[1]
+    prices = np.array(prices, dtype=np.float64)
+    demands = np.array(demands, dtype=np.float64)
+    # Solo los niveles de precio y demanda positivos entran en el ajuste logarítmico
+    valid = (prices > 0) & (demands > 0)
+    fit_group = group[valid]
+    intercept, elasticity = fit_elasticities(
+        fit_group, np.log(prices[valid]), np.log(demands[valid]), np.array(counts, dtype=np.float64)[valid], len(keys)
+    )
+
+    base_price = np.array(base_prices, dtype=np.float64)[first]
+    unit_cost = np.array([cost if cost is not None else np.nan for cost in unit_costs], dtype=np.float64)[first]
+    enough_lines = np.array(line_counts, dtype=np.int64)[first] >= MIN_SALE_LINES
+    price_levels = np.bincount(fit_group, minlength=len(keys))
+    ok = enough_lines & (price_levels >= 2) & np.isfinite(elasticity)
+    if objective == 'profit': ok &= np.isfinite(unit_cost)
+
+    # Rejilla productos x precios: demanda = e^a · p^b
+    grid = base_price[ok, None] * np.linspace(*GRID_RANGE, GRID_POINTS)[None, :]
+    demand = np.exp(intercept[ok, None]) * grid ** elasticity[ok, None]
+    revenue = grid * demand
+    score = revenue if objective == 'revenue' else (grid - unit_cost[ok, None]) * demand
+    best = score.argmax(axis=1)
+    rows_ok = np.arange(len(best))
+    base_demand = np.exp(intercept[ok]) * base_price[ok] ** elasticity[ok]
+    base_score = base_price[ok] * base_demand if objective == 'revenue' else (base_price[ok] - unit_cost[ok]) * base_demand
+    best_score = score[rows_ok, best]
+
+    products = []
+    for i, index in enumerate(np.flatnonzero(ok)):
+        product = {
+            'product_id': str(keys[index]),
+            'name': names[first[index]],
+            'base_price': round(float(base_price[index]), 2),
+            'elasticity': round(float(elasticity[index]), 4),
+            'optimal_price': round(float(grid[i, best[i]]), 2),
+            'optimal_demand': round(float(demand[i, best[i]]), 2),
+            'optimal_revenue': round(float(revenue[i, best[i]]), 2),
+            'expected_uplift_pct': round(float((best_score[i] - base_score[i]) / abs(base_score[i]) * 100), 2) if base_score[i] else None,
+        }
+        if include_grid:
+            product['grid'] = {'price': np.round(grid[i], 2), 'demand': np.round(demand[i], 2), 'revenue': np.round(revenue[i], 2)}
+        products.append(product)
+
+    skipped = [
+        {
+            'product_id': str(keys[index]),
+            'name': names[first[index]],
+            'reason': "Sin coste unitario para optimizar el margen." if enough_lines[index] and price_levels[index] >= 2 and np.isfinite(elasticity[index])
+                      else f"Se necesitan al menos {MIN_SALE_LINES} ventas a 2 precios distintos.",
+        }
+        for index in np.flatnonzero(~ok)
+    ]
+    return {'objective': objective, 'products': products, 'skipped': skipped}
@@ -0,0 +1,74 @@
+# Saas_GrapeIQ_V1.0/app/services/product_costs.py
+
+# Desglose de costes por botella de uno o muchos productos en una sola consulta.
+# Los costes de un producto son los de su lote de origen más los de la parcela de ese lote.
+# En lugar de `related_lot_id = X OR related_parcel_id = Y` (que no aprovecha bien ningún índice)
+# se unen con UNION ALL dos búsquedas por índice: costes del lote y costes de la parcela que no
+# son ya del lote. Cada par (lote, parcela) se agrupa una sola vez aunque lo compartan varios
+# productos, y las filas llegan ya ordenadas para montar el sunburst en una sola pasada.
+
+from typing import Dict, List, Optional
+
+from psycopg2.extras import RealDictCursor
+
+# Botellas de 0,75 L
+BOTTLE_LITERS = 0.75
+
+BREAKDOWN_QUERY = """
+    WITH selected AS (
+        SELECT p.id AS product_id, p.unit_cost, p.wine_lot_origin_id AS lot_id, wl.origin_parcel_id AS parcel_id,
+               wl.total_liters / %(bottle_liters)s AS total_bottles
+        FROM products p
+        JOIN wine_lots wl ON p.wine_lot_origin_id = wl.id
+        WHERE p.tenant_id = %(tenant_id)s
+          AND (%(product_ids)s::uuid[] IS NULL OR p.id = ANY(%(product_ids)s::uuid[]))
+    ),
+    targets AS (
+        SELECT DISTINCT lot_id, parcel_id FROM selected
+    ),
+    linked AS (
+        SELECT t.lot_id, t.parcel_id, c.cost_type, c.amount
+        FROM targets t
+        JOIN costs c ON c.tenant_id = %(tenant_id)s AND c.related_lot_id = t.lot_id
+        UNION ALL
+        SELECT t.lot_id, t.parcel_id, c.cost_type, c.amount
+        FROM targets t
+        JOIN costs c ON c.tenant_id = %(tenant_id)s AND c.related_parcel_id = t.parcel_id
+        WHERE c.related_lot_id IS DISTINCT FROM t.lot_id
+    ),
+    grouped AS (
+        SELECT l.lot_id, l.parcel_id, cp.category, l.cost_type, SUM(l.amount) AS amount
+        FROM linked l
+        JOIN cost_parameters cp ON cp.parameter_name = l.cost_type AND cp.tenant_id = %(tenant_id)s
+        GROUP BY l.lot_id, l.parcel_id, cp.category, l.cost_type
+    )
+    SELECT s.product_id, s.unit_cost, s.total_bottles, g.category, g.cost_type, g.amount,
+           SUM(g.amount) OVER (PARTITION BY s.product_id, g.category) AS category_amount
+    FROM selected s
+    LEFT JOIN grouped g ON g.lot_id = s.lot_id AND g.parcel_id IS NOT DISTINCT FROM s.parcel_id
+    ORDER BY s.product_id, category_amount DESC, g.category, g.amount DESC;
+"""
+
+
+def get_breakdowns(db_connection, tenant_id, product_ids: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """{product_id: {total_unit_cost, breakdown}} de los productos pedidos (todos si `product_ids` es None).
+    Los productos sin lote de origen no aparecen."""
+    params = {'tenant_id': str(tenant_id), 'product_ids': product_ids, 'bottle_liters': BOTTLE_LITERS}
+    with db_connection.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(BREAKDOWN_QUERY, params)
+        rows = cur.fetchall()
+
+    results = {}
+    for rec in rows:
+        product_id = str(rec['product_id'])
+        entry = results.get(product_id)
+        if entry is None:
+            entry = results[product_id] = {"total_unit_cost": float(rec['unit_cost'] or 0), "breakdown": []}
+        if rec['category'] is None: continue
+        total_bottles = float(rec['total_bottles'] or 1)
+        value = float(rec['amount']) / total_bottles if total_bottles > 0 else 0
+        breakdown = entry['breakdown']
+        if not breakdown or breakdown[-1]['name'] != rec['category']:
+            breakdown.append({'name': rec['category'], 'children': []})
+        breakdown[-1]['children'].append({'name': rec['cost_type'], 'value': value})
+    return results
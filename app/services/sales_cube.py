@@ -0,0 +1,287 @@
+# Saas_GrapeIQ_V1.0/app/services/sales_cube.py
+
+# Cubo de ventas columnar en memoria por tenant, para responder agrupaciones (producto, mes,
+# día de la semana, canal) sin volver a la base de datos.
+# Cada línea de venta es una fila de arrays numpy: claves de producto y canal codificadas con
+# diccionario, día, mes y día de la semana como enteros, y unidades e ingresos como medidas.
+# Una agrupación combina las claves en un único código entero y suma con np.bincount.
+# El cubo se carga con la primera consulta del tenant y se refresca de forma incremental con la
+# marca de agua sale_details.change_seq: solo se leen las líneas nuevas. Como change_seq se asigna
+# al insertar y no al confirmar, una línea con un número menor puede confirmarse después de leer
+# uno mayor; por eso, si con las líneas nuevas el número de líneas del cubo no coincidiría con el de
+# sale_details (líneas fuera de orden, ventas borradas o reemplazadas por una ingesta), en lugar de
+# añadirlas el cubo se vuelve a cargar entero.
+# Los cubos comparten un presupuesto de memoria (SALES_CUBE_MEMORY_MB) con expulsión LRU;
+# con presupuesto 0 no se guardan y cada consulta construye un cubo temporal.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from ..lazy import lazy_import
+from .date_ranges import DateRange
+
+# numpy solo se carga con la primera consulta al cubo: las ventas pueden marcarlo como obsoleto sin cargarlo
+np = lazy_import("numpy")
+
+SALES_CUBE_MEMORY_MB = float(os.getenv("SALES_CUBE_MEMORY_MB", 256))
+SALES_CUBE_REFRESH_SECONDS = float(os.getenv("SALES_CUBE_REFRESH_SECONDS", 10))
+NO_CHANNEL = 'Sin canal'
+DIMENSIONS = ['product', 'month', 'weekday', 'channel']
+MEASURES = ['quantity', 'revenue', 'lines']
+MAX_DENSE_GROUPS = 5_000_000 # Por encima se agrupa con np.unique en lugar de un bincount denso
+
+# Mismo filtro que LINES_QUERY, para que el recuento sea comparable con el del cubo
+WATERMARK_QUERY = """
+    SELECT COALESCE(MAX(sd.change_seq), 0), COUNT(*)
+    FROM sale_details sd
+    JOIN sales s ON s.id = sd.sale_id
+    WHERE sd.tenant_id = %(tenant_id)s AND s.sale_date IS NOT NULL;
+"""
+
+LINES_QUERY = """
+    SELECT sd.change_seq, sd.product_id::text, COALESCE(s.channel, %(no_channel)s), s.sale_date, sd.quantity, sd.quantity * sd.unit_price
+    FROM sale_details sd
+    JOIN sales s ON s.id = sd.sale_id
+    WHERE sd.tenant_id = %(tenant_id)s AND sd.change_seq > %(since)s AND s.sale_date IS NOT NULL
+    ORDER BY sd.change_seq;
+"""
+
+PRODUCTS_QUERY = "SELECT id::text, name, sku FROM products WHERE tenant_id = %s;"
+
+
+class TenantCube:
+    """Líneas de venta de un tenant en columnas numpy."""
+
+    def __init__(self, tenant_id: str):
+        self.tenant_id = tenant_id
+        self.product_ids: List[str] = []
+        self.channels: List[str] = []
+        self._product_codes: Dict[str, int] = {}
+        self._channel_codes: Dict[str, int] = {}
+        self.products: Dict[str, tuple] = {} # product_id -> (nombre, sku)
+        self.columns = {
+            'day': np.empty(0, dtype=np.int32),     # días desde 1970-01-01
+            'month': np.empty(0, dtype=np.int32),   # meses desde 1970-01
+            'weekday': np.empty(0, dtype=np.int8),  # ISO: 1 = lunes ... 7 = domingo
+            'product': np.empty(0, dtype=np.int32),
+            'channel': np.empty(0, dtype=np.int16),
+            'quantity': np.empty(0, dtype=np.int64),
+            'revenue': np.empty(0, dtype=np.float64),
+        }
+        self.watermark = 0
+        self.line_count = 0
+        self.checked_at = 0.0
+        self.stale = True
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def _encode(self, values, codes: Dict[str, int], labels: List[str], dtype):
+        for value in values:
+            if value not in codes:
+                codes[value] = len(labels)
+                labels.append(value)
+        return np.fromiter((codes[value] for value in values), dtype=dtype, count=len(values))
+
+    def append(self, rows: List[tuple]) -> None:
+        """Añade líneas de LINES_QUERY (ordenadas por change_seq) al final del cubo."""
+        if not rows: return
+        seqs, product_ids, channels, sale_dates, quantities, revenues = zip(*rows)
+        days = np.array(sale_dates, dtype='datetime64[D]')
+        new = {
+            'day': days.astype(np.int32),
+            'month': days.astype('datetime64[M]').astype(np.int32),
+            # 1970-01-01 fue jueves (ISO 4)
+            'weekday': ((days.astype(np.int64) + 3) % 7 + 1).astype(np.int8),
+            'product': self._encode(product_ids, self._product_codes, self.product_ids, np.int32),
+            'channel': self._encode(channels, self._channel_codes, self.channels, np.int16),
+            'quantity': np.array(quantities, dtype=np.int64),
+            'revenue': np.array(revenues, dtype=np.float64),
+        }
+        self.columns = {name: np.concatenate([self.columns[name], new[name]]) for name in self.columns}
+        self.watermark = int(seqs[-1])
+        self.line_count += len(rows)
+
+    def group_by(self, dimensions: List[str], filters: Optional[Dict] = None, period: Optional[DateRange] = None) -> Dict:
+        """Suma de unidades, ingresos y líneas por combinación de `dimensions`, tras aplicar `filters`
+        ({dimensión: valor o lista de valores}, ya codificados) y el rango de fechas semiabierto
+        `period`. Devuelve columnas numpy."""
+        columns = self.columns # Instantánea: un refresco concurrente sustituye el diccionario entero
+        mask = np.ones(len(columns['quantity']), dtype=bool)
+        for dimension, values in (filters or {}).items():
+            mask &= np.isin(columns[dimension], np.atleast_1d(values))
+        if period is not None:
+            start, end = (int(np.datetime64(day, 'D').astype(np.int32)) for day in period)
+            mask &= (columns['day'] >= start) & (columns['day'] < end)
+        quantity, revenue = columns['quantity'][mask], columns['revenue'][mask]
+
+        # Código de grupo en base mixta: cada dimensión ocupa su rango [0, tamaño)
+        code = np.zeros(len(quantity), dtype=np.int64)
+        keys, sizes, offsets = [], [], []
+        for dimension in dimensions:
+            column = columns[dimension][mask].astype(np.int64)
+            offset = int(column.min()) if len(column) else 0
+            size = (int(column.max()) - offset + 1) if len(column) else 1
+            code = code * size + (column - offset)
+            sizes.append(size)
+            offsets.append(offset)
+
+        total_groups = int(np.prod(sizes)) if sizes else 1
+        if total_groups <= MAX_DENSE_GROUPS:
+            lines = np.bincount(code, minlength=total_groups)
+            groups = np.flatnonzero(lines)
+            lines = lines[groups]
+            quantities = np.bincount(code, weights=quantity, minlength=total_groups)[groups]
+            revenues = np.bincount(code, weights=revenue, minlength=total_groups)[groups]
+        else:
+            groups, inverse = np.unique(code, return_inverse=True)
+            lines = np.bincount(inverse)
+            quantities = np.bincount(inverse, weights=quantity)
+            revenues = np.bincount(inverse, weights=revenue)
+
+        # Se deshace la base mixta para recuperar el valor de cada dimensión
+        remainder = groups
+        for dimension, size, offset in reversed(list(zip(dimensions, sizes, offsets))):
+            keys.append((dimension, remainder % size + offset))
+            remainder = remainder // size
+        result = dict(reversed(keys))
+        result.update({'quantity': quantities.astype(np.int64), 'revenue': np.round(revenues, 2), 'lines': lines.astype(np.int64)})
+        return result
+
+    def decode(self, dimension: str, values) -> list:
+        """Etiquetas legibles de los códigos de una dimensión."""
+        if dimension == 'product':
+            return [self.product_ids[code] for code in values]
+        if dimension == 'channel':
+            return [self.channels[code] for code in values]
+        if dimension == 'month':
+            return np.datetime_as_string(np.asarray(values).astype('datetime64[M]'), unit='M').tolist()
+        return [int(value) for value in values]
+
+    def encode(self, dimension: str, value) -> int:
+        """Código de un valor de filtro (product_id, canal, 'AAAA-MM' o día ISO). -1 si no existe."""
+        if dimension == 'product':
+            return self._product_codes.get(str(value), -1)
+        if dimension == 'channel':
+            return self._channel_codes.get(value, -1)
+        try:
+            if dimension == 'month':
+                return int(np.datetime64(value, 'M').astype(np.int32))
+            return int(value)
+        except ValueError:
+            raise ValueError(f"Valor no válido para {dimension}: {value}")
+
+
+def slice_rows(
+    cube: TenantCube,
+    group_by: List[str],
+    filters: Optional[Dict] = None,
+    sort: str = 'revenue',
+    limit: Optional[int] = None,
+    period: Optional[DateRange] = None
+) -> List[Dict]:
+    """Agrupación del cubo como lista de filas legibles, ordenada por `sort` de mayor a menor.
+    `filters` usa valores sin codificar: {'product': [ids], 'channel': [...], 'month': ['AAAA-MM'], 'weekday': [1..7]}."""
+    unknown = set(group_by) - set(DIMENSIONS)
+    if unknown: raise ValueError(f"Dimensiones desconocidas: {', '.join(sorted(unknown))}")
+    if sort not in MEASURES: raise ValueError(f"Medida de ordenación desconocida: {sort}")
+    encoded = {dimension: [cube.encode(dimension, value) for value in values] for dimension, values in (filters or {}).items() if values}
+    grouped = cube.group_by(group_by, encoded, period)
+    order = np.argsort(-grouped[sort], kind='stable')[:limit]
+
+    columns = {dimension: cube.decode(dimension, grouped[dimension][order]) for dimension in group_by}
+    if 'product' in columns:
+        columns['product_name'] = [cube.products.get(product_id, (None, None))[0] for product_id in columns['product']]
+        columns['sku'] = [cube.products.get(product_id, (None, None))[1] for product_id in columns['product']]
+    for measure in MEASURES:
+        columns[measure] = grouped[measure][order].tolist()
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+_cubes: "OrderedDict[str, TenantCube]" = OrderedDict()
+_lock = threading.Lock()
+_tenant_locks: Dict[str, threading.Lock] = {}
+
+
+def _fetch_lines(cur, tenant_id: str, since: int) -> List[tuple]:
+    cur.execute(LINES_QUERY, {'tenant_id': tenant_id, 'since': since, 'no_channel': NO_CHANNEL})
+    return cur.fetchall()
+
+
+def _refresh(db_connection, cube: TenantCube) -> TenantCube:
+    """Lee las líneas nuevas desde la marca de agua del cubo y, si con ellas el número de líneas
+    coincide con el de la base de datos, las añade al mismo cubo (las consultas en curso trabajan
+    sobre una instantánea de sus columnas). Si no coincide, el cubo no se toca y se devuelve uno
+    nuevo cargado entero."""
+    with db_connection.cursor() as cur:
+        cur.execute(WATERMARK_QUERY, {'tenant_id': cube.tenant_id})
+        watermark, line_count = (int(value) for value in cur.fetchone())
+        if watermark != cube.watermark or line_count != cube.line_count or not cube.products:
+            new_lines = []
+            if watermark >= cube.watermark and line_count >= cube.line_count:
+                new_lines = _fetch_lines(cur, cube.tenant_id, cube.watermark)
+            if cube.line_count + len(new_lines) == line_count:
+                cube.append(new_lines)
+            else:
+                print(f"Cubo de ventas del tenant {cube.tenant_id}: recarga completa.")
+                cube = TenantCube(cube.tenant_id)
+                cube.append(_fetch_lines(cur, cube.tenant_id, 0))
+            cur.execute(PRODUCTS_QUERY, (cube.tenant_id,))
+            cube.products = {product_id: (name, sku) for product_id, name, sku in cur.fetchall()}
+    cube.checked_at = time.monotonic()
+    cube.stale = False
+    return cube
+
+
+def _evict(keep: str) -> None:
+    """Expulsa los cubos menos usados hasta respetar el presupuesto de memoria."""
+    budget = SALES_CUBE_MEMORY_MB * 1024 * 1024
+    _cubes.move_to_end(keep)
+    while len(_cubes) > 1 and sum(cube.nbytes for cube in _cubes.values()) > budget:
+        tenant_id, _ = _cubes.popitem(last=False)
+        _tenant_locks.pop(tenant_id, None)
+        print(f"Cubo de ventas del tenant {tenant_id} expulsado de memoria.")
+    if _cubes[keep].nbytes > budget:
+        del _cubes[keep] # Un cubo que no cabe solo en el presupuesto no se guarda
+        _tenant_locks.pop(keep, None)
+
+
+def get_cube(db_connection, tenant_id) -> TenantCube:
+    """Cubo del tenant, cargado o refrescado si hace falta."""
+    tenant_id = str(tenant_id)
+    if SALES_CUBE_MEMORY_MB <= 0:
+        return _refresh(db_connection, TenantCube(tenant_id))
+
+    while True:
+        with _lock:
+            cube = _cubes.get(tenant_id)
+            if cube is None:
+                cube = _cubes[tenant_id] = TenantCube(tenant_id)
+            _cubes.move_to_end(tenant_id)
+            tenant_lock = _tenant_locks.setdefault(tenant_id, threading.Lock())
+
+        with tenant_lock:
+            # Si el cubo se expulsó mientras se esperaba, su cerrojo ya no es el del tenant: otro hilo
+            # podría estar refrescando con el nuevo, así que se vuelve a empezar
+            with _lock:
+                if _tenant_locks.get(tenant_id) is not tenant_lock: continue
+            cube = _cubes.get(tenant_id, cube)
+            if cube.stale or time.monotonic() - cube.checked_at > SALES_CUBE_REFRESH_SECONDS:
+                cube = _refresh(db_connection, cube)
+                with _lock:
+                    _cubes[tenant_id] = cube
+                    _evict(keep=tenant_id)
+            return cube
+
+
+def mark_stale(tenant_id) -> None:
+    """Fuerza a comprobar la marca de agua en la siguiente consulta (tras registrar ventas)."""
+    with _lock:
+        cube = _cubes.get(str(tenant_id))
+        if cube is not None:
+            cube.stale = True
@@ -0,0 +1,86 @@
+# Saas_GrapeIQ_V1.0/app/services/sales_rollups.py
+
+# Agregados de ventas para los cuadros de mando: por día, mes, día de la semana, producto y
+# cliente. Se mantienen de forma incremental: cada venta registrada suma su aportación en la
+# misma transacción (INSERT ... ON CONFLICT DO UPDATE), así que los endpoints de analítica leen
+# tantas filas como cubos (días, meses, productos) en lugar de recorrer todas las líneas de venta.
+# La ingesta masiva, que reemplaza las ventas del tenant, reconstruye sus agregados con rebuild().
+
+from typing import Iterable, Optional
+
+ROLLUP_TABLES = ['sales_rollup_daily', 'sales_rollup_monthly', 'sales_rollup_weekday', 'sales_rollup_products', 'sales_rollup_customers']
+
+# Suma a los agregados las ventas seleccionadas (todas las del tenant, o solo `sale_ids`)
+APPLY_SALES_QUERY = """
+    WITH selected AS (
+        SELECT s.id, s.tenant_id, s.sale_date, s.total_amount, s.customer_name
+        FROM sales s
+        WHERE (%(tenant_id)s::uuid IS NULL OR s.tenant_id = %(tenant_id)s::uuid)
+          AND (%(sale_ids)s::uuid[] IS NULL OR s.id = ANY(%(sale_ids)s::uuid[]))
+    ),
+    lines AS (
+        SELECT sel.tenant_id, sd.sale_id, sd.product_id, sd.quantity, sd.unit_price
+        FROM sale_details sd
+        JOIN selected sel ON sel.id = sd.sale_id
+    ),
+    per_sale AS (
+        SELECT sel.tenant_id, sel.sale_date, sel.total_amount, sel.customer_name, COALESCE(q.quantity, 0) AS quantity
+        FROM selected sel
+        LEFT JOIN (SELECT sale_id, SUM(quantity) AS quantity FROM lines GROUP BY sale_id) q ON q.sale_id = sel.id
+    ),
+    daily AS (
+        INSERT INTO sales_rollup_daily AS r (tenant_id, sale_date, sale_count, total_amount, quantity)
+        SELECT tenant_id, sale_date, COUNT(*), SUM(total_amount), SUM(quantity)
+        FROM per_sale WHERE sale_date IS NOT NULL GROUP BY tenant_id, sale_date
+        ON CONFLICT (tenant_id, sale_date) DO UPDATE SET
+            sale_count = r.sale_count + EXCLUDED.sale_count, total_amount = r.total_amount + EXCLUDED.total_amount, quantity = r.quantity + EXCLUDED.quantity
+    ),
+    monthly AS (
+        INSERT INTO sales_rollup_monthly AS r (tenant_id, month, sale_count, total_amount, quantity)
+        SELECT tenant_id, DATE_TRUNC('month', sale_date)::date, COUNT(*), SUM(total_amount), SUM(quantity)
+        FROM per_sale WHERE sale_date IS NOT NULL GROUP BY tenant_id, DATE_TRUNC('month', sale_date)::date
+        ON CONFLICT (tenant_id, month) DO UPDATE SET
+            sale_count = r.sale_count + EXCLUDED.sale_count, total_amount = r.total_amount + EXCLUDED.total_amount, quantity = r.quantity + EXCLUDED.quantity
+    ),
+    weekday AS (
+        INSERT INTO sales_rollup_weekday AS r (tenant_id, weekday, sale_count, total_amount, quantity)
+        SELECT tenant_id, EXTRACT(ISODOW FROM sale_date)::int, COUNT(*), SUM(total_amount), SUM(quantity)
+        FROM per_sale WHERE sale_date IS NOT NULL GROUP BY tenant_id, EXTRACT(ISODOW FROM sale_date)::int
+        ON CONFLICT (tenant_id, weekday) DO UPDATE SET
+            sale_count = r.sale_count + EXCLUDED.sale_count, total_amount = r.total_amount + EXCLUDED.total_amount, quantity = r.quantity + EXCLUDED.quantity
+    ),
+    products AS (
+        INSERT INTO sales_rollup_products AS r (tenant_id, product_id, line_count, quantity, revenue)
+        SELECT tenant_id, product_id, COUNT(*), SUM(quantity), SUM(quantity * unit_price)
+        FROM lines GROUP BY tenant_id, product_id
+        ON CONFLICT (tenant_id, product_id) DO UPDATE SET
+            line_count = r.line_count + EXCLUDED.line_count, quantity = r.quantity + EXCLUDED.quantity, revenue = r.revenue + EXCLUDED.revenue
+    ),
+    customers AS (
+        INSERT INTO sales_rollup_customers AS r (tenant_id, customer_name, sale_count, total_amount)
+        SELECT tenant_id, customer_name, COUNT(*), SUM(total_amount)
+        FROM per_sale WHERE customer_name IS NOT NULL GROUP BY tenant_id, customer_name
+        ON CONFLICT (tenant_id, customer_name) DO UPDATE SET
+            sale_count = r.sale_count + EXCLUDED.sale_count, total_amount = r.total_amount + EXCLUDED.total_amount
+    )
+    SELECT COUNT(*) FROM per_sale;
+"""
+
+
+def apply_sales(cur, tenant_id, sale_ids: Iterable) -> int:
+    """Suma las ventas `sale_ids` (ya insertadas) a los agregados, dentro de la transacción del
+    llamante: la venta y sus agregados se confirman juntos. Devuelve cuántas ventas se sumaron."""
+    cur.execute(APPLY_SALES_QUERY, {'tenant_id': str(tenant_id), 'sale_ids': [str(sale_id) for sale_id in sale_ids]})
+    return cur.fetchone()[0]
+
+
+def rebuild(db_connection, tenant_id: Optional[str] = None) -> int:
+    """Recalcula desde cero los agregados de un tenant (o de todos). Devuelve cuántas ventas se agregaron."""
+    tenant = str(tenant_id) if tenant_id else None
+    with db_connection.cursor() as cur:
+        for table in ROLLUP_TABLES:
+            cur.execute(f"DELETE FROM {table} WHERE %(tenant_id)s::uuid IS NULL OR tenant_id = %(tenant_id)s::uuid;", {'tenant_id': tenant})
+        cur.execute(APPLY_SALES_QUERY, {'tenant_id': tenant, 'sale_ids': None})
+        sales_count = cur.fetchone()[0]
+    db_connection.commit()
+    return sales_count
@@ -0,0 +1,83 @@
+import json
+import argparse
+import uuid
+from dotenv import load_dotenv
+
+from app import database
+from app.services import forecast_backtest
+
+# Carga las variables de entorno
+load_dotenv()
+
+def get_tenant_id(username: str):
+    """Obtiene el tenant_id del usuario indicado."""
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT tenant_id FROM users WHERE username = %s", (username,))
+            record = cur.fetchone()
+    return record[0] if record else None
+
+def format_metric(value, width: int) -> str:
+    """Cifra alineada a la derecha, o 'n/a' si no se pudo calcular (p. ej. MAPE sin ventas en el horizonte)."""
+    return f"{'n/a' if value is None else value:>{width}}"
+
+def print_comparison(rows):
+    for row in rows:
+        flag = f"  ⚠️ REGRESIÓN: {', '.join(row['regressions'])}" if row['regressions'] else ""
+        print(f"\n[{row['config']}]{flag}")
+        for metric, values in row.items():
+            if isinstance(values, dict):
+                print(f"  {metric:<16} {values['before']:>10} -> {values['after']:>10} ({values['delta']:+})")
+
+def run(args):
+    """Carga la serie una vez, ejecuta el backtest y guarda (y opcionalmente compara) el informe."""
+    configs = None
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as fh:
+            configs = json.load(fh)
+
+    database.connect_to_db()
+    try:
+        tenant_id = get_tenant_id(args.username)
+        if not tenant_id:
+            print(f"ERROR: No se encontró al usuario '{args.username}'.")
+            return
+        product_id = None if args.series == "total" else uuid.UUID(args.series)
+        with database.get_db_connection() as conn:
+            series = forecast_backtest.load_series(conn, tenant_id, product_id)
+    finally:
+        database.close_db_connection()
+
+    if series is None:
+        print("ERROR: Datos insuficientes para la serie indicada.")
+        return
+
+    # A partir de aquí no se usa la base de datos
+    report = forecast_backtest.run_backtest(series, configs, args.folds, args.horizon, args.step, args.workers)
+    forecast_backtest.save_results(report, args.output)
+    print(f"\n✅ Backtest de '{report['series']}' ({report['folds']} cortes, {report['horizon']} días) en {report['elapsed_seconds']} s. Informe: {args.output}")
+    for config in report['configs']:
+        summary = config['summary']
+        print(f"  {config['name']:<22} sMAPE {format_metric(summary['smape'], 8)}  MAPE {format_metric(summary['mape'], 8)}  "
+              f"ajuste {format_metric(summary['fit_seconds'], 7)} s  predicción {format_metric(summary['predict_seconds'], 7)} s  "
+              f"memoria {format_metric(summary['max_rss_mb'], 8)} MB")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        print_comparison(forecast_backtest.compare_results(baseline, report))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtesting (validación con origen móvil) del pronóstico de ventas.")
+    parser.add_argument("username", type=str, help="Usuario cuyo tenant se va a evaluar.")
+    parser.add_argument("--series", type=str, default="total", help="'total' o el UUID de un producto. Por defecto: total.")
+    parser.add_argument("--folds", type=int, default=4, help="Número de cortes. Por defecto: 4.")
+    parser.add_argument("--horizon", type=int, default=30, help="Días a predecir en cada corte. Por defecto: 30.")
+    parser.add_argument("--step", type=int, default=None, help="Días entre cortes. Por defecto: el horizonte.")
+    parser.add_argument("--configs", type=str, default=None, help="JSON con la lista de configuraciones a comparar.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo. Por defecto: uno por núcleo.")
+    parser.add_argument("--output", type=str, default="backtest_results.json", help="Fichero del informe JSON.")
+    parser.add_argument("--compare", type=str, default=None, help="Informe anterior con el que comparar.")
+    args = parser.parse_args()
+
+    run(args)
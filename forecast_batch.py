@@ -0,0 +1,44 @@
+import argparse
+from dotenv import load_dotenv
+
+from app import database
+from app.migrations import apply_migrations
+from app.services import advanced_forecast
+
+# Carga las variables de entorno
+load_dotenv()
+
+def get_tenant_id(username: str):
+    """Obtiene el tenant_id del usuario indicado."""
+    with database.get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT tenant_id FROM users WHERE username = %s", (username,))
+            record = cur.fetchone()
+    return record[0] if record else None
+
+def run(username: str, periods: int, workers: int, only_changed: bool):
+    """Lanza el pronóstico masivo de todo el catálogo del tenant del usuario."""
+    database.connect_to_db()
+    apply_migrations()
+    try:
+        tenant_id = get_tenant_id(username)
+        if not tenant_id:
+            print(f"ERROR: No se encontró al usuario '{username}'.")
+            return
+        summary = advanced_forecast.run_batch_forecast(tenant_id, periods, max_workers=workers, only_changed=only_changed)
+        print(f"\n✅ {summary['series_succeeded']}/{summary['series_total']} SKUs pronosticados en {summary['elapsed_seconds']} s "
+              f"({summary['skus_per_second']} SKUs/s), {summary['series_skipped']} sin cambios. Ejecución: {summary['run_id']}")
+    except Exception as e:
+        print(f"\n--- ERROR EN EL PRONÓSTICO MASIVO ---: {e}")
+    finally:
+        database.close_db_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera los pronósticos de todos los productos de un tenant.")
+    parser.add_argument("username", type=str, help="Usuario cuyo tenant se va a pronosticar.")
+    parser.add_argument("--periods", type=int, default=90, help="Días a pronosticar. Por defecto: 90.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos en paralelo. Por defecto: uno por núcleo.")
+    parser.add_argument("--only-changed", action="store_true", help="Solo las series con datos nuevos (ejecución nocturna).")
+    args = parser.parse_args()
+
+    run(args.username, args.periods, args.workers, args.only_changed)
@@ -0,0 +1,43 @@
+import argparse
+from datetime import date
+from dotenv import load_dotenv
+
+from app import database
+from app.migrations import apply_migrations
+from app.services import forecast_precompute
+
+# Carga las variables de entorno
+load_dotenv()
+
+def run(args):
+    """Precalcula los pronósticos de todos los tenants (o de una partición) para la fecha indicada."""
+    database.connect_to_db()
+    apply_migrations()
+    try:
+        results = forecast_precompute.run_precompute(
+            run_date=date.fromisoformat(args.run_date) if args.run_date else None,
+            shard_index=args.shard,
+            shard_count=args.shards,
+            periods=args.periods,
+            max_workers=args.workers,
+            force=args.force,
+        )
+        print(f"\n✅ Precálculo {results['run_date']}: {len(results['completed'])} tenants completados, {len(results['failed'])} con errores.")
+        for tenant_id, error in results['failed'].items():
+            print(f"  ❌ {tenant_id}: {error}")
+    except Exception as e:
+        print(f"\n--- ERROR EN EL PRECÁLCULO DE PRONÓSTICOS ---: {e}")
+    finally:
+        database.close_db_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precálculo nocturno de los pronósticos de todos los tenants (reanudable).")
+    parser.add_argument("--run-date", type=str, default=None, help="Fecha de la ejecución (AAAA-MM-DD). Relanzar con la misma fecha la reanuda. Por defecto: hoy.")
+    parser.add_argument("--shard", type=int, default=0, help="Partición que atiende este proceso (desde 0). Por defecto: 0.")
+    parser.add_argument("--shards", type=int, default=1, help="Número total de particiones. Por defecto: 1.")
+    parser.add_argument("--periods", type=int, default=90, help="Días a pronosticar. Por defecto: 90.")
+    parser.add_argument("--workers", type=int, default=None, help="Procesos para Prophet. Por defecto: uno por núcleo.")
+    parser.add_argument("--force", action="store_true", help="Recalcula también las series sin datos nuevos.")
+    args = parser.parse_args()
+
+    run(args)
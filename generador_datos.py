@@ -15,6 +15,10 @@ from passlib.context import CryptContext
 from sqlalchemy import create_engine
 import importlib.util
 
+from app import database
+from app.migrations import apply_migrations
+from app.services import sales_rollups
+
 # --- 1. CONFIGURACIÓN INICIAL ---
 print("🚀 Iniciando el generador de datos DEFINITIVO para GrapeIQ...")
 
@@ -370,6 +374,18 @@ try:
         if sale_details_to_insert: execute_values(cur, "INSERT INTO sale_details (id, sale_id, product_id, quantity, unit_price, tenant_id, on_promotion, discount_percentage) VALUES %s", sale_details_to_insert)
 
     conn.commit()
+
+    # El DROP ... CASCADE borra también las vistas materializadas, los triggers e índices de las
+    # migraciones, y los agregados de ventas se crean vacíos: se restauran sobre los datos nuevos.
+    print("\n🔧 Aplicando migraciones y recalculando los agregados de ventas...")
+    database.connect_to_db()
+    try:
+        apply_migrations()
+    finally:
+        database.close_db_connection()
+    sales_count = sales_rollups.rebuild(conn)
+    print(f"   ...agregados recalculados: {sales_count} ventas.")
+
     print("\n🎉 ¡Proceso completado! La base de datos está lista con datos de CANALES y EVENTOS.")
     print(f"\n🔑 Usuario: {admin_user} / Contraseña: {admin_pass}")
 
@@ -5,6 +5,10 @@ import pandas as pd
 from dotenv import load_dotenv
 from datetime import date
 
+from app import database
+from app.migrations import apply_migrations
+from app.services import sales_rollups
+
 # Carga las variables de entorno
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -87,6 +91,15 @@ def preload_data_for_user(username: str, csv_path: str):
                 print(f"Lote #{i+1} insertado.")
 
         conn.commit()
+
+        # Los endpoints de analítica leen los agregados de ventas: se recalculan para este tenant
+        database.connect_to_db()
+        try:
+            apply_migrations()
+        finally:
+            database.close_db_connection()
+        sales_count = sales_rollups.rebuild(conn, tenant_id)
+        print(f"Agregados de ventas recalculados: {sales_count} ventas.")
         print("\n✅ ¡Precarga de datos completada con éxito!")
 
     except Exception as e:
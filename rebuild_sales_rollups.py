@@ -0,0 +1,29 @@
+import argparse
+from dotenv import load_dotenv
+
+from app import database
+from app.migrations import apply_migrations
+from app.services import sales_rollups
+
+# Carga las variables de entorno
+load_dotenv()
+
+def run(args):
+    """Recalcula desde cero los agregados de ventas de un tenant o de todos (cargas históricas, correcciones)."""
+    database.connect_to_db()
+    apply_migrations()
+    try:
+        with database.get_db_connection() as conn:
+            sales_count = sales_rollups.rebuild(conn, args.tenant)
+        print(f"\n✅ Agregados de ventas recalculados {'del tenant ' + args.tenant if args.tenant else 'de todos los tenants'}: {sales_count} ventas.")
+    except Exception as e:
+        print(f"\n--- ERROR RECALCULANDO LOS AGREGADOS DE VENTAS ---: {e}")
+    finally:
+        database.close_db_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstrucción de los agregados de ventas (diario, mensual, día de la semana, producto y cliente).")
+    parser.add_argument("--tenant", type=str, default=None, help="ID del tenant a recalcular. Por defecto: todos.")
+    args = parser.parse_args()
+
+    run(args)
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Cada medición se ejecuta en un intérprete nuevo para que el arranque sea realmente en frío.
+# Las etapas se encadenan dentro del mismo proceso: importar la API, cargar el módulo de
+# pronóstico (pandas/numpy) y precalentar Prophet, midiendo tiempo y memoria tras cada una.
+PROBE = r"""
+import sys, json, time, resource
+
+def rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+stages = []
+def stage(name, fn):
+    started = time.perf_counter()
+    fn()
+    stages.append({'stage': name, 'seconds': round(time.perf_counter() - started, 3), 'max_rss_mb': rss_mb()})
+
+stage('import app.main', lambda: __import__('app.main'))
+if WARMUP_STAGES:
+    import importlib
+    stage('carga de advanced_forecast', lambda: importlib.import_module('app.services.advanced_forecast').PROPHET_PARAMS)
+    stage('precalentamiento de Prophet', lambda: importlib.import_module('app.services.advanced_forecast').warm_up())
+print(json.dumps({'modules': len(sys.modules), 'stages': stages}))
+"""
+
+def measure(warmup_stages: bool) -> dict:
+    code = f"WARMUP_STAGES = {warmup_stages}\n{PROBE}"
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def run(args):
+    """Mide el arranque en frío de la API y el coste del stack de pronóstico por proceso."""
+    runs = [measure(not args.api_only) for _ in range(args.repeat)]
+    report = {'python': sys.version.split()[0], 'repeat': args.repeat, 'runs': runs}
+
+    print(f"\n⏱️  Arranque en frío ({args.repeat} ejecuciones, mediana):")
+    for i, first in enumerate(runs[0]['stages']):
+        seconds = sorted(run['stages'][i]['seconds'] for run in runs)[len(runs) // 2]
+        rss = sorted(run['stages'][i]['max_rss_mb'] for run in runs)[len(runs) // 2]
+        print(f"  {first['stage']:<30} {seconds:>8} s   RSS {rss:>8} MB")
+    print(f"  Módulos cargados tras la última etapa: {runs[0]['modules']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2, ensure_ascii=False)
+        print(f"Informe: {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de arranque: tiempo en frío y memoria (RSS) por proceso.")
+    parser.add_argument("--repeat", type=int, default=3, help="Número de arranques a medir. Por defecto: 3.")
+    parser.add_argument("--api-only", action="store_true", help="Mide solo la importación de la API, sin el stack de pronóstico.")
+    parser.add_argument("--output", type=str, default=None, help="Fichero JSON donde guardar el informe.")
+    args = parser.parse_args()
+
+    run(args)